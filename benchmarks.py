@@ -23,15 +23,27 @@ Requirements:
 
 Usage:
     $ python benchmarks.py --weights yolov5s.pt --img 640
+    $ python benchmarks.py --weights yolov5s.pt --img 640 --device cpu --int8  # FP32 vs calibrated INT8 on CPU
+
+Sweep (synthetic inputs, no dataset needed):
+    $ python benchmarks.py --sweep --weights yolov5s.pt --device cpu --batch-size 1 8 --img 320 640 --threads 1 4
+    $ python benchmarks.py --sweep ... --baseline runs/benchmarks/sweep.json --max-regression 0.1  # fail if >10% slower
 """
 
 import argparse
+import contextlib
+import itertools
+import json
+import os
 import platform
 import sys
 import time
+from datetime import datetime
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import torch
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # YOLOv5 root directory
@@ -40,12 +52,15 @@ if str(ROOT) not in sys.path:
 # ROOT = ROOT.relative_to(Path.cwd())  # relative
 
 import export
+from models.common import DetectMultiBackend
 from models.experimental import attempt_load
 from models.yolo import SegmentationModel
 from segment.val import run as val_seg
 from utils import notebook_init
-from utils.general import LOGGER, check_yaml, file_size, print_args
-from utils.torch_utils import select_device
+from utils.augmentations import letterbox
+from utils.general import (LOGGER, check_img_size, check_yaml, file_size, get_default_args, non_max_suppression,
+                           print_args)
+from utils.torch_utils import select_device, smart_inference_mode, time_sync
 from val import run as val_det
 
 
@@ -59,40 +74,45 @@ def run(
         test=False,  # test exports only
         pt_only=False,  # test PyTorch only
         hard_fail=False,  # throw error on benchmark failure
+        int8=False,  # also benchmark INT8 quantized ONNX and OpenVINO models
 ):
     y, t = [], time.time()
     device = select_device(device)
     model_type = type(attempt_load(weights, fuse=False))  # DetectionModel, SegmentationModel, etc.
     for i, (name, f, suffix, cpu, gpu) in export.export_formats().iterrows():  # index, (name, file, suffix, CPU, GPU)
-        try:
-            assert i not in (9, 10), 'inference not supported'  # Edge TPU and TF.js are unsupported
-            assert i != 5 or platform.system() == 'Darwin', 'inference only supported on macOS>=10.13'  # CoreML
-            if 'cpu' in device.type:
-                assert cpu, 'inference not supported on CPU'
-            if 'cuda' in device.type:
-                assert gpu, 'inference not supported on GPU'
-
-            # Export
-            if f == '-':
-                w = weights  # PyTorch format
-            else:
-                w = export.run(weights=weights, imgsz=[imgsz], include=[f], device=device, half=half)[-1]  # all others
-            assert suffix in str(w), 'export failed'
+        for q in (False, True) if int8 and f in ('onnx', 'openvino') else (False,):  # INT8 next to FP32
+            n = f'{name} INT8' if q else name
+            try:
+                assert i not in (9, 10), 'inference not supported'  # Edge TPU and TF.js are unsupported
+                assert i != 5 or platform.system() == 'Darwin', 'inference only supported on macOS>=10.13'  # CoreML
+                if 'cpu' in device.type:
+                    assert cpu, 'inference not supported on CPU'
+                if 'cuda' in device.type:
+                    assert gpu, 'inference not supported on GPU'
 
-            # Validate
-            if model_type == SegmentationModel:
-                result = val_seg(data, w, batch_size, imgsz, plots=False, device=device, task='speed', half=half)
-                metric = result[0][7]  # (box(p, r, map50, map), mask(p, r, map50, map), *loss(box, obj, cls))
-            else:  # DetectionModel:
-                result = val_det(data, w, batch_size, imgsz, plots=False, device=device, task='speed', half=half)
-                metric = result[0][3]  # (p, r, map50, map, *loss(box, obj, cls))
-            speed = result[2][1]  # times (preprocess, inference, postprocess)
-            y.append([name, round(file_size(w), 1), round(metric, 4), round(speed, 2)])  # MB, mAP, t_inference
-        except Exception as e:
-            if hard_fail:
-                assert type(e) is AssertionError, f'Benchmark --hard-fail for {name}: {e}'
-            LOGGER.warning(f'WARNING ⚠️ Benchmark failure for {name}: {e}')
-            y.append([name, None, None, None])  # mAP, t_inference
+                # Export
+                if f == '-':
+                    w = weights  # PyTorch format
+                else:
+                    w = export.run(weights=weights, imgsz=[imgsz], include=[f], device=device, half=half, int8=q,
+                                   data=data)[-1]  # all others
+                assert suffix in str(w), 'export failed'
+                assert not q or 'int8' in str(w), 'INT8 quantization failed'
+
+                # Validate
+                if model_type == SegmentationModel:
+                    result = val_seg(data, w, batch_size, imgsz, plots=False, device=device, task='speed', half=half)
+                    metric = result[0][7]  # (box(p, r, map50, map), mask(p, r, map50, map), *loss(box, obj, cls))
+                else:  # DetectionModel:
+                    result = val_det(data, w, batch_size, imgsz, plots=False, device=device, task='speed', half=half)
+                    metric = result[0][3]  # (p, r, map50, map, *loss(box, obj, cls))
+                speed = result[2][1]  # times (preprocess, inference, postprocess)
+                y.append([n, round(file_size(w), 1), round(metric, 4), round(speed, 2)])  # MB, mAP, t_inference
+            except Exception as e:
+                if hard_fail:
+                    assert type(e) is AssertionError, f'Benchmark --hard-fail for {n}: {e}'
+                LOGGER.warning(f'WARNING ⚠️ Benchmark failure for {n}: {e}')
+                y.append([n, None, None, None])  # mAP, t_inference
         if pt_only and i == 0:
             break  # break after PyTorch
 
@@ -143,17 +163,141 @@ def test(
     return py
 
 
+def peak_rss(reset=False):
+    # Peak resident set size of this process in MB, reset=True restarts the high-water mark (Linux only)
+    status = Path('/proc/self/status')
+    if status.exists():
+        if reset:
+            with contextlib.suppress(OSError):
+                Path('/proc/self/clear_refs').write_text('5')  # reset VmHWM
+        return next(int(x.split()[1]) for x in status.read_text().splitlines() if x.startswith('VmHWM')) / 1024
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** (20 if platform.system() == 'Darwin' else 10)
+    except ImportError:  # Windows
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+
+
+def compare(results, baseline, max_regression=0.1, metrics=('inference_p50', 'total_p50', 'rss_mb')):
+    # Compare sweep results to a baseline sweep .json, return the metrics that regressed by more than max_regression
+    key = lambda x: (x['batch_size'], x['imgsz'], x['threads'])  # noqa: E731
+    base = {key(x): x for x in json.loads(Path(baseline).read_text())['results']}
+    failures = []
+    for r in results:
+        b = base.get(key(r), {})
+        for m in metrics:
+            if r.get(m) and b.get(m) and r[m] / b[m] - 1 > max_regression:
+                failures.append(f'batch {r["batch_size"]}, imgsz {r["imgsz"]}, threads {r["threads"]}: '
+                                f'{m} {b[m]:.2f} -> {r[m]:.2f} (+{r[m] / b[m] - 1:.0%})')
+    return failures
+
+
+@smart_inference_mode()
+def sweep(
+        weights=ROOT / 'yolov5s.pt',  # weights path, any DetectMultiBackend format
+        imgsz=(640,),  # inference sizes (pixels)
+        batch_size=(1,),  # batch sizes
+        threads=(0,),  # torch intra-op threads, 0 for the default
+        device='',  # cuda device, i.e. 0 or 0,1,2,3 or cpu
+        half=False,  # use FP16 half-precision inference
+        iters=30,  # timed iterations per configuration
+        warmup=3,  # untimed iterations per configuration
+        shape=(720, 1280),  # synthetic source image (height, width)
+        conf_thres=0.25,  # NMS confidence threshold
+        iou_thres=0.45,  # NMS IoU threshold
+        max_det=1000,  # NMS maximum detections per image
+        output=ROOT / 'runs/benchmarks/sweep',  # results path, saved as *.json and *.csv
+        baseline=None,  # baseline *.json from a previous sweep
+        max_regression=0.1,  # fail if slower than baseline by more than this fraction
+):
+    # Latency percentiles, throughput and peak memory of preprocess, inference and NMS over batch, imgsz and threads
+    y, t = [], time.time()
+    device = select_device(device)
+    n = torch.get_num_threads()
+    rng = np.random.default_rng(0)
+    stages = 'preprocess', 'inference', 'nms', 'total'
+    for k in threads:
+        torch.set_num_threads(k or n)
+        model = DetectMultiBackend(weights, device=device, fp16=half)  # reload, ONNX Runtime reads threads at load
+        for b, s in itertools.product(batch_size, imgsz):
+            s = check_img_size(s, s=model.stride)
+            r = {'weights': Path(weights).name, 'batch_size': b, 'imgsz': s, 'threads': torch.get_num_threads()}
+            try:
+                ims = rng.integers(0, 256, (b, *shape, 3), dtype=np.uint8)  # synthetic BGR frames
+                dt = {x: [] for x in stages}
+                peak_rss(reset=True)
+                for i in range(warmup + iters):
+                    t0 = time_sync()
+                    im = np.stack([letterbox(x, s, stride=model.stride, auto=False)[0] for x in ims])
+                    im = torch.from_numpy(np.ascontiguousarray(im.transpose((0, 3, 1, 2))[:, ::-1])).to(model.device)
+                    im = (im.half() if model.fp16 else im.float()) / 255  # uint8 to fp16/32, 0 - 255 to 0.0 - 1.0
+                    t1 = time_sync()
+                    pred = model(im)
+                    t2 = time_sync()
+                    non_max_suppression(pred, conf_thres, iou_thres, max_det=max_det)
+                    t3 = time_sync()
+                    if i >= warmup:
+                        for x, v in zip(stages, (t1 - t0, t2 - t1, t3 - t2, t3 - t0)):
+                            dt[x].append(v * 1E3)  # ms
+                for x, v in dt.items():
+                    for p, v50 in zip((50, 95, 99), np.percentile(v, (50, 95, 99))):
+                        r[f'{x}_p{p}'] = round(float(v50), 2)  # ms
+                    r[f'{x}_ips'] = round(b * 1E3 / float(np.mean(v)), 2)  # images/s
+                r['rss_mb'] = round(peak_rss(), 1)
+            except Exception as e:
+                LOGGER.warning(f'WARNING ⚠️ Benchmark failure for batch {b}, imgsz {s}, threads {r["threads"]}: {e}')
+                r['error'] = str(e)
+            y.append(r)
+    torch.set_num_threads(n)
+
+    # Save results
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    info = {
+        'weights': str(weights),
+        'device': str(device),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'iters': iters}
+    output.with_suffix('.json').write_text(json.dumps({**info, 'results': y}, indent=2))
+    py = pd.DataFrame(y)
+    py.to_csv(output.with_suffix('.csv'), index=False)
+
+    # Print results
+    c = [x for x in py.columns if x.endswith(('_p50', '_p99', '_ips')) and not x.startswith('preprocess')]
+    LOGGER.info(f'\nBenchmarks complete ({time.time() - t:.2f}s), saved to {output.with_suffix(".json")} and .csv')
+    LOGGER.info(py[[x for x in ('batch_size', 'imgsz', 'threads', *c, 'rss_mb') if x in py]].to_string(index=False))
+    if baseline:
+        failures = compare(y, baseline, max_regression)
+        for f in failures:
+            LOGGER.warning(f'WARNING ⚠️ Regression {f}')
+        assert not failures, f'REGRESSION: {len(failures)} metrics > {max_regression:.0%} slower than {baseline}'
+        LOGGER.info(f'No regressions > {max_regression:.0%} against {baseline}')
+    return py
+
+
 def parse_opt():
     parser = argparse.ArgumentParser()
     parser.add_argument('--weights', type=str, default=ROOT / 'yolov5s.pt', help='weights path')
-    parser.add_argument('--imgsz', '--img', '--img-size', type=int, default=640, help='inference size (pixels)')
-    parser.add_argument('--batch-size', type=int, default=1, help='batch size')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[640], help='inference size(s)')
+    parser.add_argument('--batch-size', nargs='+', type=int, default=[1], help='batch size(s)')
     parser.add_argument('--data', type=str, default=ROOT / 'data/coco128.yaml', help='dataset.yaml path')
     parser.add_argument('--device', default='', help='cuda device, i.e. 0 or 0,1,2,3 or cpu')
     parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
     parser.add_argument('--test', action='store_true', help='test exports only')
     parser.add_argument('--pt-only', action='store_true', help='test PyTorch only')
+    parser.add_argument('--int8', action='store_true', help='benchmark INT8 ONNX and OpenVINO next to FP32')
     parser.add_argument('--hard-fail', nargs='?', const=True, default=False, help='Exception on error or < min metric')
+    parser.add_argument('--sweep', action='store_true', help='latency sweep over --batch-size, --imgsz and --threads')
+    parser.add_argument('--threads', nargs='+', type=int, default=[0], help='--sweep intra-op threads, 0 for default')
+    parser.add_argument('--iters', type=int, default=30, help='--sweep timed iterations per configuration')
+    parser.add_argument('--warmup', type=int, default=3, help='--sweep warmup iterations per configuration')
+    parser.add_argument('--output', type=str, default=ROOT / 'runs/benchmarks/sweep', help='--sweep *.json/*.csv path')
+    parser.add_argument('--baseline', type=str, default=None, help='--sweep baseline *.json to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.1, help='--sweep allowed slowdown vs baseline')
     opt = parser.parse_args()
     opt.data = check_yaml(opt.data)  # check YAML
     print_args(vars(opt))
@@ -161,7 +305,10 @@ def parse_opt():
 
 
 def main(opt):
-    test(**vars(opt)) if opt.test else run(**vars(opt))
+    f = sweep if opt.sweep else test if opt.test else run
+    if not opt.sweep:
+        opt.imgsz, opt.batch_size = opt.imgsz[0], opt.batch_size[0]  # lists are swept with --sweep only
+    f(**{k: v for k, v in vars(opt).items() if k in get_default_args(f)})
 
 
 if __name__ == "__main__":
@@ -122,9 +122,10 @@ def run(
         # Process predictions
         for i, prob in enumerate(pred):  # per image
             seen += 1
-            if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
-                s += f'{i}: '
+            vi = i  # video writer index
+            if webcam:  # batch_size >= 1, streams without a new frame are skipped
+                p, im0, frame, vi = path[i], im0s[i].copy(), dataset.count, dataset.indices[i]
+                s += f'{vi}: '
             else:
                 p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
 
@@ -162,10 +163,10 @@ def run(
                 if dataset.mode == 'image':
                     cv2.imwrite(save_path, im0)
                 else:  # 'video' or 'stream'
-                    if vid_path[i] != save_path:  # new video
-                        vid_path[i] = save_path
-                        if isinstance(vid_writer[i], cv2.VideoWriter):
-                            vid_writer[i].release()  # release previous video writer
+                    if vid_path[vi] != save_path:  # new video
+                        vid_path[vi] = save_path
+                        if isinstance(vid_writer[vi], cv2.VideoWriter):
+                            vid_writer[vi].release()  # release previous video writer
                         if vid_cap:  # video
                             fps = vid_cap.get(cv2.CAP_PROP_FPS)
                             w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
@@ -173,8 +174,8 @@ def run(
                         else:  # stream
                             fps, w, h = 30, im0.shape[1], im0.shape[0]
                         save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
-                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
-                    vid_writer[i].write(im0)
+                        vid_writer[vi] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+                    vid_writer[vi].write(im0)
 
         # Print time (inference-only)
         LOGGER.info(f"{s}{dt[1].dt * 1E3:.1f}ms")
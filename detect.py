@@ -30,8 +30,11 @@ import argparse
 import os
 import platform
 import sys
+import time
 from pathlib import Path
+from types import SimpleNamespace
 
+import numpy as np
 import torch
 
 FILE = Path(__file__).resolve()
@@ -41,11 +44,14 @@ if str(ROOT) not in sys.path:
 ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
-from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
+from utils.dataloaders import (IMG_FORMATS, VID_FORMATS, LoadBatches, LoadImages, LoadScreenshots, LoadStreams,
+                               video_props)
 from utils.general import (LOGGER, Profile, check_file, check_img_size, check_imshow, check_requirements, colorstr, cv2,
                            increment_path, non_max_suppression, print_args, scale_boxes, strip_optimizer, xyxy2xywh)
 from utils.plots import Annotator, colors, save_one_box
+from utils.postprocess import non_max_suppression as numpy_non_max_suppression
 from utils.torch_utils import select_device, smart_inference_mode
+from utils.workers import InferencePool
 
 
 @smart_inference_mode()
@@ -76,7 +82,14 @@ def run(
         hide_conf=False,  # hide confidences
         half=False,  # use FP16 half-precision inference
         dnn=False,  # use OpenCV DNN for ONNX inference
+        model_cache=False,  # load *.pt weights pre-fused from the model cache
+        numpy_nms=False,  # NumPy inputs, outputs and utils/postprocess NMS for ONNX, OpenVINO, TF and Paddle models
         vid_stride=1,  # video frame-rate stride
+        prefetch=0,  # number of images to decode ahead in background threads, 0 to disable
+        batch_size=1,  # batch size for image/video sources
+        max_age=0.0,  # skip stream frames older than max_age seconds, 0 to disable
+        workers=0,  # CPU inference worker processes pinned to core subsets, 0 for in-process inference
+        threads=0,  # intra-op threads per worker, 0 for its share of cores
 ):
     source = str(source)
     save_img = not nosave and not source.endswith('.txt')  # save inference images
@@ -93,57 +106,113 @@ def run(
 
     # Load model
     device = select_device(device)
-    model = DetectMultiBackend(weights, device=device, dnn=dnn, data=data, fp16=half)
+    model = DetectMultiBackend(weights,
+                               device=device,
+                               dnn=dnn,
+                               data=data,
+                               fp16=half,
+                               cache=model_cache,
+                               numpy=numpy_nms)
+    if numpy_nms and not model.numpy:
+        LOGGER.warning('WARNING ⚠️ --numpy-nms needs an ONNX, OpenVINO, TensorFlow or PaddlePaddle model, using torch')
     stride, names, pt = model.stride, model.names, model.pt
     imgsz = check_img_size(imgsz, s=stride)  # check image size
 
     # Dataloader
     bs = 1  # batch_size
+    batched = False  # LoadImages frames grouped into batches
     if webcam:
         view_img = check_imshow(warn=True)
-        dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
+        dataset = LoadStreams(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride, max_age=max_age)
         bs = len(dataset)
     elif screenshot:
         dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
     else:
-        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
+        batched = batch_size > 1
+        auto = pt and not batched  # batches share one letterbox shape
+        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=auto, vid_stride=vid_stride, prefetch=prefetch)
+        if batched:
+            bs = batch_size
+            dataset = LoadBatches(dataset, batch_size=bs)
     vid_path, vid_writer = [None] * bs, [None] * bs
 
     # Run inference
     model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
     seen, windows, dt = 0, [], (Profile(), Profile(), Profile())
-    for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
-            im = torch.from_numpy(im).to(model.device)
-            im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
-            im /= 255  # 0 - 255 to 0.0 - 1.0
-            if len(im.shape) == 3:
-                im = im[None]  # expand for batch dim
+    pool = None
+    # Video (fps, w, h) per frame, read before LoadImages releases the capture after a video's last frame
+    frames = dataset if batched else ((*x[:3], video_props(x[3]), x[4]) for x in dataset)
+    if workers:  # replicas run inference and NMS ahead of this loop, so snapshot dataset state with each item
+        pool = InferencePool(weights,
+                             workers,
+                             threads,
+                             imgsz,
+                             bs,
+                             conf_thres,
+                             iou_thres,
+                             classes,
+                             agnostic_nms,
+                             max_det,
+                             dnn=dnn,
+                             data=data,
+                             fp16=half)
+        items = ((x, SimpleNamespace(**vars(dataset))) for x in frames)
+        stream = ((x, ds, pred) for (x, ds), pred in pool.imap(items, fn=lambda x: x[0][1]))
+        t0 = time.time()
+    else:
+        stream = ((x, dataset, None) for x in frames)
+    for (path, im, im0s, vid_props, s), ds, pred in stream:
+        ss = s  # per-image strings for batched sources
+        if pool:
+            im = im[None] if im.ndim == 3 else im  # only the shape is used below
+        else:
+            with dt[0]:
+                if model.numpy:  # stays NumPy through inference and NMS
+                    im = im.astype(np.float16 if model.fp16 else np.float32)  # uint8 to fp16/32
+                else:
+                    im = torch.from_numpy(im).to(model.device)
+                    im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
+                im /= 255  # 0 - 255 to 0.0 - 1.0
+                if len(im.shape) == 3:
+                    im = im[None]  # expand for batch dim
 
-        # Inference
-        with dt[1]:
-            visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
-            pred = model(im, augment=augment, visualize=visualize)
+            # Inference
+            with dt[1]:
+                p = path[0] if isinstance(path, list) else path  # first image of batch
+                visualize = increment_path(save_dir / Path(p).stem, mkdir=True) if visualize else False
+                pred = model(im, augment=augment, visualize=visualize)
 
-        # NMS
-        with dt[2]:
-            pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
+            # NMS
+            with dt[2]:
+                if model.numpy:
+                    pred = numpy_non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms,
+                                                     max_det=max_det)
+                    pred = [torch.from_numpy(x) for x in pred]  # for the result handling below
+                else:
+                    pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det,
+                                               batched=bs > 1)
 
         # Second-stage classifier (optional)
         # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
 
         # Process predictions
+        # Inference time per image, in-process only
+        ms = '' if pool else f'{dt[1].dt * 1E3 / (len(pred) if batched else 1):.1f}ms'
         for i, det in enumerate(pred):  # per image
             seen += 1
-            if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
-                s += f'{i}: '
+            mode, props, vi = ds.mode, vid_props, i  # source mode, video (fps, w, h), video writer index
+            if webcam:  # batch_size >= 1, streams without a new frame are skipped
+                p, im0, frame, vi = path[i], im0s[i].copy(), ds.count, ds.indices[i]
+                s += f'{vi}: '
+            elif batched:  # consecutive frames of one source share a video writer
+                p, im0, frame, s = path[i], im0s[i].copy(), ds.frames[i], ss[i]
+                mode, props, vi = ds.modes[i], vid_props[i], 0
             else:
-                p, im0, frame = path, im0s.copy(), getattr(dataset, 'frame', 0)
+                p, im0, frame = path, im0s.copy(), getattr(ds, 'frame', 0)
 
             p = Path(p)  # to Path
             save_path = str(save_dir / p.name)  # im.jpg
-            txt_path = str(save_dir / 'labels' / p.stem) + ('' if dataset.mode == 'image' else f'_{frame}')  # im.txt
+            txt_path = str(save_dir / 'labels' / p.stem) + ('' if mode == 'image' else f'_{frame}')  # im.txt
             s += '%gx%g ' % im.shape[2:]  # print string
             gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
             imc = im0.copy() if save_crop else im0  # for save_crop
@@ -184,32 +253,40 @@ def run(
 
             # Save results (image with detections)
             if save_img:
-                if dataset.mode == 'image':
+                if mode == 'image':
                     cv2.imwrite(save_path, im0)
                 else:  # 'video' or 'stream'
-                    if vid_path[i] != save_path:  # new video
-                        vid_path[i] = save_path
-                        if isinstance(vid_writer[i], cv2.VideoWriter):
-                            vid_writer[i].release()  # release previous video writer
-                        if vid_cap:  # video
-                            fps = vid_cap.get(cv2.CAP_PROP_FPS)
-                            w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                            h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                    if vid_path[vi] != save_path:  # new video
+                        vid_path[vi] = save_path
+                        if isinstance(vid_writer[vi], cv2.VideoWriter):
+                            vid_writer[vi].release()  # release previous video writer
+                        if props:  # video
+                            fps, w, h = props
                         else:  # stream
                             fps, w, h = 30, im0.shape[1], im0.shape[0]
                         save_path = str(Path(save_path).with_suffix('.mp4'))  # force *.mp4 suffix on results videos
-                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
-                    vid_writer[i].write(im0)
+                        vid_writer[vi] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+                    vid_writer[vi].write(im0)
+
+            # Print time (inference-only), per image for batched sources
+            if batched:
+                LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{ms}")
         key = cv2.waitKey(1)
         if key == 27:
             break
 
         # Print time (inference-only)
-        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
+        if not batched:
+            LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{ms}")
 
     # Print results
-    t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
-    LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(1, 3, *imgsz)}' % t)
+    if pool:
+        pool.close()
+        t = time.time() - t0
+        LOGGER.info(f'Throughput: {seen / t:.1f} images/s with {pool.workers} workers at shape {(bs, 3, *imgsz)}')
+    else:
+        t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
+        LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {(bs, 3, *imgsz)}' % t)
     if save_txt or save_img:
         s = f"\n{len(list(save_dir.glob('labels/*.txt')))} labels saved to {save_dir / 'labels'}" if save_txt else ''
         LOGGER.info(f"Results saved to {colorstr('bold', save_dir)}{s}")
@@ -219,10 +296,14 @@ def run(
 
 def parse_opt():
     parser = argparse.ArgumentParser()
-    parser.add_argument('--weights', nargs='+', type=str, default=ROOT / 'weights/yolov5s.pt', help='model path or triton URL')
+    parser.add_argument('--weights',
+                        nargs='+',
+                        type=str,
+                        default=ROOT / 'weights/yolov5s.pt',
+                        help='model path or triton URL')
     parser.add_argument('--source', type=str, default='0', help='file/dir/URL/glob/screen/0(webcam)')
     parser.add_argument('--data', type=str, default=ROOT / 'data/faces.yaml', help='(optional) dataset.yaml path')
-    parser.add_argument('--imgsz', '--img', '--img-sizepython detect.py --source 0', nargs='+', type=int, default=[640], help='inference size h,w')
+    parser.add_argument('--imgsz', '--img', '--img-size', nargs='+', type=int, default=[640], help='inference size h,w')
     parser.add_argument('--conf-thres', type=float, default=0.2, help='confidence threshold')
     parser.add_argument('--iou-thres', type=float, default=0.45, help='NMS IoU threshold')
     parser.add_argument('--max-det', type=int, default=1000, help='maximum detections per image')
@@ -245,7 +326,14 @@ def parse_opt():
     parser.add_argument('--hide-conf', default=False, action='store_true', help='hide confidences')
     parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
     parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--numpy-nms', action='store_true', help='NumPy inference and NMS for ONNX/OpenVINO/TF/Paddle')
+    parser.add_argument('--model-cache', action='store_true', help='load *.pt weights pre-fused from the model cache')
     parser.add_argument('--vid-stride', type=int, default=1, help='video frame-rate stride')
+    parser.add_argument('--prefetch', type=int, default=0, help='number of images to decode ahead, 0 to disable')
+    parser.add_argument('--batch-size', type=int, default=1, help='batch size for image/video sources')
+    parser.add_argument('--workers', type=int, default=0, help='CPU inference worker processes, 0 for in-process')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads per worker, 0 for its share of cores')
+    parser.add_argument('--max-age', type=float, default=0.0, help='skip stream frames older than seconds, 0 disables')
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -23,12 +23,15 @@ Requirements:
 
 Usage:
     $ python export.py --weights yolov5s.pt --include torchscript onnx openvino engine coreml tflite ...
+    $ python export.py --weights yolov5s.pt --include onnx openvino --int8 --data coco128.yaml  # INT8 for CPU
 
 Inference:
     $ python detect.py --weights yolov5s.pt                 # PyTorch
                                  yolov5s.torchscript        # TorchScript
                                  yolov5s.onnx               # ONNX Runtime or OpenCV DNN with --dnn
+                                 yolov5s-int8.onnx          # ONNX Runtime INT8
                                  yolov5s_openvino_model     # OpenVINO
+                                 yolov5s_int8_openvino_model  # OpenVINO INT8
                                  yolov5s.engine             # TensorRT
                                  yolov5s.mlmodel            # CoreML (macOS-only)
                                  yolov5s_saved_model        # TensorFlow SavedModel
@@ -56,9 +59,7 @@ import time
 import warnings
 from pathlib import Path
 
-import pandas as pd
 import torch
-from torch.utils.mobile_optimizer import optimize_for_mobile
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[0]  # YOLOv5 root directory
@@ -69,7 +70,7 @@ if platform.system() != 'Windows':
 
 from models.experimental import attempt_load
 from models.yolo import ClassificationModel, Detect, DetectionModel, SegmentationModel
-from utils.dataloaders import LoadImages
+from utils.dataloaders import LoadCalibration, LoadImages
 from utils.general import (LOGGER, Profile, check_dataset, check_img_size, check_requirements, check_version,
                            check_yaml, colorstr, file_size, get_default_args, print_args, url2file, yaml_save)
 from utils.torch_utils import select_device, smart_inference_mode
@@ -77,8 +78,8 @@ from utils.torch_utils import select_device, smart_inference_mode
 MACOS = platform.system() == 'Darwin'  # macOS environment
 
 
-def export_formats():
-    # YOLOv5 export formats
+def export_formats(df=True):
+    # YOLOv5 export formats, as a pandas DataFrame or as a list of rows if df=False
     x = [
         ['PyTorch', '-', '.pt', True, True],
         ['TorchScript', 'torchscript', '.torchscript', True, True],
@@ -92,6 +93,9 @@ def export_formats():
         ['TensorFlow Edge TPU', 'edgetpu', '_edgetpu.tflite', False, False],
         ['TensorFlow.js', 'tfjs', '_web_model', False, False],
         ['PaddlePaddle', 'paddle', '_paddle_model', True, True],]
+    if not df:
+        return x
+    import pandas as pd  # scoped, pandas is slow to import
     return pd.DataFrame(x, columns=['Format', 'Argument', 'Suffix', 'CPU', 'GPU'])
 
 
@@ -123,6 +127,7 @@ def export_torchscript(model, im, file, optimize, prefix=colorstr('TorchScript:'
     d = {"shape": im.shape, "stride": int(max(model.stride)), "names": model.names}
     extra_files = {'config.txt': json.dumps(d)}  # torch._C.ExtraFilesMap()
     if optimize:  # https://pytorch.org/tutorials/recipes/mobile_interpreter.html
+        from torch.utils.mobile_optimizer import optimize_for_mobile
         optimize_for_mobile(ts)._save_for_lite_interpreter(str(f), _extra_files=extra_files)
     else:
         ts.save(str(f), _extra_files=extra_files)
@@ -186,8 +191,53 @@ def export_onnx(model, im, file, opset, dynamic, simplify, prefix=colorstr('ONNX
 
 
 @try_export
-def export_openvino(file, metadata, half, prefix=colorstr('OpenVINO:')):
-    # YOLOv5 OpenVINO export
+def export_onnx_int8(model, im, file, data, prefix=colorstr('ONNX INT8:')):
+    # YOLOv5 ONNX static INT8 quantization (QDQ), calibrated on dataset.yaml val images
+    check_requirements(('onnx', 'onnxruntime'))
+    import onnx
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    LOGGER.info(f'\n{prefix} starting quantization with onnxruntime {onnxruntime.__version__}...')
+    f_fp32, f = file.with_suffix('.onnx'), Path(str(file).replace('.pt', '-int8.onnx'))
+    model_onnx = onnx.load(f_fp32)
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.data = iter(LoadCalibration(check_dataset(check_yaml(data))['val'], im.shape, prefix=f'{prefix} '))
+
+        def get_next(self):
+            x = next(self.data, None)
+            return None if x is None else {'images': x}
+
+    # Keep the Detect() box decode in FP32, xywh pixels and 0-1 scores share one output and one INT8 scale would not fit
+    producer = {y: x for x in model_onnx.graph.node for y in x.output}
+    exclude, stack = set(), [model_onnx.graph.output[0].name]
+    while stack:  # walk back from output0 to the last Conv layers
+        x = producer.get(stack.pop())
+        if x is not None and x.op_type != 'Conv' and x.name not in exclude:
+            exclude.add(x.name)
+            stack.extend(x.input)
+    quantize_static(f_fp32,
+                    f,
+                    Reader(),
+                    quant_format=QuantFormat.QDQ,
+                    per_channel=True,
+                    activation_type=QuantType.QUInt8,
+                    weight_type=QuantType.QInt8,
+                    nodes_to_exclude=list(exclude))
+
+    # Metadata
+    model_int8 = onnx.load(f)
+    del model_int8.metadata_props[:]
+    model_int8.metadata_props.extend(model_onnx.metadata_props)  # stride, names
+    onnx.save(model_int8, f)
+    return f, model_int8
+
+
+@try_export
+def export_openvino(file, metadata, half, int8=False, data=None, im=None, prefix=colorstr('OpenVINO:')):
+    # YOLOv5 OpenVINO export, optionally INT8 quantized with NNCF and calibrated on dataset.yaml val images
     check_requirements('openvino-dev')  # requires openvino-dev: https://pypi.org/project/openvino-dev/
     import openvino.inference_engine as ie
 
@@ -197,6 +247,23 @@ def export_openvino(file, metadata, half, prefix=colorstr('OpenVINO:')):
     cmd = f"mo --input_model {file.with_suffix('.onnx')} --output_dir {f} --data_type {'FP16' if half else 'FP32'}"
     subprocess.run(cmd.split(), check=True, env=os.environ)  # export
     yaml_save(Path(f) / file.with_suffix('.yaml').name, metadata)  # add metadata.yaml
+
+    if int8:
+        check_requirements('nncf>=2.4.0')  # requires at least version 2.4.0 to use the post-training quantization
+        import nncf
+        from openvino.runtime import Core, serialize
+
+        LOGGER.info(f'{prefix} starting INT8 quantization with nncf {nncf.__version__}...')
+        fp32, f = f, str(file).replace('.pt', f'_int8_openvino_model{os.sep}')
+        ov_model = Core().read_model(Path(fp32) / file.with_suffix('.xml').name)
+        dataset = LoadCalibration(check_dataset(check_yaml(data))['val'], im.shape, prefix=f'{prefix} ')
+        ov_model = nncf.quantize(ov_model,
+                                 nncf.Dataset(dataset),
+                                 preset=nncf.QuantizationPreset.MIXED,
+                                 subset_size=len(dataset),
+                                 ignored_scope=nncf.IgnoredScope(types=['Multiply', 'Subtract', 'Sigmoid']))  # decode
+        serialize(ov_model, str(Path(f) / file.with_suffix('.xml').name))
+        yaml_save(Path(f) / file.with_suffix('.yaml').name, metadata)  # add metadata.yaml
     return f, None
 
 
@@ -499,7 +566,7 @@ def run(
         inplace=False,  # set YOLOv5 Detect() inplace=True
         keras=False,  # use Keras
         optimize=False,  # TorchScript: optimize for mobile
-        int8=False,  # CoreML/TF INT8 quantization
+        int8=False,  # CoreML/TF/ONNX/OpenVINO INT8 quantization
         dynamic=False,  # ONNX/TF/TensorRT: dynamic axes
         simplify=False,  # ONNX: simplify model
         opset=12,  # ONNX: opset version
@@ -514,7 +581,7 @@ def run(
 ):
     t = time.time()
     include = [x.lower() for x in include]  # to lowercase
-    fmts = tuple(export_formats()['Argument'][1:])  # --include arguments
+    fmts = tuple(x[1] for x in export_formats(df=False)[1:])  # --include arguments
     flags = [x in include for x in fmts]
     assert sum(flags) == len(include), f'ERROR: Invalid --include {include}, valid --include arguments are {fmts}'
     jit, onnx, xml, engine, coreml, saved_model, pb, tflite, edgetpu, tfjs, paddle = flags  # export booleans
@@ -562,8 +629,10 @@ def run(
         f[1], _ = export_engine(model, im, file, half, dynamic, simplify, workspace, verbose)
     if onnx or xml:  # OpenVINO requires ONNX
         f[2], _ = export_onnx(model, im, file, opset, dynamic, simplify)
+        if onnx and int8 and f[2]:  # ONNX INT8
+            f[2], _ = export_onnx_int8(model, im, file, data)
     if xml:  # OpenVINO
-        f[3], _ = export_openvino(file, metadata, half)
+        f[3], _ = export_openvino(file, metadata, half, int8, data, im)
     if coreml:  # CoreML
         f[4], _ = export_coreml(model, im, file, int8, half)
     if any((saved_model, pb, tflite, edgetpu, tfjs)):  # TensorFlow formats
@@ -620,7 +689,7 @@ def parse_opt():
     parser.add_argument('--inplace', action='store_true', help='set YOLOv5 Detect() inplace=True')
     parser.add_argument('--keras', action='store_true', help='TF: use Keras')
     parser.add_argument('--optimize', action='store_true', help='TorchScript: optimize for mobile')
-    parser.add_argument('--int8', action='store_true', help='CoreML/TF INT8 quantization')
+    parser.add_argument('--int8', action='store_true', help='CoreML/TF/ONNX/OpenVINO INT8 quantization')
     parser.add_argument('--dynamic', action='store_true', help='ONNX/TF/TensorRT: dynamic axes')
     parser.add_argument('--simplify', action='store_true', help='ONNX: simplify model')
     parser.add_argument('--opset', type=int, default=12, help='ONNX: opset version')
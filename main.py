@@ -3,7 +3,8 @@ from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QImage, QPixmap
 import sys
 import cv2
-import torch
+
+from utils.registry import load_model
 
 class FaceAttendanceSystem(QMainWindow):
     def __init__(self):
@@ -28,7 +29,7 @@ class FaceAttendanceSystem(QMainWindow):
         layout.addLayout(info_layout)
         
         # 初始化YOLOv5模型
-        self.model = torch.hub.load('ultralytics/yolov5', 'custom', path='weights/yolov5s.pt')
+        self.model = load_model('weights/yolov5s.pt')  # local checkout, no network
         
         # 初始化摄像头
         self.cap = cv2.VideoCapture(0)
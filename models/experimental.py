@@ -70,10 +70,17 @@ class Ensemble(nn.ModuleList):
         return y, None  # inference, train output
 
 
-def attempt_load(weights, device=None, inplace=True, fuse=True):
+def attempt_load(weights, device=None, inplace=True, fuse=True, cache=False):
     # Loads an ensemble of models weights=[a,b,c] or a single model weights=[a] or weights=a
     from models.yolo import Detect, Model
 
+    if isinstance(weights, list) and len(weights) == 1:  # i.e. detect.py --weights nargs='+', a single model
+        weights = weights[0]
+    if cache and not isinstance(weights, list):  # serve the fused eval model from the on-disk cache, utils/registry.py
+        from utils.registry import cached
+        build = lambda w: attempt_load(w, device=device, inplace=inplace, fuse=fuse)  # noqa: E731
+        return cached(attempt_download(weights), build, tag=f'attempt_load-{device}-{inplace}-{fuse}')
+
     model = Ensemble()
     for w in weights if isinstance(weights, list) else [weights]:
         ckpt = torch.load(attempt_download(w), map_location='cpu')  # load
@@ -0,0 +1,140 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+BatchAugment label checks for --device-augment, tile-warped mosaics against the canvas random_perspective() path
+
+Usage:
+    $ python -m pytest tests/test_augmentations.py
+"""
+
+import random
+
+import cv2
+import numpy as np
+import pytest
+import torch
+import yaml
+
+from utils.augmentations import BatchAugment
+from utils.dataloaders import LoadImagesAndLabels
+from utils.general import ROOT
+
+HYP = dict(degrees=0.0, translate=0.0, scale=0.0, shear=0.0, perspective=0.0, mixup=0.0, hsv_h=0.0, hsv_s=0.0,
+           hsv_v=0.0, flipud=0.0, fliplr=0.0)
+
+
+def single_box(h=8, w=8, y=1, x=2):
+    # One image with one lit pixel at (y, x) and a box centered on it, targets are image, class, xywhn
+    im = torch.zeros(1, 3, h, w)
+    im[0, :, y, x] = 1
+    targets = torch.tensor([[0, 0, (x + 0.5) / w, (y + 0.5) / h, 1 / w, 1 / h]])
+    return im, targets
+
+
+def test_flip_lr():
+    im, targets = single_box()
+    im, t = BatchAugment(HYP, 8).flip(im, targets.clone(), p=1.0, dim=3)
+    assert im[0, 0, 1, 8 - 1 - 2] == 1  # pixel moved to mirrored x
+    assert torch.allclose(t[0, 2], 1 - targets[0, 2])  # x mirrored
+    assert torch.allclose(t[0, 3], targets[0, 3])  # y unchanged
+
+
+def test_flip_ud():
+    im, targets = single_box()
+    im, t = BatchAugment(HYP, 8).flip(im, targets.clone(), p=1.0, dim=2)
+    assert im[0, 0, 8 - 1 - 1, 2] == 1  # pixel moved to mirrored y
+    assert torch.allclose(t[0, 2], targets[0, 2])  # x unchanged
+    assert torch.allclose(t[0, 3], 1 - targets[0, 3])  # y mirrored
+
+
+def test_flip_boxes_follow_pixels():
+    # Boxes of a batch where only some images are flipped still contain their pixel
+    im = torch.zeros(4, 3, 16, 16)
+    targets = []
+    for b in range(4):
+        y, x = 2 + b, 3 + 2 * b
+        im[b, :, y, x] = 1
+        targets.append([b, 0, (x + 0.5) / 16, (y + 0.5) / 16, 1 / 16, 1 / 16])
+    aug = BatchAugment({**HYP, 'fliplr': 0.5, 'flipud': 0.5}, 16)
+    torch.manual_seed(1)
+    m = torch.rand(4) < 0.5, torch.rand(4) < 0.5  # flipud and fliplr draws of this seed
+    assert all(x.any() and not x.all() for x in m), 'seed must flip some images and not others'
+    torch.manual_seed(1)
+    im, t = aug.flip(im, torch.tensor(targets), 0.5, dim=2)
+    im, t = aug.flip(im, t, 0.5, dim=3)
+    for b, _, x, y, _, _ in t.tolist():
+        assert im[int(b), 0, int(y * 16), int(x * 16)] == 1
+
+
+def test_perspective_identity():
+    # With all geometric gains at 0, non-mosaic images and their labels are unchanged
+    im, targets = single_box(16, 24, 5, 7)
+    out, t = BatchAugment(HYP, 16).perspective(im.clone(), targets.clone())
+    assert out.shape == im.shape
+    assert torch.allclose(out, im, atol=1E-5)
+    assert torch.allclose(t, targets, atol=1E-4)
+
+
+def test_perspective_mosaic_center():
+    # A 2 * img_size mosaic canvas is warped to img_size around its center, as random_perspective(border=-s // 2)
+    s = 32
+    im = torch.zeros(1, 3, 2 * s, 2 * s)
+    targets = torch.tensor([[0, 1, 0.5, 0.5, 0.25, 0.125]])  # 16x8 box at the canvas center
+    out, t = BatchAugment(HYP, s).perspective(im, targets)
+    assert out.shape == (1, 3, s, s)
+    assert torch.allclose(t, torch.tensor([[0, 1, 0.5, 0.5, 0.5, 0.25]]), atol=1E-4)
+
+
+@pytest.fixture(scope='module')
+def segments(tmp_path_factory):
+    # Dataset of 6 images of mixed shapes with 2 polygon labels each, and one unlabelled image
+    path, rng = tmp_path_factory.mktemp('segments'), np.random.default_rng(0)
+    (path / 'images').mkdir()
+    (path / 'labels').mkdir()
+    a = np.arange(8) * np.pi / 4  # octagon vertex angles
+    for i in range(7):
+        h, w = (48, 80) if i % 2 else (96, 64)
+        cv2.imwrite(str(path / 'images' / f'{i}.jpg'), rng.integers(0, 256, (h, w, 3), dtype=np.uint8))
+        lines = []
+        for c in range(2 if i else 0):
+            xy = rng.uniform(0.2, 0.8, 2) + rng.uniform(0.05, 0.2) * np.stack((np.cos(a), np.sin(a)), 1)
+            lines.append(' '.join(map(str, [c, *xy.reshape(-1).round(4)])))
+        (path / 'labels' / f'{i}.txt').write_text('\n'.join(lines))
+    hyp = yaml.safe_load((ROOT / 'data' / 'hyps' / 'hyp.scratch-low.yaml').read_text())
+    hyp.update(degrees=10.0, translate=0.1, scale=0.5, shear=2.0)
+    return LoadImagesAndLabels(path / 'images', img_size=64, augment=True, hyp=hyp)
+
+
+def mosaic(dataset, fn, index, seed, **hyp):
+    # Seeded load_mosaic() or load_mosaic9() output of 'index' with 'hyp' updates
+    dataset.hyp.update(hyp)
+    random.seed(seed)
+    np.random.seed(seed)
+    img, labels = getattr(dataset, fn)(index)
+    return img.copy(), labels
+
+
+@pytest.mark.parametrize('perspective', [0.0, 0.0005])
+@pytest.mark.parametrize('fn', ['load_mosaic', 'load_mosaic9'])
+def test_mosaic_warp_tiles(segments, fn, perspective):
+    # Tile-warped mosaics match the canvas + random_perspective() path, the segment-derived boxes included
+    n = 0
+    for seed in range(8):
+        index = seed % len(segments)
+        im, labels = mosaic(segments, fn, index, seed, perspective=perspective, copy_paste=0.0)
+        im0, labels0 = mosaic(segments, fn, index, seed, perspective=perspective, copy_paste=1E-9)  # pastes none
+        assert im.shape == im0.shape == (64, 64, 3)
+        assert np.abs(im.astype(int) - im0).mean() < 2  # interpolation differs at tile seams only
+        np.testing.assert_allclose(labels, labels0, atol=1E-3)
+        n += len(labels)
+    assert n  # some labels survive the warp
+
+
+@pytest.mark.parametrize('fn', ['load_mosaic', 'load_mosaic9'])
+def test_mosaic_buffers(segments, fn):
+    # A mosaic is not overwritten by its mixup partner, which is the next load_mosaic() call
+    segments.hyp.update(perspective=0.0, copy_paste=0.0)
+    a = getattr(segments, fn)(1)[0]
+    a0 = a.copy()
+    b = getattr(segments, fn)(2)[0]
+    assert not np.shares_memory(a, b)
+    np.testing.assert_array_equal(a, a0)
@@ -0,0 +1,153 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+LoadImages prefetch shutdown, ShardBatchSampler shards, DevicePrefetcher batches and incremental label caches
+
+Usage:
+    $ python -m pytest tests/test_dataloaders.py
+"""
+
+import gc
+import os
+import shutil
+import threading
+import time
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+import utils.dataloaders as dl
+from utils.dataloaders import (DevicePrefetcher, LoadBatches, LoadImages, LoadImagesAndLabels, ShardBatchSampler,
+                               create_dataloader)
+from utils.microbench import synthetic_dataset
+
+
+@pytest.fixture(scope='module')
+def images(tmp_path_factory):
+    # Directory of 8 synthetic images
+    return synthetic_dataset(tmp_path_factory.mktemp('ds'), n=8, shape=(64, 96), labels=1)
+
+
+def threads_settle(n, timeout=5):
+    # Wait for the number of live threads to drop to 'n', returns the final count
+    t = time.time() + timeout
+    while threading.active_count() > n and time.time() < t:
+        time.sleep(0.01)
+    return threading.active_count()
+
+
+def test_prefetch_order(images):
+    paths = [x[0] for x in LoadImages(images, img_size=64, prefetch=3)]
+    assert paths == [x[0] for x in LoadImages(images, img_size=64)]
+
+
+def test_prefetch_closed_on_exit(images):
+    n = threading.active_count()
+    with LoadImages(images, img_size=64, prefetch=3) as dataset:
+        for _ in dataset:
+            break
+        assert threading.active_count() > n
+    assert dataset.pool is None and threads_settle(n) == n
+
+
+def test_prefetch_closed_on_collection(images):
+    n = threading.active_count()
+    dataset = LoadImages(images, img_size=64, prefetch=3)
+    for _ in dataset:
+        break
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter('always')
+        del dataset
+        gc.collect()
+    assert not [x for x in w if issubclass(x.category, ResourceWarning)]  # 'unclosed running multiprocessing pool'
+    assert threads_settle(n) == n
+
+
+@pytest.mark.parametrize('n, batch_size, world_size', [(100, 16, 1), (100, 16, 3), (100, 10, 4), (5, 16, 2)])
+def test_shard_batches(n, batch_size, world_size):
+    single = list(ShardBatchSampler(n, batch_size, rank=0, world_size=1))
+    shards = [list(ShardBatchSampler(n, batch_size, rank=r, world_size=world_size)) for r in range(world_size)]
+    assert [x for r in range(world_size) for x in single[r::world_size]] == [x for b in shards for x in b]
+    assert sorted(i for b in shards for x in b for i in x) == list(range(n))  # every image once, no padding
+
+
+
+@pytest.mark.parametrize('rank, batches', [(0, 1), (1, 0)])
+def test_shard_dataloader(images, tmp_path, monkeypatch, rank, batches):
+    # 8 images in one batch of 8 as rank 'rank' of 2, rank 1 has an empty shard
+    torch.distributed.init_process_group('gloo', init_method=f'file://{tmp_path / "init"}', rank=0, world_size=1)
+    monkeypatch.setattr(torch.distributed, 'get_rank', lambda: rank)
+    monkeypatch.setattr(torch.distributed, 'get_world_size', lambda: 2)
+    try:
+        loader, _ = create_dataloader(images, 64, 8, 32, rank=rank, workers=0, shard=True)
+        assert len(loader) == len(list(loader)) == batches
+    finally:
+        torch.distributed.destroy_process_group()
+
+
+@pytest.mark.parametrize('half', [False, True])
+def test_device_prefetcher(images, half):
+    loader, _ = create_dataloader(images, 64, 3, 32, workers=0, pin_memory=False)
+    batches = list(DevicePrefetcher(loader, torch.device('cpu'), half=half))
+    assert len(batches) == len(loader) == 3  # 8 images in batches of 3
+    for (im, targets, paths, shapes), (im0, targets0, paths0, _) in zip(batches, loader):
+        assert im.dtype == (torch.float16 if half else torch.float32) and im.device.type == 'cpu'
+        assert 0 <= im.min() and im.max() <= 1 and im.max() > 0.5
+        torch.testing.assert_close(im, (im0.half() if half else im0.float()) / 255)
+        torch.testing.assert_close(targets, targets0)
+        assert paths == paths0
+
+
+def test_batched_video_props(tmp_path):
+    # A video ending inside a batch has its capture released before the batch is returned
+    for name, n in ('a.avi', 5), ('b.avi', 2):
+        writer = cv2.VideoWriter(str(tmp_path / name), cv2.VideoWriter_fourcc(*'MJPG'), 10, (96, 64))
+        for i in range(n):
+            writer.write(np.full((64, 96, 3), i * 40, np.uint8))
+        writer.release()
+    batches = list(LoadBatches(LoadImages(tmp_path, img_size=64, auto=False), batch_size=4))
+    props = [x for _, _, _, props, _ in batches for x in props]
+    assert len(props) == 7
+    assert all(x == (10, 96, 64) for x in props)
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    # Image files passed to verify_image_labels(), per scan
+    scans, verify = [], dl.verify_image_labels
+
+    def recording(im_files, *args, **kwargs):
+        scans.append(sorted(os.path.basename(f) for f in im_files))
+        yield from verify(im_files, *args, **kwargs)
+
+    monkeypatch.setattr(dl, 'verify_image_labels', recording)
+    return scans
+
+
+def test_label_cache_incremental(tmp_path, verified):
+    path = synthetic_dataset(tmp_path, n=8, shape=(64, 96), labels=2)
+    labels, cache = tmp_path / 'labels', tmp_path / 'labels.cache'
+    assert len(LoadImagesAndLabels(path, img_size=64).labels) == 8
+    assert verified == [[f'{i}.jpg' for i in range(8)]]  # new cache, every image
+
+    mtime = os.stat(cache).st_mtime_ns
+    LoadImagesAndLabels(path, img_size=64)
+    assert len(verified) == 1  # unchanged, nothing verified
+    assert os.stat(cache).st_mtime_ns == mtime  # and the cache is not rewritten
+
+    (labels / '3.txt').write_text('7 0.5 0.5 0.25 0.25\n')  # changed label
+    shutil.copy(path / '0.jpg', path / '8.jpg')  # new image and label
+    shutil.copy(labels / '0.txt', labels / '8.txt')
+    (path / '5.jpg').unlink()  # deleted image
+    (path / '6.jpg').write_bytes(b'not an image')  # corrupt image
+    dataset = LoadImagesAndLabels(path, img_size=64)
+    assert verified[1] == ['3.jpg', '6.jpg', '8.jpg']
+    files = [os.path.basename(f) for f in dataset.im_files]
+    assert files == ['0.jpg', '1.jpg', '2.jpg', '3.jpg', '4.jpg', '7.jpg', '8.jpg']  # 5 deleted, 6 corrupt
+    np.testing.assert_allclose(dataset.labels[files.index('3.jpg')], [[7, 0.5, 0.5, 0.25, 0.25]])
+    np.testing.assert_array_equal(dataset.labels[files.index('8.jpg')], dataset.labels[0])
+
+    LoadImagesAndLabels(path, img_size=64)
+    assert len(verified) == 2  # corrupt images stay in the cache and are not verified again
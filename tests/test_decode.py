@@ -0,0 +1,133 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+imdecode() EXIF orientation and DCT-scaled shapes for each IMREAD_BACKEND
+
+Usage:
+    $ python -m pytest tests/test_decode.py
+"""
+
+import io
+import sys
+import types
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image, ImageOps
+
+import utils.dataloaders as dl
+from utils.dataloaders import imdecode
+
+
+def jpeg(orientation=1, shape=(256, 384)):
+    # JPEG bytes of an asymmetric 4 color image of HW 'shape' with EXIF 'orientation'
+    h, w = shape
+    im = np.zeros((h, w, 3), np.uint8)
+    im[:h // 2, :w // 3] = 255, 0, 0
+    im[:h // 2, w // 3:] = 0, 255, 0
+    im[h // 2:, :w // 2] = 0, 0, 255
+    im[h // 2:, w // 2:] = 255, 255, 0
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    f = io.BytesIO()
+    Image.fromarray(im).save(f, 'JPEG', quality=95, exif=exif.tobytes())
+    return f.getvalue()
+
+
+def reference(b):
+    # BGR array of JPEG bytes 'b' oriented by PIL
+    return np.asarray(ImageOps.exif_transpose(Image.open(io.BytesIO(b))).convert('RGB'))[..., ::-1]
+
+
+@pytest.fixture
+def fake_turbojpeg(monkeypatch):
+    # PyTurboJPEG stand-in that decodes like libjpeg-turbo: unoriented, at the requested DCT scale
+    class TurboJPEG:
+        def decode(self, b, pixel_format=None, scaling_factor=None):
+            assert pixel_format == module.TJPF_BGR
+            flags = dl.IMREAD_FLAGS[scaling_factor[1] if scaling_factor else 1] | cv2.IMREAD_IGNORE_ORIENTATION
+            return cv2.imdecode(b, flags)
+
+    module = types.ModuleType('turbojpeg')
+    module.TJPF_BGR, module.TurboJPEG = 0, TurboJPEG
+    monkeypatch.setitem(sys.modules, 'turbojpeg', module)
+    dl.turbojpeg.cache_clear()
+    yield
+    dl.turbojpeg.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def reduced(monkeypatch):
+    monkeypatch.setattr(dl, 'IMREAD_REDUCED', True)
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+@pytest.mark.parametrize('backend', ['cv2', 'pil', 'turbojpeg'])
+def test_orientation(backend, orientation, request):
+    if backend == 'turbojpeg':
+        request.getfixturevalue('fake_turbojpeg')
+    b = jpeg(orientation)
+    ref = reference(b)
+    im = imdecode(b, backend=backend)
+    assert im.shape == ref.shape
+    assert np.abs(im.astype(int) - ref).mean() < 2
+
+
+@pytest.mark.parametrize('orientation', [1, 6])
+@pytest.mark.parametrize('backend', ['cv2', 'pil', 'turbojpeg'])
+@pytest.mark.parametrize('size, short, k', [(100, False, 2), (90, True, 2), (48, False, 8), (400, False, 1)])
+def test_scaled(backend, orientation, size, short, k, request):
+    if backend == 'turbojpeg':
+        request.getfixturevalue('fake_turbojpeg')
+    b = jpeg(orientation)
+    ref = reference(b)
+    im = imdecode(b, size, short, backend=backend)
+    assert im.shape == (ref.shape[0] // k, ref.shape[1] // k, 3)
+    assert np.abs(cv2.resize(ref, im.shape[1::-1], interpolation=cv2.INTER_AREA).astype(int) - im).mean() < 4
+
+
+def test_header_only_when_used(monkeypatch, fake_turbojpeg):
+    calls = []
+    header = dl.jpeg_header
+    monkeypatch.setattr(dl, 'jpeg_header', lambda b: calls.append(1) or header(b))
+    b = jpeg(6)
+    for backend in 'cv2', 'pil':
+        imdecode(b, backend=backend)
+    assert not calls  # full size cv2 and PIL decodes orient themselves
+    imdecode(b, 100, backend='cv2')
+    imdecode(b, backend='turbojpeg')
+    assert len(calls) == 2
+    _, png = cv2.imencode('.png', np.zeros((8, 8, 3), np.uint8))
+    assert imdecode(png, 4, backend='turbojpeg').shape == (8, 8, 3)  # not a JPEG, OpenCV without a header parse
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize('backend', ['cv2', 'pil', 'turbojpeg'])
+def test_truncated(backend, request):
+    if backend == 'turbojpeg':
+        request.getfixturevalue('fake_turbojpeg')
+    b = jpeg(6)
+    for size in None, 100:
+        im = imdecode(b[:len(b) * 2 // 3], size, backend=backend)  # rows past the end are filled in
+        assert im.shape == imdecode(b, size, backend=backend).shape
+
+
+def test_turbojpeg_library():
+    pytest.importorskip('turbojpeg')
+    dl.turbojpeg.cache_clear()
+    try:
+        dl.turbojpeg()
+    except Exception as e:  # PyTurboJPEG installed without the libjpeg-turbo shared library
+        pytest.skip(str(e))
+    try:
+        for orientation in 1, 6:
+            b = jpeg(orientation)
+            assert np.abs(imdecode(b, backend='turbojpeg').astype(int) - reference(b)).mean() < 2
+    finally:
+        dl.turbojpeg.cache_clear()
+
+
+def test_check_imread_backend():
+    dl.check_imread_backend('cv2')
+    with pytest.raises(AssertionError):
+        dl.check_imread_backend('jpeg')
@@ -0,0 +1,79 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Batched and NumPy non_max_suppression() against the per-image torch loop
+
+Usage:
+    $ python -m pytest tests/test_general.py
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from utils import postprocess
+from utils.general import non_max_suppression
+
+
+def predictions(bs=4, n=3000, nc=5, nm=0, seed=0):
+    # Random (bs,n,5+nc+nm) model output of xywh boxes in a 640 image, clustered so NMS has overlaps to suppress
+    g = torch.Generator().manual_seed(seed)
+    xy = torch.rand(bs, 40, 1, 2, generator=g) * 640 + torch.randn(bs, 40, n // 40, 2, generator=g) * 8
+    wh = 20 + torch.rand(bs, 40, n // 40, 2, generator=g) * 80
+    scores = torch.rand(bs, n, 1 + nc + nm, generator=g)
+    return torch.cat((xy.view(bs, -1, 2), wh.view(bs, -1, 2), scores), 2)
+
+
+def ranked(x):
+    # Detections 'x' by descending confidence then x1, the two paths may order equal confidences differently
+    return x[np.lexsort((x[:, 0].numpy(), -x[:, 4].numpy()))]
+
+
+@pytest.mark.parametrize('multi_label', [False, True])
+@pytest.mark.parametrize('agnostic', [False, True])
+@pytest.mark.parametrize('classes', [None, [1, 3]])
+@pytest.mark.parametrize('nm', [0, 32])
+@pytest.mark.parametrize('topk', [0, 500])
+def test_batched_nms(multi_label, agnostic, classes, nm, topk):
+    p = predictions(nm=nm)
+    kwargs = dict(conf_thres=0.3, iou_thres=0.45, classes=classes, agnostic=agnostic, multi_label=multi_label,
+                  max_det=100, nm=nm, topk=topk)
+    loop = non_max_suppression(p.clone(), **kwargs)
+    batched = non_max_suppression(p.clone(), batched=True, **kwargs)
+    assert len(loop) == len(batched) == p.shape[0]
+    for a, b in zip(loop, batched):
+        assert a.shape[1] == 6 + nm and len(a) > 0
+        torch.testing.assert_close(ranked(a), ranked(b))
+
+
+def test_batched_nms_labels():
+    p = predictions()
+    labels = [torch.tensor([[1, 100, 100, 40, 40], [2, 300, 200, 60, 30]]), torch.zeros((0, 5)),
+              torch.tensor([[4, 500, 500, 50, 50]]), torch.zeros((0, 5))]  # (cls, xywh) autolabels
+    loop = non_max_suppression(p.clone(), conf_thres=0.3, labels=labels)
+    batched = non_max_suppression(p.clone(), conf_thres=0.3, labels=labels, batched=True)
+    for a, b in zip(loop, batched):
+        torch.testing.assert_close(ranked(a), ranked(b))
+
+
+def test_batched_nms_empty():
+    p = predictions()
+    p[1:, :, 4] = 0  # no candidates past the first image
+    out = non_max_suppression(p, conf_thres=0.3, batched=True)
+    assert len(out[0]) and all(x.shape == (0, 6) for x in out[1:])
+
+
+@pytest.mark.parametrize('multi_label', [False, True])
+@pytest.mark.parametrize('agnostic', [False, True])
+@pytest.mark.parametrize('classes', [None, [1, 3]])
+@pytest.mark.parametrize('nm', [0, 32])
+@pytest.mark.parametrize('max_det', [10, 300])
+def test_numpy_nms(multi_label, agnostic, classes, nm, max_det):
+    p = predictions(nm=nm)
+    kwargs = dict(conf_thres=0.3, iou_thres=0.45, classes=classes, agnostic=agnostic, multi_label=multi_label,
+                  max_det=max_det, nm=nm)
+    ref = non_max_suppression(p.clone(), **kwargs)
+    out = postprocess.non_max_suppression(p.numpy().copy(), **kwargs)
+    assert len(out) == len(ref)
+    for a, b in zip(ref, out):
+        assert isinstance(b, np.ndarray) and len(b) > 0
+        np.testing.assert_allclose(ranked(torch.from_numpy(b)), ranked(a), rtol=1e-6, atol=1e-4)
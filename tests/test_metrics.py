@@ -0,0 +1,92 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+AP accumulators against ap_per_class(), including sharded merges and all_reduce()
+
+Usage:
+    $ python -m pytest tests/test_metrics.py
+"""
+
+import numpy as np
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from utils.metrics import APAccumulator, APStats, ap_per_class
+
+NC, NIOU = 5, 10
+
+
+def random_images(n=200, seed=0):
+    # Per-image (correct (k, niou), conf (k), pred_cls (k), target_cls (m)) where correct is monotone in IoU threshold
+    g = torch.Generator().manual_seed(seed)
+    iouv = torch.linspace(0.5, 0.95, NIOU)
+    images = []
+    for _ in range(n):
+        k, m = torch.randint(0, 30, (2,), generator=g).tolist()
+        iou = torch.rand(k, generator=g) * (torch.rand(k, generator=g) < 0.6)  # 40% unmatched
+        conf = torch.rand(k, generator=g) ** 2
+        images.append((iou[:, None] > iouv, conf, torch.randint(0, NC, (k,), generator=g).float(),
+                       torch.randint(0, NC, (m,), generator=g).float()))
+    return images
+
+
+def reference(images):
+    return ap_per_class(*(torch.cat(x, 0).numpy() for x in zip(*images)))
+
+
+def filled(cls, images):
+    stats = cls(NC, NIOU)
+    for x in images:
+        stats.update(*x)
+    return stats
+
+
+def assert_same(a, b):
+    for x, y in zip(a, b):
+        np.testing.assert_allclose(x, y, rtol=0, atol=1E-12)
+
+
+def test_apstats_exact():
+    images = random_images()
+    assert_same(filled(APStats, images).compute(), reference(images))
+
+
+def test_accumulator_close():
+    # Binned AP is an approximation, within 0.01 of the exact per-class AP on dense random detections
+    images = random_images()
+    tp, fp, p, r, f1, ap, classes = filled(APAccumulator, images).compute()
+    ref = reference(images)
+    np.testing.assert_array_equal(classes, ref[6])
+    np.testing.assert_allclose(ap, ref[5], atol=0.01)
+    np.testing.assert_array_equal(filled(APAccumulator, images).nt.numpy(), np.bincount(
+        torch.cat([x[3] for x in images]).long().numpy(), minlength=NC))
+
+
+@pytest.mark.parametrize('cls', [APStats, APAccumulator])
+def test_merge_matches_single(cls):
+    images = random_images()
+    merged = filled(cls, images[0::3]).merge(filled(cls, images[1::3])).merge(filled(cls, images[2::3]))
+    single = filled(cls, images).compute()
+    if cls is APStats:  # image order differs, exact AP is order independent without confidence ties
+        single = reference(images)
+    assert_same(merged.compute(), single)
+
+
+def reduce_worker(rank, world, init, cls, q):
+    dist.init_process_group('gloo', init_method=init, rank=rank, world_size=world)
+    stats = filled(cls, random_images()[rank::world]).all_reduce()
+    q.put((rank, stats.compute()))
+    dist.destroy_process_group()
+
+
+@pytest.mark.parametrize('cls', [APStats, APAccumulator])
+def test_all_reduce_matches_single(cls, tmp_path):
+    world, ctx = 2, mp.get_context('spawn')
+    q = ctx.Queue()
+    init = f'file://{tmp_path / "init"}'
+    mp.start_processes(reduce_worker, (world, init, cls, q), nprocs=world, start_method='spawn')
+    results = dict(q.get() for _ in range(world))
+    single = filled(cls, random_images()).compute() if cls is APAccumulator else reference(random_images())
+    for r in results.values():
+        assert_same(r, single)
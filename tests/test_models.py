@@ -0,0 +1,81 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Fused model cache for attempt_load() and DetectMultiBackend, DetectMultiBackend NumPy inference, InferencePool replicas
+
+Usage:
+    $ python -m pytest tests/test_models.py
+"""
+
+import os
+import signal
+
+import numpy as np
+import pytest
+import torch
+
+import utils.registry
+from models.common import DetectMultiBackend
+from models.experimental import attempt_load
+from models.yolo import Model
+from utils.general import ROOT
+from utils.workers import InferencePool
+
+
+@pytest.fixture
+def weights(tmp_path):
+    # Checkpoint of an untrained 3 class yolov5n
+    f = tmp_path / 'yolov5n-3.pt'
+    torch.save({'model': Model(ROOT / 'models' / 'yolov5n.yaml', nc=3)}, f)
+    return f
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    # Model cache directory of this test, returned empty
+    d, cached = tmp_path / 'cache', utils.registry.cached
+    monkeypatch.setattr(utils.registry, 'cached', lambda *args, **kwargs: cached(*args, **kwargs, cache_dir=d))
+    return d
+
+
+@pytest.mark.parametrize('as_list', [False, True])
+def test_attempt_load_cache(weights, cache_dir, as_list):
+    model = attempt_load([str(weights)] if as_list else str(weights), cache=True)
+    assert len(list(cache_dir.glob('*.pt'))) == 1  # written on the first load
+    cached = attempt_load([str(weights)] if as_list else str(weights), cache=True)
+    assert len(list(cache_dir.glob('*.pt'))) == 1
+    x = torch.zeros(1, 3, 64, 64)
+    torch.testing.assert_close(cached(x)[0], model(x)[0])
+
+
+def test_detect_multi_backend_cache(weights, cache_dir):
+    model = DetectMultiBackend([str(weights)], cache=True)  # detect.py --weights is a list
+    assert model.pt and len(list(cache_dir.glob('*.pt'))) == 1
+
+
+def test_numpy_onnx(weights, tmp_path, monkeypatch):
+    pytest.importorskip('onnxruntime')
+    from export import run
+    f = run(weights=weights, imgsz=(64, 64), include=('onnx',))[0]
+    im = torch.rand(1, 3, 64, 64)
+    ref = DetectMultiBackend(f)(im)
+    numpy = DetectMultiBackend(f, numpy=True)
+    assert numpy.numpy and not DetectMultiBackend(weights, numpy=True).numpy  # only for NumPy runtime backends
+    monkeypatch.setattr(torch, 'from_numpy', None)  # NumPy in and out without torch conversions
+    y = numpy(im.numpy())
+    assert isinstance(y, np.ndarray)
+    np.testing.assert_allclose(y, ref.numpy(), rtol=1e-4, atol=1e-4)
+
+
+def test_inference_pool_dead_worker(weights):
+    pool = InferencePool(str(weights), workers=1, imgsz=(64, 64), cache=False)
+    try:
+        im = np.zeros((3, 64, 64), np.uint8)
+        assert len(pool(im)) == 1
+        os.kill(pool.procs[0].pid, signal.SIGKILL)  # i.e. OOM killer, never replies
+        pool.procs[0].join(timeout=10)
+        with pytest.raises(RuntimeError, match='exited with code'):
+            pool.submit(im).result(timeout=30)
+        with pytest.raises(RuntimeError, match='all workers exited'):
+            pool.submit(im)
+    finally:
+        pool.close()
@@ -0,0 +1,100 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Packed dataset round trip and PackedShards read sizes and counts
+
+Usage:
+    $ python -m pytest tests/test_packed.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+import yaml
+
+from utils.dataloaders import LoadImagesAndLabels, PackedShards, PackedShardSampler, pack_dataset
+from utils.general import ROOT
+from utils.microbench import synthetic_dataset
+
+
+class CountingFile:
+    # File wrapper that records the size of every read
+    def __init__(self, f):
+        self.f, self.reads = f, []
+
+    def seek(self, o):
+        self.f.seek(o)
+
+    def read(self, n):
+        b = self.f.read(n)
+        self.reads.append(len(b))
+        return b
+
+
+@pytest.fixture(scope='module')
+def packed(tmp_path_factory):
+    # (images directory, packed directory) of 24 synthetic images in 3 shards
+    path = synthetic_dataset(tmp_path_factory.mktemp('ds'), n=24, shape=(64, 96), labels=3)
+    return path, pack_dataset(path, shard_size=40_000)
+
+
+def counting(p):
+    # Open every shard of PackedShards 'p' through a CountingFile
+    p.pid, p.fh = os.getpid(), {s: CountingFile(open(f, 'rb', buffering=0)) for s, f in enumerate(p.shards)}
+    return p.fh.values()
+
+
+def test_round_trip(packed):
+    path, out = packed
+    a, b = LoadImagesAndLabels(path), LoadImagesAndLabels(out)
+    assert len(b.packed.shards) > 1
+    assert [os.path.basename(f) for f in a.im_files] == [os.path.basename(f) for f in b.im_files]
+    np.testing.assert_array_equal(a.shapes, b.shapes)
+    for x, y in zip(a.labels, b.labels):
+        np.testing.assert_array_equal(x, y)
+    for i in range(b.n):
+        with open(a.im_files[i], 'rb') as f:
+            assert bytes(b.packed.read(b.pack_index[i])) == f.read()
+        np.testing.assert_array_equal(a.imread(i), b.imread(i))
+
+
+def test_random_reads_are_exact(packed):
+    p = PackedShards(packed[1], chunk=1 << 20)
+    files = counting(p)
+    order = np.random.default_rng(0).permutation(len(p.records))
+    for j in order:
+        assert len(p.read(j)) == p.records[j, 2]
+    assert sum(sum(f.reads) for f in files) == p.records[:, 2].sum()  # no read-ahead
+
+
+def test_sequential_reads_are_chunked(packed):
+    p = PackedShards(packed[1], chunk=1 << 20)
+    files = counting(p)
+    for j in np.lexsort((p.records[:, 1], p.records[:, 0])):  # file order
+        assert len(p.read(j)) == p.records[j, 2]
+    assert all(len(f.reads) <= 2 for f in files)  # first record alone, then one chunk per shard
+
+
+@pytest.mark.parametrize('window', [3, 256])
+def test_windows(packed, window):
+    p = PackedShards(packed[1], window=window)
+    _, n = np.unique(p.windows, return_counts=True)
+    assert n.max() <= window and len(n) == len(p.spans)
+    s, o, e = p.spans[p.windows].T
+    assert (s == p.records[:, 0]).all() and (o <= p.records[:, 1]).all() and (p.records[:, 1:].sum(1) <= e).all()
+    assert (p.spans[:, 2] - p.spans[:, 1]).sum() == p.records[:, 2].sum()  # windows tile the shards
+
+
+@pytest.mark.parametrize('window', [4, 256])
+def test_sampler_reads_windows(packed, window, monkeypatch):
+    monkeypatch.setattr(PackedShards.__init__, '__defaults__', (8 << 20, window))
+    hyp = yaml.safe_load((ROOT / 'data' / 'hyps' / 'hyp.scratch-low.yaml').read_text())
+    hyp.update(mosaic=1.0, mixup=1.0)  # 3 mosaic partners and a 4 image mixup mosaic per sample
+    dataset = LoadImagesAndLabels(packed[1], img_size=64, augment=True, hyp=hyp)
+    sampler = PackedShardSampler(dataset)
+    files = counting(dataset.packed)
+    for i in sampler:
+        dataset[i]
+    reads = [n for f in files for n in f.reads]
+    assert sorted(reads) == sorted(dataset.packed.spans[:, 2] - dataset.packed.spans[:, 1])  # every window once
+    assert sorted(sampler) == list(range(len(dataset)))  # next epoch, every image once
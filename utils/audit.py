@@ -0,0 +1,171 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Dataset audit: label and image header checks, dataset statistics and opt-in image repairs
+
+Labels are verified and image shapes read from headers by the incremental labels cache, in parallel processes.
+Statistics (class histograms, box position and size distributions, image shapes) are saved next to the labels cache as
+*.stats.npz and reused by AutoAnchor and plot_labels() while the dataset is unchanged. Full decodes and JPEG repairs,
+which rewrite image files, only run when requested.
+
+Usage:
+    $ python utils/audit.py --data coco128.yaml                    # verify labels and headers, write statistics
+    $ python utils/audit.py --data coco128.yaml --decode           # also decode every image
+    $ python utils/audit.py --data coco128.yaml --repair           # also re-save truncated JPEGs in place
+"""
+
+import argparse
+import contextlib
+import hashlib
+import os
+import sys
+from itertools import combinations, repeat
+from multiprocessing.pool import Pool
+from pathlib import Path
+
+import numpy as np
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(FILE.parent) in sys.path:
+    sys.path.remove(str(FILE.parent))  # utils/triton.py would shadow the triton package imported by torchvision
+
+from utils.general import LOGGER, NUM_THREADS, TQDM_BAR_FORMAT, check_dataset, colorstr  # noqa: E402
+
+STATS_VERSION = 1  # *.stats.npz version
+PAIRS = list(combinations(range(4), 2))  # (x, y), (x, w), (x, h), (y, w), (y, h), (w, h) 2D histograms
+SIZE_EDGES = np.array([0, 4, 8, 16, 32, 64, 96, 128, 256, 512, 1024, np.inf])  # sqrt(box area) bins, COCO at 32, 96
+
+
+def label_stats(labels, shapes, bins=50):
+    # Statistics of per-image [cls, xywhn] labels and (n, 2) wh image shapes, as a dict of arrays for np.savez()
+    n = np.array([len(x) for x in labels], dtype=np.int64)  # instances per image
+    x = np.concatenate(labels, 0) if len(labels) else np.zeros((0, 5), np.float32)
+    c = x[:, 0].astype(int)
+    m = c.max(initial=0) + 1  # number of classes
+    i = np.repeat(np.arange(len(n)), n)  # image index of each box
+    b, edges = x[:, 1:5], np.linspace(0, 1, bins + 1)
+    area = np.sqrt((x[:, 3:5] * shapes[i]).prod(1))  # sqrt(box area) in pixels at native image size
+    return dict(version=STATS_VERSION,
+                classes=np.bincount(c, minlength=m),  # instances per class
+                images=np.bincount(np.unique(i * m + c) % m, minlength=m),  # images per class
+                instances=n,
+                shapes=np.asarray(shapes),
+                img=i.astype(np.int32),
+                wh=x[:, 3:5],  # normalized box wh
+                hist=np.stack([np.histogram(b[:, k], edges)[0] for k in range(4)]),  # x, y, w, h (4, bins)
+                hist2d=np.stack([np.histogram2d(b[:, j], b[:, k], (edges, edges))[0] for j, k in PAIRS]),
+                size=np.histogram(area, SIZE_EDGES)[0])
+
+
+def stats_key(labels, shapes):
+    # Hash of labels and shapes, a dataset's statistics file is reused while this is unchanged
+    h = hashlib.sha256(np.array([len(x) for x in labels], dtype=np.int64).tobytes())
+    for x in labels:
+        h.update(np.ascontiguousarray(x, dtype=np.float32).tobytes())
+    h.update(np.ascontiguousarray(shapes, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def dataset_stats(dataset, bins=50):
+    # Statistics of a LoadImagesAndLabels dataset, kept on the dataset and read from or written to the *.stats.npz next
+    # to its labels cache when the file matches the dataset labels and shapes
+    if getattr(dataset, 'stats', None) is not None:
+        return dataset.stats
+    key = stats_key(dataset.labels, dataset.shapes)
+    f = Path(dataset.cache_path).with_suffix('.stats.npz')
+    stats = None
+    with contextlib.suppress(Exception):  # missing, unreadable or stale
+        with np.load(f) as x:
+            if x['version'] == STATS_VERSION and str(x['key']) == key and x['hist'].shape[1] == bins:
+                stats = dict(x)
+    if stats is None:
+        stats = dict(label_stats(dataset.labels, dataset.shapes, bins), key=key)
+        with contextlib.suppress(Exception):  # read-only dataset directory
+            tmp = f.with_suffix('.tmp')
+            with open(tmp, 'wb') as t:  # file object, np.savez() would append .npz to a path
+                np.savez(t, **stats)
+            os.replace(tmp, f)
+    dataset.stats = stats
+    return stats
+
+
+def decode_image(args):
+    # Fully decode image 'f', re-saving it first if it is a truncated JPEG and repair=True, returns (f, message)
+    from PIL import Image, ImageFile, ImageOps
+
+    from utils.dataloaders import jpeg_complete
+
+    f, repair, prefix = args
+    try:
+        with Image.open(f) as im:
+            truncated = im.format.lower() in ('jpg', 'jpeg') and not jpeg_complete(f)
+            if truncated and repair:
+                ImageFile.LOAD_TRUNCATED_IMAGES = True  # decode what is there, set in --repair workers only
+                ImageOps.exif_transpose(im).save(f, 'JPEG', subsampling=0, quality=100)
+                return f, f'{prefix}WARNING ⚠️ {f}: truncated JPEG restored and saved'
+            im.load()  # decode
+        return f, f'{prefix}WARNING ⚠️ {f}: truncated JPEG, restore with --repair' if truncated else ''
+    except Exception as e:
+        return f, f'{prefix}WARNING ⚠️ {f}: image does not decode: {e}'
+
+
+def decode_images(files, repair=False, prefix='', chunksize=64, workers=NUM_THREADS):
+    # Decode (and optionally repair) images in parallel processes, yields (file, message) in completion order
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(decode_image,
+                                       zip(files, repeat(repair), repeat(prefix)),
+                                       chunksize=max(1, min(chunksize, len(files) // workers)))
+
+
+def audit(data='data/coco128.yaml', splits=('train', 'val', 'test'), decode=False, repair=False, chunksize=64):
+    # Audit dataset splits, returns {split: statistics}. Label scans use SCAN_CHUNKSIZE (utils/dataloaders.py) per task
+    from tqdm import tqdm
+
+    from utils.dataloaders import LoadImagesAndLabels
+
+    data, results = check_dataset(data), {}
+    for split in splits:
+        if data.get(split) is None:
+            continue
+        prefix = colorstr(f'{split}: ')
+        dataset = LoadImagesAndLabels(data[split], prefix=prefix)  # verifies new or changed labels and headers
+        stats = results[split] = dataset_stats(dataset)
+        if decode or repair:
+            msgs = []
+            pbar = tqdm(decode_images(dataset.im_files, repair, prefix, chunksize),
+                        desc=f'{prefix}Decoding images',
+                        total=dataset.n,
+                        bar_format=TQDM_BAR_FORMAT)
+            for _, msg in pbar:
+                if msg:
+                    msgs.append(msg)
+            if msgs:
+                LOGGER.info('\n'.join(msgs))
+
+        names = data['names']
+        nc, ni = stats['classes'], stats['images']
+        size = stats['size']
+        small, medium = size[SIZE_EDGES[1:] <= 32].sum(), size[(SIZE_EDGES[1:] > 32) & (SIZE_EDGES[1:] <= 96)].sum()
+        LOGGER.info(f"{prefix}{dataset.n} images, {(stats['instances'] == 0).sum()} backgrounds, {nc.sum()} instances, "
+                    f"image sizes {stats['shapes'].min(0).tolist()} to {stats['shapes'].max(0).tolist()}, "
+                    f"boxes {small} small, {medium} medium, {size.sum() - small - medium} large")
+        for c in np.argsort(-nc):
+            LOGGER.info(f'{names.get(c, c):>22}{nc[c]:>10} instances{ni[c]:>8} images')
+    return results
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', type=str, default=ROOT / 'data/coco128.yaml', help='dataset.yaml path')
+    parser.add_argument('--splits', nargs='+', default=['train', 'val', 'test'], help='splits to audit')
+    parser.add_argument('--decode', action='store_true', help='fully decode every image')
+    parser.add_argument('--repair', action='store_true', help='re-save truncated JPEGs in place, implies --decode')
+    parser.add_argument('--chunksize', type=int, default=64, help='images per decode task')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    audit(**vars(opt))
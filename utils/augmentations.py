@@ -9,10 +9,11 @@ import random
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as T
 import torchvision.transforms.functional as TF
 
-from utils.general import LOGGER, check_version, colorstr, resample_segments, segment2box, xywhn2xyxy
+from utils.general import LOGGER, check_version, colorstr, resample_segments, xywhn2xyxy, xyxy2xywhn
 from utils.metrics import bbox_ioa
 
 IMAGENET_MEAN = 0.485, 0.456, 0.406  # RGB mean
@@ -152,14 +153,32 @@ def random_perspective(im,
                        border=(0, 0)):
     # torchvision.transforms.RandomAffine(degrees=(-10, 10), translate=(0.1, 0.1), scale=(0.9, 1.1), shear=(-10, 10))
     # targets = [cls, xyxy]
+    M, s, (height, width) = random_perspective_matrix(im.shape[:2], degrees, translate, scale, shear, perspective,
+                                                      border)
+    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
+        if perspective:
+            im = cv2.warpPerspective(im, M, dsize=(width, height), borderValue=(114, 114, 114))
+        else:  # affine
+            im = cv2.warpAffine(im, M[:2], dsize=(width, height), borderValue=(114, 114, 114))
+
+    # Visualize
+    # import matplotlib.pyplot as plt
+    # ax = plt.subplots(1, 2, figsize=(12, 6))[1].ravel()
+    # ax[0].imshow(im[:, :, ::-1])  # base
+    # ax[1].imshow(im2[:, :, ::-1])  # warped
+
+    return im, warp_targets(targets, segments, M, s, width, height)
 
-    height = im.shape[0] + border[0] * 2  # shape(h,w,c)
-    width = im.shape[1] + border[1] * 2
+
+def random_perspective_matrix(shape, degrees=10, translate=.1, scale=.1, shear=10, perspective=0.0, border=(0, 0)):
+    # Draw the random_perspective() homography for an image of shape (h, w), returns M, scale, output (height, width)
+    height = shape[0] + border[0] * 2  # shape(h,w,c)
+    width = shape[1] + border[1] * 2
 
     # Center
     C = np.eye(3)
-    C[0, 2] = -im.shape[1] / 2  # x translation (pixels)
-    C[1, 2] = -im.shape[0] / 2  # y translation (pixels)
+    C[0, 2] = -shape[1] / 2  # x translation (pixels)
+    C[1, 2] = -shape[0] / 2  # y translation (pixels)
 
     # Perspective
     P = np.eye(3)
@@ -186,39 +205,31 @@ def random_perspective(im,
 
     # Combined rotation matrix
     M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
-    if (border[0] != 0) or (border[1] != 0) or (M != np.eye(3)).any():  # image changed
-        if perspective:
-            im = cv2.warpPerspective(im, M, dsize=(width, height), borderValue=(114, 114, 114))
-        else:  # affine
-            im = cv2.warpAffine(im, M[:2], dsize=(width, height), borderValue=(114, 114, 114))
+    return M, s, (height, width)
 
-    # Visualize
-    # import matplotlib.pyplot as plt
-    # ax = plt.subplots(1, 2, figsize=(12, 6))[1].ravel()
-    # ax[0].imshow(im[:, :, ::-1])  # base
-    # ax[1].imshow(im2[:, :, ::-1])  # warped
 
-    # Transform label coordinates
+def warp_targets(targets, segments, M, s, width, height):
+    # Transform [cls, xyxy] targets by homography M into a (height, width) image, refitting boxes to warped segments
     n = len(targets)
     if n:
         use_segments = any(x.any() for x in segments)
-        new = np.zeros((n, 4))
         if use_segments:  # warp segments
-            segments = resample_segments(segments)  # upsample
-            for i, segment in enumerate(segments):
-                xy = np.ones((len(segment), 3))
-                xy[:, :2] = segment
-                xy = xy @ M.T  # transform
-                xy = xy[:, :2] / xy[:, 2:3] if perspective else xy[:, :2]  # perspective rescale or affine
+            xy = np.stack(resample_segments(segments))  # upsample (n,1000,2)
+            xy = np.concatenate((xy, np.ones_like(xy[..., :1])), 2) @ M.T  # transform
+            xy = xy[..., :2] / xy[..., 2:]  # perspective rescale, 1 if affine
 
-                # clip
-                new[i] = segment2box(xy, width, height)
+            # clip, segment2box() for all segments
+            x, y = xy[..., 0], xy[..., 1]
+            inside = (x >= 0) & (y >= 0) & (x <= width) & (y <= height)
+            new = np.stack((np.where(inside, x, np.inf).min(1), np.where(inside, y, np.inf).min(1),
+                            np.where(inside, x, -np.inf).max(1), np.where(inside, y, -np.inf).max(1)), 1)
+            new[~inside.any(1)] = 0
 
         else:  # warp boxes
             xy = np.ones((n * 4, 3))
             xy[:, :2] = targets[:, [1, 2, 3, 4, 1, 4, 3, 2]].reshape(n * 4, 2)  # x1y1, x2y2, x1y2, x2y1
             xy = xy @ M.T  # transform
-            xy = (xy[:, :2] / xy[:, 2:3] if perspective else xy[:, :2]).reshape(n, 8)  # perspective rescale or affine
+            xy = (xy[:, :2] / xy[:, 2:3]).reshape(n, 8)  # perspective rescale, 1 if affine
 
             # create new boxes
             x = xy[:, [0, 2, 4, 6]]
@@ -234,7 +245,34 @@ def random_perspective(im,
         targets = targets[i]
         targets[:, 1:5] = new[i]
 
-    return im, targets
+    return targets
+
+
+def warp_tiles(out, tiles, M, perspective=0.0):
+    # Warp image tiles (im, x, y) placed at x, y of an unwarped canvas directly into out by homography M, fusing mosaic
+    # placement with random_perspective(), only the output region covered by each tile is processed
+    H, W = out.shape[:2]
+    for im, x, y in tiles:
+        h, w = im.shape[:2]
+        if not (h and w):
+            continue
+        Mt = M @ np.array([[1, 0, x], [0, 1, y], [0, 0, 1]])  # tile to output
+        xy = np.array([[0, 0, 1], [w, 0, 1], [0, h, 1], [w, h, 1]]) @ Mt.T
+        if (xy[:, 2] <= 0).any():  # degenerate perspective, warp the full output
+            x0, y0, x1, y1 = 0, 0, W, H
+        else:
+            xy = xy[:, :2] / xy[:, 2:]
+            x0, y0 = np.clip(np.floor(xy.min(0)).astype(int) - 1, 0, (W, H))
+            x1, y1 = np.clip(np.ceil(xy.max(0)).astype(int) + 1, 0, (W, H))
+            if x0 >= x1 or y0 >= y1:  # tile is outside the output
+                continue
+        Mr = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]]) @ Mt  # tile to output region
+        dst = out[y0:y1, x0:x1]
+        if perspective:
+            cv2.warpPerspective(im, Mr, (x1 - x0, y1 - y0), dst=dst, borderMode=cv2.BORDER_TRANSPARENT)
+        else:
+            cv2.warpAffine(im, Mr[:2], (x1 - x0, y1 - y0), dst=dst, borderMode=cv2.BORDER_TRANSPARENT)
+    return out
 
 
 def copy_paste(im, labels, segments, p=0.5):
@@ -298,10 +336,118 @@ def box_candidates(box1, box2, wh_thr=2, ar_thr=100, area_thr=0.1, eps=1e-16):
     # Compute candidate boxes: box1 before augment, box2 after augment, wh_thr (pixels), aspect_ratio_thr, area_ratio
     w1, h1 = box1[2] - box1[0], box1[3] - box1[1]
     w2, h2 = box2[2] - box2[0], box2[3] - box2[1]
-    ar = np.maximum(w2 / (h2 + eps), h2 / (w2 + eps))  # aspect ratio
+    maximum = torch.maximum if isinstance(w2, torch.Tensor) else np.maximum  # numpy or batched torch boxes
+    ar = maximum(w2 / (h2 + eps), h2 / (w2 + eps))  # aspect ratio
     return (w2 > wh_thr) & (h2 > wh_thr) & (w2 * h2 / (w1 * h1 + eps) > area_thr) & (ar < ar_thr)  # candidates
 
 
+class BatchAugment:
+    """ Batched training augmentation on the training device, for datasets created with batch_augment=True
+
+    Applies random_perspective(), mixup(), augment_hsv() and flips to a collated batch of float 0-1 RGB images (B,3,H,W)
+    and targets (n,6) image, class, xywhn, so dataloader workers only decode and assemble mosaics. Mosaic canvases of
+    2 * img_size are warped to img_size like random_perspective(border=mosaic_border), other batches keep their shape.
+    Boxes are warped by their corners, mixup partners are drawn from the same batch.
+    """
+
+    def __init__(self, hyp, img_size=640):
+        self.hyp = hyp
+        self.img_size = img_size
+
+    def __call__(self, im, targets):
+        h = self.hyp
+        im, targets = self.perspective(im, targets)
+        if h['mixup']:
+            im, targets = self.mixup(im, targets, h['mixup'])
+        if h['hsv_h'] or h['hsv_s'] or h['hsv_v']:
+            im = self.hsv(im, h['hsv_h'], h['hsv_s'], h['hsv_v'])
+        im, targets = self.flip(im, targets, h['flipud'], dim=2)
+        im, targets = self.flip(im, targets, h['fliplr'], dim=3)
+        return im, targets
+
+    def uniform(self, im, lo, hi):
+        return torch.empty(im.shape[0], device=im.device).uniform_(lo, hi)
+
+    def perspective(self, im, targets):
+        # random_perspective() with one homography per image, applied with grid_sample()
+        b, _, H, W = im.shape
+        h, w = (self.img_size, self.img_size) if H == W == 2 * self.img_size else (H, W)  # output shape
+        hyp, eye = self.hyp, torch.eye(3, device=im.device).repeat(b, 1, 1)
+        C, P, R, S, T = eye.clone(), eye.clone(), eye.clone(), eye.clone(), eye.clone()
+        C[:, 0, 2], C[:, 1, 2] = -W / 2, -H / 2  # center
+        P[:, 2, 0] = self.uniform(im, -hyp['perspective'], hyp['perspective'])  # x perspective (about y)
+        P[:, 2, 1] = self.uniform(im, -hyp['perspective'], hyp['perspective'])  # y perspective (about x)
+        a = self.uniform(im, -hyp['degrees'], hyp['degrees']) * math.pi / 180  # rotation
+        s = self.uniform(im, 1 - hyp['scale'], 1 + hyp['scale'])  # scale
+        R[:, 0, 0], R[:, 0, 1], R[:, 1, 0], R[:, 1, 1] = s * a.cos(), s * a.sin(), -s * a.sin(), s * a.cos()
+        S[:, 0, 1] = (self.uniform(im, -hyp['shear'], hyp['shear']) * math.pi / 180).tan()  # x shear
+        S[:, 1, 0] = (self.uniform(im, -hyp['shear'], hyp['shear']) * math.pi / 180).tan()  # y shear
+        T[:, 0, 2] = self.uniform(im, 0.5 - hyp['translate'], 0.5 + hyp['translate']) * w  # x translation
+        T[:, 1, 2] = self.uniform(im, 0.5 - hyp['translate'], 0.5 + hyp['translate']) * h  # y translation
+        M = T @ S @ R @ P @ C  # order of operations (right to left) is IMPORTANT
+
+        # Warp, sampling each output pixel from the inverse-mapped input pixel like cv2.warpPerspective()
+        y, x = torch.meshgrid(torch.arange(h, device=im.device), torch.arange(w, device=im.device), indexing='ij')
+        xy = torch.stack((x, y, torch.ones_like(x)), -1).view(1, -1, 3).float() @ torch.linalg.inv(M).transpose(1, 2)
+        grid = (2 * xy[..., :2] / xy[..., 2:] + 1) / torch.tensor([W, H], device=im.device) - 1  # to -1, 1
+        fill = 114 / 255  # border value
+        im = F.grid_sample(im - fill, grid.view(b, h, w, 2), align_corners=False) + fill
+
+        # Warp boxes by their corners
+        if len(targets):
+            i = targets[:, 0].long()
+            box = xywhn2xyxy(targets[:, 2:], W, H)
+            xy = box[:, [0, 1, 2, 3, 0, 3, 2, 1]].view(-1, 4, 2)  # x1y1, x2y2, x1y2, x2y1
+            xy = torch.cat((xy, torch.ones_like(xy[..., :1])), 2) @ M[i].transpose(1, 2)
+            xy = xy[..., :2] / xy[..., 2:]  # perspective rescale
+            new = torch.cat((xy.min(1).values, xy.max(1).values), 1)
+            new[:, [0, 2]], new[:, [1, 3]] = new[:, [0, 2]].clamp(0, w), new[:, [1, 3]].clamp(0, h)
+            j = box_candidates(box1=box.T * s[i], box2=new.T, area_thr=0.10)
+            targets = targets[j]
+            targets[:, 2:] = xyxy2xywhn(new[j], w=w, h=h, clip=True, eps=1E-3)
+        return im, targets
+
+    def mixup(self, im, targets, p):
+        # mixup() of a fraction p of the images with a random partner from the batch
+        b = im.shape[0]
+        j = torch.randperm(b, device=im.device)  # partners
+        m = (torch.rand(b, device=im.device) < p) & (j != torch.arange(b, device=im.device))
+        if not m.any():
+            return im, targets
+        r = torch.distributions.Beta(32.0, 32.0).sample((b,)).to(im.device)  # mixup ratio, alpha=beta=32.0
+        r = torch.where(m, r, 1).view(-1, 1, 1, 1)
+        im = im * r + im[j] * (1 - r)
+        k = torch.empty_like(j)
+        k[j] = torch.arange(b, device=im.device)  # image that each partner is mixed into
+        dst = k[targets[:, 0].long()]
+        extra = targets[m[dst]].clone()
+        extra[:, 0] = dst[m[dst]]
+        return im, torch.cat((targets, extra), 0)
+
+    def hsv(self, im, hgain=0.5, sgain=0.5, vgain=0.5):
+        # augment_hsv() on RGB, hue gain wraps around like the OpenCV 0-180 hue LUT
+        gain = torch.tensor([hgain, sgain, vgain], device=im.device).view(1, 3, 1, 1)
+        gain = (torch.rand(im.shape[0], 3, 1, 1, device=im.device) * 2 - 1) * gain + 1  # random gains
+        v, c = im.max(1, keepdim=True)
+        d = v - im.min(1, keepdim=True).values  # chroma, hue is unused where it is 0 as saturation is 0
+        hue = (im.roll(-1, 1) - im.roll(-2, 1)).gather(1, c) / d.clamp(min=1E-8) + 2 * c  # RGB to HSV, 0-6 hue
+        hue = (hue / 6 % 1 * gain[:, :1]) % 1
+        sat = (d / v.clamp(min=1E-8) * gain[:, 1:2]).clamp_(0, 1)
+        v = (v * gain[:, 2:]).clamp_(0, 1)
+        k = (torch.tensor([5, 3, 1], device=im.device).view(1, 3, 1, 1) + hue * 6) % 6  # HSV to RGB
+        return v - v * sat * torch.minimum(k, 4 - k).clamp_(0, 1)
+
+    def flip(self, im, targets, p, dim=3):
+        # Flip a fraction p of the images up-down (dim=2) or left-right (dim=3)
+        m = torch.rand(im.shape[0], device=im.device) < p
+        if m.any():
+            im[m] = im[m].flip(dim)
+            i = m[targets[:, 0].long()]
+            c = 5 - dim  # targets column, y (3) for dim 2 and x (2) for dim 3
+            targets[i, c] = 1 - targets[i, c]
+        return im, targets
+
+
 def classify_albumentations(
         augment=True,
         size=224,
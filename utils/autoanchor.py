@@ -11,6 +11,7 @@ import yaml
 from tqdm import tqdm
 
 from utils import TryExcept
+from utils.audit import dataset_stats
 from utils.general import LOGGER, TQDM_BAR_FORMAT, colorstr
 
 PREFIX = colorstr('AutoAnchor: ')
@@ -30,9 +31,10 @@ def check_anchor_order(m):
 def check_anchors(dataset, model, thr=4.0, imgsz=640):
     # Check anchor fit to data, recompute if necessary
     m = model.module.model[-1] if hasattr(model, 'module') else model.model[-1]  # Detect()
-    shapes = imgsz * dataset.shapes / dataset.shapes.max(1, keepdims=True)
+    stats = dataset_stats(dataset)  # box wh and image index of every label
+    shapes = imgsz * stats['shapes'] / stats['shapes'].max(1, keepdims=True)
     scale = np.random.uniform(0.9, 1.1, size=(shapes.shape[0], 1))  # augment scale
-    wh = torch.tensor(np.concatenate([l[:, 3:5] * s for s, l in zip(shapes * scale, dataset.labels)])).float()  # wh
+    wh = torch.tensor(stats['wh'] * (shapes * scale)[stats['img']]).float()  # wh
 
     def metric(k):  # compute metric
         r = wh[:, None] / k[None]
@@ -116,8 +118,9 @@ def kmean_anchors(dataset='./data/coco128.yaml', n=9, img_size=640, thr=4.0, gen
         dataset = LoadImagesAndLabels(data_dict['train'], augment=True, rect=True)
 
     # Get label wh
-    shapes = img_size * dataset.shapes / dataset.shapes.max(1, keepdims=True)
-    wh0 = np.concatenate([l[:, 3:5] * s for s, l in zip(shapes, dataset.labels)])  # wh
+    stats = dataset_stats(dataset)
+    shapes = img_size * stats['shapes'] / stats['shapes'].max(1, keepdims=True)
+    wh0 = stats['wh'] * shapes[stats['img']]  # wh
 
     # Filter
     i = (wh0 < 3.0).any(1).sum()
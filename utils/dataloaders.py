@@ -3,19 +3,24 @@
 Dataloaders and dataset utils
 """
 
+import atexit
 import contextlib
 import glob
 import hashlib
+import io
 import json
 import math
 import os
 import random
 import shutil
+import tempfile
 import time
+from collections import deque
+from functools import lru_cache
 from itertools import repeat
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
-from threading import Thread
+from threading import Condition, Thread
 from urllib.parse import urlparse
 
 import numpy as np
@@ -24,15 +29,16 @@ import torch
 import torch.nn.functional as F
 import torchvision
 import yaml
-from PIL import ExifTags, Image, ImageOps
+from PIL import ExifTags, Image
 from torch.utils.data import DataLoader, Dataset, dataloader, distributed
 from tqdm import tqdm
 
 from utils.augmentations import (Albumentations, augment_hsv, classify_albumentations, classify_transforms, copy_paste,
-                                 letterbox, mixup, random_perspective)
+                                 letterbox, mixup, random_perspective, random_perspective_matrix, warp_targets,
+                                 warp_tiles)
 from utils.general import (DATASETS_DIR, LOGGER, NUM_THREADS, TQDM_BAR_FORMAT, check_dataset, check_requirements,
-                           check_yaml, clean_str, cv2, is_colab, is_kaggle, segments2boxes, unzip_file, xyn2xy,
-                           xywh2xyxy, xywhn2xyxy, xyxy2xywhn)
+                           check_yaml, clean_str, colorstr, cv2, is_colab, is_kaggle, segments2boxes, unzip_file,
+                           xyn2xy, xywh2xyxy, xywhn2xyxy, xyxy2xywhn)
 from utils.torch_utils import torch_distributed_zero_first
 
 # Parameters
@@ -42,6 +48,23 @@ VID_FORMATS = 'asf', 'avi', 'gif', 'm4v', 'mkv', 'mov', 'mp4', 'mpeg', 'mpg', 't
 LOCAL_RANK = int(os.getenv('LOCAL_RANK', -1))  # https://pytorch.org/docs/stable/elastic/run.html
 RANK = int(os.getenv('RANK', -1))
 PIN_MEMORY = str(os.getenv('PIN_MEMORY', True)).lower() == 'true'  # global pin_memory for dataloaders
+SCAN_CHUNKSIZE = int(os.getenv('SCAN_CHUNKSIZE', 64))  # image-label pairs per verify_image_labels() task
+IMREAD_BACKEND = os.getenv('IMREAD_BACKEND', 'cv2')  # JPEG decoder for imread(), 'cv2', 'pil' or 'turbojpeg'
+IMREAD_REDUCED = str(os.getenv('IMREAD_REDUCED', True)).lower() == 'true'  # DCT-scaled JPEG decodes for datasets
+
+IMREAD_FLAGS = {  # cv2.imdecode() flags per DCT scale denominator
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8}
+EXIF_ORIENT = {  # EXIF orientation to HWC array transform, as exif_transpose()
+    2: np.fliplr,
+    3: lambda x: np.rot90(x, 2),
+    4: np.flipud,
+    5: lambda x: x.transpose(1, 0, 2),
+    6: lambda x: np.rot90(x, -1),
+    7: lambda x: np.rot90(x, 2).transpose(1, 0, 2),
+    8: np.rot90}
 
 # Get orientation exif tag
 for orientation in ExifTags.TAGS.keys():
@@ -57,6 +80,37 @@ def get_hash(paths):
     return h.hexdigest()  # return hash
 
 
+def file_stats(files):
+    # Returns (n, 2) int64 size and mtime of files, -1 for missing files, stat() runs in threads for network filesystems
+    def stat(f):
+        try:
+            s = os.stat(f)
+            return s.st_size, s.st_mtime_ns
+        except OSError:
+            return -1, -1
+
+    with ThreadPool(NUM_THREADS) as pool:
+        return np.array(pool.map(stat, files, chunksize=256), dtype=np.int64).reshape(-1, 2)
+
+
+def flatten_labels(labels, segments):
+    # Flatten per-image labels and segments into arrays that save without pickle, inverse of unflatten_labels()
+    s = [x for segment in segments for x in segment]
+    return {
+        'labels': np.concatenate(labels, 0) if labels else np.zeros((0, 5), np.float32),
+        'nl': np.array([len(x) for x in labels], dtype=np.int64),  # labels per image
+        'points': np.concatenate(s, 0).astype(np.float32) if s else np.zeros((0, 2), np.float32),
+        'npoints': np.array([len(x) for x in s], dtype=np.int64),  # points per segment
+        'nseg': np.array([len(x) for x in segments], dtype=np.int64)}  # segments per image
+
+
+def unflatten_labels(x):
+    # Returns per-image lists of labels and segments from the arrays of flatten_labels()
+    split = lambda a, n: np.split(a, np.cumsum(n)[:-1]) if len(n) else []  # noqa: E731
+    segments = split(x['points'], x['npoints'])
+    return split(x['labels'], x['nl']), [segments[i - k:i] for i, k in zip(np.cumsum(x['nseg']), x['nseg'])]
+
+
 def exif_size(img):
     # Returns exif-corrected PIL size
     s = img.size  # (width, height)
@@ -93,6 +147,72 @@ def exif_transpose(image):
     return image
 
 
+def jpeg_header(b):
+    # Returns (width, height, EXIF orientation) read from the header of JPEG bytes 'b', None if 'b' is not a JPEG
+    if bytes(b[:2]) != b'\xff\xd8':
+        return None
+    with contextlib.suppress(Exception):
+        with Image.open(io.BytesIO(b)) as im:  # lazy, reads the header
+            return (*im.size, im.getexif().get(0x0112, 1))
+
+
+@lru_cache(maxsize=None)
+def turbojpeg():
+    # Shared PyTurboJPEG decoder, SIMD libjpeg-turbo with DCT scaling and no PIL or OpenCV overhead
+    from turbojpeg import TurboJPEG
+    return TurboJPEG()
+
+
+def check_imread_backend(backend=None):
+    # Check the IMREAD_BACKEND decoder in the main process, before any dataloader worker decodes with it
+    backend = backend or IMREAD_BACKEND
+    assert backend in ('cv2', 'pil', 'turbojpeg'), f"IMREAD_BACKEND={backend} is not one of 'cv2', 'pil', 'turbojpeg'"
+    if backend == 'turbojpeg':
+        check_requirements('PyTurboJPEG')
+        turbojpeg()  # raises if the libjpeg-turbo shared library is missing
+
+
+def imdecode(b, size=None, short=False, backend=None):
+    # Decode encoded image bytes 'b' to a BGR array like cv2.imdecode(), with EXIF orientation applied. JPEGs with a
+    # target 'size' are decoded in the DCT domain at the smallest 1/2, 1/4 or 1/8 scale whose long side (short side if
+    # short=True) is still >= size, callers resize to their exact size afterwards
+    b = np.frombuffer(b, np.uint8)
+    backend = backend or IMREAD_BACKEND
+    scaled = bool(size) and IMREAD_REDUCED
+    if bytes(b[:2]) != b'\xff\xd8':  # not a JPEG
+        return cv2.imdecode(b, cv2.IMREAD_COLOR)
+    if bytes(b[-2:]) != b'\xff\xd9':  # truncated JPEG, end it with an EOI marker so every backend decodes what is there
+        b = np.concatenate((b, np.array((0xff, 0xd9), np.uint8)))
+    if backend == 'cv2' and not scaled:  # full size, OpenCV orients JPEGs itself
+        return cv2.imdecode(b, cv2.IMREAD_COLOR)
+    header = jpeg_header(b) if scaled or backend == 'turbojpeg' else (0, 0, 1)  # only parsed when it is used
+    if header is None:  # unreadable header, let OpenCV decode it or fail
+        return cv2.imdecode(b, cv2.IMREAD_COLOR)
+    w, h, orientation = header
+    s = (min if short else max)(w, h)
+    k = next((k for k in (8, 4, 2) if s >= size * k), 1) if scaled else 1  # scale denominator
+    if backend == 'pil':  # draft() picks the DCT scale, exif_transpose() orients
+        with contextlib.suppress(OSError), Image.open(io.BytesIO(b)) as im:  # i.e. truncated JPEGs, decoded by OpenCV
+            if k > 1:
+                im.draft('RGB', (w // k, h // k))
+            return np.ascontiguousarray(np.asarray(exif_transpose(im).convert('RGB'))[..., ::-1])  # RGB to BGR
+    if backend == 'turbojpeg':
+        with contextlib.suppress(OSError):  # i.e. CMYK JPEGs libjpeg-turbo can not convert, decoded by OpenCV below
+            from turbojpeg import TJPF_BGR
+            im = turbojpeg().decode(b, pixel_format=TJPF_BGR, scaling_factor=(1, k) if k > 1 else None)
+            return np.ascontiguousarray(EXIF_ORIENT[orientation](im)) if orientation in EXIF_ORIENT else im
+    return cv2.imdecode(b, IMREAD_FLAGS[k])  # OpenCV orients JPEGs itself
+
+
+def imread(f, size=None, short=False, backend=None):
+    # Read image file 'f' as BGR through imdecode(), returns None if it can not be read like cv2.imread()
+    try:
+        b = np.fromfile(f, np.uint8)
+    except OSError:
+        return None
+    return imdecode(b, size, short, backend)
+
+
 def seed_worker(worker_id):
     # Set dataloader worker seed https://pytorch.org/docs/stable/notes/randomness.html#dataloader
     worker_seed = torch.initial_seed() % 2 ** 32
@@ -115,7 +235,10 @@ def create_dataloader(path,
                       image_weights=False,
                       quad=False,
                       prefix='',
-                      shuffle=False):
+                      shuffle=False,
+                      shard=False,
+                      batch_augment=False,
+                      pin_memory=PIN_MEMORY):
     if rect and shuffle:
         LOGGER.warning('WARNING ⚠️ --rect is incompatible with DataLoader shuffle, setting shuffle=False')
         shuffle = False
@@ -132,26 +255,87 @@ def create_dataloader(path,
             stride=int(stride),
             pad=pad,
             image_weights=image_weights,
-            prefix=prefix)
+            prefix=prefix,
+            batch_augment=batch_augment)  # warps, mixup, HSV and flips on the training device
 
     batch_size = min(batch_size, len(dataset))
     nd = torch.cuda.device_count()  # number of CUDA devices
     nw = min([os.cpu_count() // max(nd, 1), batch_size if batch_size > 1 else 0, workers])  # number of workers
-    sampler = None if rank == -1 else distributed.DistributedSampler(dataset, shuffle=shuffle)
+    batch_sampler = ShardBatchSampler(len(dataset), batch_size) if shard and rank != -1 else None  # validation
+    if rank == -1 or batch_sampler is not None:  # an empty ShardBatchSampler is falsy
+        sampler = None
+    else:
+        sampler = distributed.DistributedSampler(dataset, shuffle=shuffle)
+    if shuffle and dataset.packed is not None and batch_sampler is None:
+        sampler = PackedShardSampler(dataset)  # sequential reads within shards
     loader = DataLoader if image_weights else InfiniteDataLoader  # only DataLoader allows for attribute updates
+    if batch_sampler is not None and not len(batch_sampler):
+        loader = DataLoader  # empty shard, InfiniteDataLoader would spin forever
     generator = torch.Generator()
     generator.manual_seed(6148914691236517205 + RANK)
     return loader(dataset,
-                  batch_size=batch_size,
-                  shuffle=shuffle and sampler is None,
+                  batch_size=1 if batch_sampler is not None else batch_size,
+                  shuffle=shuffle and sampler is None and batch_sampler is None,
                   num_workers=nw,
                   sampler=sampler,
-                  pin_memory=PIN_MEMORY,
+                  batch_sampler=batch_sampler,
+                  pin_memory=pin_memory,
                   collate_fn=LoadImagesAndLabels.collate_fn4 if quad else LoadImagesAndLabels.collate_fn,
                   worker_init_fn=seed_worker,
                   generator=generator), dataset
 
 
+class ShardBatchSampler:
+    """ Batch sampler that gives each DDP rank every WORLD_SIZE-th batch, in order and without padding
+
+    Batches are the same index ranges as in a single process, so --rect batch shapes and results are unchanged
+    """
+
+    def __init__(self, n, batch_size, rank=None, world_size=None):
+        rank = torch.distributed.get_rank() if rank is None else rank
+        world_size = torch.distributed.get_world_size() if world_size is None else world_size
+        self.batches = [list(range(i, min(i + batch_size, n))) for i in range(0, n, batch_size)][rank::world_size]
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+
+class PackedShardSampler:
+    """ Shuffling sampler for packed datasets, visits shards in random order and shuffles within PackedShards windows
+
+    Reads stay within one window of one shard at a time and each window is read whole once, see PackedShards. With
+    DDP every rank draws the same order and takes every WORLD_SIZE-th sample, padded to equal lengths like
+    DistributedSampler
+    """
+
+    def __init__(self, dataset, seed=0, rank=None, world_size=None):
+        ddp = torch.distributed.is_available() and torch.distributed.is_initialized()
+        self.rank = rank if rank is not None else torch.distributed.get_rank() if ddp else 0
+        self.world_size = world_size or (torch.distributed.get_world_size() if ddp else 1)
+        dataset.packed.windowed = True  # whole window reads, mosaic partners from the same window
+        self.windows = dataset.pack_windows  # dataset indices of each window, in file order
+        w = np.flatnonzero([len(x) for x in self.windows])  # windows holding dataset images
+        self.shards = np.split(w, np.flatnonzero(np.diff(dataset.packed.spans[w, 0])) + 1)  # windows of each shard
+        self.seed, self.epoch = seed, 0
+        self.n = math.ceil(len(dataset) / self.world_size)  # samples per rank
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        g = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1  # new order every pass when set_epoch() is not called
+        x = [g.permutation(self.windows[w]) for k in g.permutation(len(self.shards)) for w in self.shards[k]]
+        x = np.resize(np.concatenate(x), self.n * self.world_size)  # pad by repeating
+        return iter(x[self.rank::self.world_size].tolist())
+
+    def __len__(self):
+        return self.n
+
+
 class InfiniteDataLoader(dataloader.DataLoader):
     """ Dataloader that reuses workers
 
@@ -186,6 +370,66 @@ class _RepeatSampler:
             yield from iter(self.sampler)
 
 
+class DevicePrefetcher:
+    """ Iterates a LoadImagesAndLabels dataloader with images on device as float 0-1 (half=True for FP16), targets too
+
+    On CUDA each uint8 batch is staged in a ring of reusable pinned buffers, then copied and normalized on a side stream
+    one batch ahead, so the transfer of the next batch overlaps the current step. Use with create_dataloader(...,
+    pin_memory=False), staging replaces the DataLoader pinning copy
+    """
+
+    def __init__(self, loader, device, half=False, depth=2):
+        self.loader = loader
+        self.device = device
+        self.half = half
+        self.cuda = device.type == 'cuda'
+        self.stream = torch.cuda.Stream(device) if self.cuda else None
+        self.buffers = [None] * depth  # pinned uint8 staging buffers
+        self.events = [None] * depth  # transfer done, buffer free
+        self.i = 0  # next buffer
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        batches = iter(self.loader)
+        batch = self.load(batches)
+        while batch is not None:
+            if self.cuda:
+                stream = torch.cuda.current_stream(self.device)
+                stream.wait_stream(self.stream)
+                for x in batch[:2]:
+                    x.record_stream(stream)  # allocated on the side stream, used on this one
+            next_batch = self.load(batches)  # transfer in flight while the caller runs on this batch
+            yield batch
+            batch = next_batch
+
+    def load(self, batches):
+        # Fetch the next batch and start its transfer, None when exhausted
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        im, targets, *rest = batch
+        if not self.cuda:
+            im = (im.to(self.device).half() if self.half else im.to(self.device).float()) / 255  # uint8 to fp16/32
+            return (im, targets.to(self.device), *rest)
+
+        i, self.i = self.i, (self.i + 1) % len(self.buffers)
+        buf = self.buffers[i]
+        if not im.is_pinned():
+            if buf is None or buf.numel() < im.numel():
+                buf = self.buffers[i] = torch.empty(im.numel(), dtype=im.dtype, pin_memory=True)
+            elif self.events[i] is not None:
+                self.events[i].synchronize()  # previous transfer out of this buffer is done
+            im = buf[:im.numel()].view(im.shape).copy_(im)
+        with torch.cuda.stream(self.stream):
+            im = im.to(self.device, non_blocking=True)
+            im = (im.half() if self.half else im.float()).div_(255)  # uint8 to fp16/32, 0-255 to 0.0-1.0
+            targets = targets.to(self.device, non_blocking=True)
+            self.events[i] = self.stream.record_event()
+        return (im, targets, *rest)
+
+
 class LoadScreenshots:
     # YOLOv5 screenshot dataloader, i.e. `python detect.py --source "screen 0 100 100 512 256"`
     def __init__(self, source, img_size=640, stride=32, auto=True, transforms=None):
@@ -237,7 +481,8 @@ class LoadScreenshots:
 
 class LoadImages:
     # YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`
-    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1, prefetch=0,
+                 workers=NUM_THREADS):
         files = []
         for p in sorted(path) if isinstance(path, (list, tuple)) else [path]:
             p = str(Path(p).resolve())
@@ -263,6 +508,11 @@ class LoadImages:
         self.auto = auto
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.prefetch = max(prefetch, 0)  # number of images decoded ahead, 0 to disable
+        self.workers = max(1, min(workers, self.prefetch))  # prefetch decode threads
+        self.pool = None
+        self.queue = deque()  # pending decodes, in file order
+        check_imread_backend()
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -272,10 +522,54 @@ class LoadImages:
 
     def __iter__(self):
         self.count = 0
+        self.queue.clear()
+        self.ahead = 0  # index of next file to submit for prefetching
         return self
 
+    def _fill(self):
+        # Submit image decodes until self.prefetch are queued, videos are read sequentially in __next__
+        self.ahead = max(self.ahead, self.count)
+        if self.pool is None:
+            self.pool = ThreadPool(self.workers)
+        while len(self.queue) < self.prefetch and self.ahead < self.nf and not self.video_flag[self.ahead]:
+            self.queue.append(self.pool.apply_async(self._load, (self.files[self.ahead],)))
+            self.ahead += 1
+
+    def _close(self):
+        # Shut down prefetch threads, a new pool is started if the dataset is iterated again
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, value, traceback):
+        # Iteration broken off early never reaches StopIteration, 'with LoadImages(...) as dataset:' still shuts the
+        # prefetch threads down
+        self._close()
+
+    def __del__(self):
+        if getattr(self, 'pool', None) is not None:  # __init__ may have raised before the pool attribute was set
+            self._close()  # not left to the ThreadPool finalizer, which warns about a running pool
+
+    def _load(self, path):
+        # Read and preprocess image, returns (im, im0)
+        im0 = imread(path)  # BGR, full size as predictions are returned in its coordinates
+        assert im0 is not None, f'Image Not Found {path}'
+        return self._preprocess(im0), im0
+
+    def _preprocess(self, im0):
+        # Transform or letterbox an HWC BGR image to a contiguous CHW RGB array
+        if self.transforms:
+            return self.transforms(im0)  # transforms
+        im = letterbox(im0, self.img_size, stride=self.stride, auto=self.auto)[0]  # padded resize
+        im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return np.ascontiguousarray(im)  # contiguous
+
     def __next__(self):
         if self.count == self.nf:
+            self._close()
             raise StopIteration
         path = self.files[self.count]
 
@@ -289,6 +583,7 @@ class LoadImages:
                 self.count += 1
                 self.cap.release()
                 if self.count == self.nf:  # last video
+                    self._close()
                     raise StopIteration
                 path = self.files[self.count]
                 self._new_video(path)
@@ -297,20 +592,21 @@ class LoadImages:
             self.frame += 1
             # im0 = self._cv2_rotate(im0)  # for use if cv2 autorotation is False
             s = f'video {self.count + 1}/{self.nf} ({self.frame}/{self.frames}) {path}: '
+            im = self._preprocess(im0)
 
-        else:
-            # Read image
+        elif self.prefetch:
+            # Read prefetched image, queue the next one
+            self._fill()
+            im, im0 = self.queue.popleft().get()
             self.count += 1
-            im0 = cv2.imread(path)  # BGR
-            assert im0 is not None, f'Image Not Found {path}'
+            self._fill()
             s = f'image {self.count}/{self.nf} {path}: '
 
-        if self.transforms:
-            im = self.transforms(im0)  # transforms
         else:
-            im = letterbox(im0, self.img_size, stride=self.stride, auto=self.auto)[0]  # padded resize
-            im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
-            im = np.ascontiguousarray(im)  # contiguous
+            # Read image
+            self.count += 1
+            im, im0 = self._load(path)
+            s = f'image {self.count}/{self.nf} {path}: '
 
         return path, im, im0, self.cap, s
 
@@ -336,20 +632,83 @@ class LoadImages:
         return self.nf  # number of files
 
 
+def video_props(cap):
+    # Returns (fps, width, height) of an open cv2.VideoCapture, or None for images and streams
+    if cap is None:
+        return None
+    return cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+
+class LoadBatches:
+    # YOLOv5 batched image/video dataloader, i.e. `python detect.py --source path/ --batch-size 8`
+    def __init__(self, dataset, batch_size=8):
+        # dataset = LoadImages(..., auto=False) so all frames are letterboxed to a common shape
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.mode = dataset.mode
+        self.frames, self.modes = [], []  # per-image frame numbers and modes of the current batch
+
+    def __iter__(self):
+        iter(self.dataset)
+        return self
+
+    def __next__(self):
+        paths, ims, im0s, props, ss, self.frames, self.modes = [], [], [], [], [], [], []
+        for path, im, im0, cap, s in self._frames():
+            paths.append(path)
+            ims.append(im)
+            im0s.append(im0)
+            props.append(video_props(cap))  # read now, LoadImages releases cap after a video's last frame
+            ss.append(s)
+            self.frames.append(getattr(self.dataset, 'frame', 0))
+            self.modes.append(self.dataset.mode)
+        if not paths:
+            raise StopIteration
+        self.mode = self.modes[-1]
+        return paths, np.stack(ims), im0s, props, ss  # BCHW batch, per-image video (fps, w, h)
+
+    def _frames(self):
+        # Yield up to batch_size frames from the underlying dataset without restarting it
+        for _ in range(self.batch_size):
+            try:
+                yield next(self.dataset)
+            except StopIteration:
+                return
+
+    def __len__(self):
+        return len(self.dataset)  # number of files
+
+
 class LoadStreams:
     # YOLOv5 streamloader, i.e. `python detect.py --source 'rtsp://example.com/media.mp4'  # RTSP, RTMP, HTTP streams`
-    def __init__(self, sources='streams.txt', img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
+    def __init__(self,
+                 sources='streams.txt',
+                 img_size=640,
+                 stride=32,
+                 auto=True,
+                 transforms=None,
+                 vid_stride=1,
+                 buffer=4,
+                 max_age=0.0):
         torch.backends.cudnn.benchmark = True  # faster for fixed-size inference
         self.mode = 'stream'
         self.img_size = img_size
         self.stride = stride
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.max_age = max_age  # skip frames captured more than max_age seconds ago, 0 to disable
         sources = Path(sources).read_text().rsplit() if os.path.isfile(sources) else [sources]
         n = len(sources)
         self.sources = [clean_str(x) for x in sources]  # clean source names for later
-        self.imgs, self.fps, self.frames, self.threads = [None] * n, [0] * n, [0] * n, [None] * n
+        self.fps, self.frames, self.threads = [0] * n, [0] * n, [None] * n
+        self.buffers = [deque(maxlen=max(buffer, 1)) for _ in range(n)]  # (seq, timestamp, im, im0) ring buffers
+        self.seq = [0] * n  # sequence number of last captured frame per stream
+        self.last = [0] * n  # sequence number of last returned frame per stream
+        self.cond = Condition()  # notified by capture threads on every new frame
+        self.running = True  # capture threads exit when False
+        self.indices, self.seqs, self.timestamps = [], [], []  # per-image stream index, seq and capture time of batch
+        caps, im0s = [None] * n, [None] * n
         for i, s in enumerate(sources):  # index, source
-            # Start thread to read frames from video stream
+            # Open video stream
             st = f'{i + 1}/{n}: {s}... '
             if urlparse(s).hostname in ('www.youtube.com', 'youtube.com', 'youtu.be'):  # if source is YouTube video
                 # YouTube format i.e. 'https://www.youtube.com/watch?v=Zgi9g1ksQHc' or 'https://youtu.be/Zgi9g1ksQHc'
@@ -368,35 +727,66 @@ class LoadStreams:
             self.frames[i] = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0) or float('inf')  # infinite stream fallback
             self.fps[i] = max((fps if math.isfinite(fps) else 0) % 100, 0) or 30  # 30 FPS fallback
 
-            _, self.imgs[i] = cap.read()  # guarantee first frame
-            self.threads[i] = Thread(target=self.update, args=([i, cap, s]), daemon=True)
+            _, im0s[i] = cap.read()  # guarantee first frame
+            caps[i], sources[i] = cap, s
             LOGGER.info(f"{st} Success ({self.frames[i]} frames {w}x{h} at {self.fps[i]:.2f} FPS)")
-            self.threads[i].start()
         LOGGER.info('')  # newline
 
         # check for common shapes
-        s = np.stack([letterbox(x, img_size, stride=stride, auto=auto)[0].shape for x in self.imgs])
+        s = np.stack([letterbox(x, img_size, stride=stride, auto=auto)[0].shape for x in im0s])
         self.rect = np.unique(s, axis=0).shape[0] == 1  # rect inference if all shapes equal
         self.auto = auto and self.rect
         self.transforms = transforms  # optional
         if not self.rect:
             LOGGER.warning('WARNING ⚠️ Stream shapes differ. For optimal performance supply similarly-shaped streams.')
 
+        # Start threads to read and preprocess frames from video streams
+        for i, (cap, s) in enumerate(zip(caps, sources)):
+            self._push(i, im0s[i])
+            self.threads[i] = Thread(target=self.update, args=([i, cap, s]), daemon=True)
+            self.threads[i].start()
+
+    def _preprocess(self, im0):
+        # Transform or letterbox an HWC BGR frame to a contiguous CHW RGB array
+        if self.transforms:
+            return self.transforms(im0)  # transforms
+        im = letterbox(im0, self.img_size, stride=self.stride, auto=self.auto)[0]  # padded resize
+        im = im.transpose((2, 0, 1))[::-1]  # HWC to CHW, BGR to RGB
+        return np.ascontiguousarray(im)  # contiguous
+
+    def _push(self, i, im0):
+        # Preprocess frame in the calling capture thread and append it to stream `i` ring buffer
+        im = self._preprocess(im0)
+        with self.cond:
+            self.seq[i] += 1
+            self.buffers[i].append((self.seq[i], time.time(), im, im0))
+            self.cond.notify_all()
+
     def update(self, i, cap, stream):
-        # Read stream `i` frames in daemon thread
+        # Read stream `i` frames in daemon thread, cap.grab() blocks until the next frame arrives
         n, f = 0, self.frames[i]  # frame number, frame array
-        while cap.isOpened() and n < f:
+        while self.running and cap.isOpened() and n < f:
             n += 1
             cap.grab()  # .read() = .grab() followed by .retrieve()
             if n % self.vid_stride == 0:
                 success, im = cap.retrieve()
                 if success:
-                    self.imgs[i] = im
+                    self._push(i, im)
                 else:
                     LOGGER.warning('WARNING ⚠️ Video stream unresponsive, please check your IP camera connection.')
-                    self.imgs[i] = np.zeros_like(self.imgs[i])
                     cap.open(stream)  # re-open stream if signal was lost
-            time.sleep(0.0)  # wait time
+        with self.cond:
+            self.cond.notify_all()  # wake readers to notice the finished stream
+
+    def _collect(self):
+        # Return indices and buffer entries of streams with a new, fresh enough frame, must hold self.cond
+        t = time.time()
+        ready = []
+        for i, buf in enumerate(self.buffers):
+            if buf and buf[-1][0] > self.last[i] and not (self.max_age and t - buf[-1][1] > self.max_age):
+                self.last[i] = buf[-1][0]
+                ready.append((i, buf[-1]))
+        return ready
 
     def __iter__(self):
         self.count = -1
@@ -404,19 +794,23 @@ class LoadStreams:
 
     def __next__(self):
         self.count += 1
-        if not all(x.is_alive() for x in self.threads) or cv2.waitKey(1) == ord('q'):  # q to quit
-            cv2.destroyAllWindows()
-            raise StopIteration
-
-        im0 = self.imgs.copy()
-        if self.transforms:
-            im = np.stack([self.transforms(x) for x in im0])  # transforms
-        else:
-            im = np.stack([letterbox(x, self.img_size, stride=self.stride, auto=self.auto)[0] for x in im0])  # resize
-            im = im[..., ::-1].transpose((0, 3, 1, 2))  # BGR to RGB, BHWC to BCHW
-            im = np.ascontiguousarray(im)  # contiguous
-
-        return self.sources, im, im0, None, ''
+        while True:
+            if not all(x.is_alive() for x in self.threads) or cv2.waitKey(1) == ord('q'):  # q to quit
+                self.running = False
+                for x in self.threads:
+                    x.join(timeout=1)  # let capture threads leave OpenCV calls before shutdown
+                cv2.destroyAllWindows()
+                raise StopIteration
+            with self.cond:
+                ready = self._collect()
+                if ready:
+                    break
+                self.cond.wait(timeout=1)  # block until a capture thread pushes a frame
+
+        self.indices = [i for i, _ in ready]
+        self.seqs, self.timestamps, ims, im0 = (list(x) for x in zip(*(entry for _, entry in ready)))
+        im = np.stack(ims)  # BCHW, preprocessed in capture threads
+        return [self.sources[i] for i in self.indices], im, im0, None, ''
 
     def __len__(self):
         return len(self.sources)  # 1E12 frames = 32 streams at 30 FPS for 30 years
@@ -428,9 +822,167 @@ def img2label_paths(img_paths):
     return [sb.join(x.rsplit(sa, 1)).rsplit('.', 1)[0] + '.txt' for x in img_paths]
 
 
+class SharedImageCache:
+    """ Image cache packed into one contiguous shared-memory arena, a /dev/shm-backed memmap with an offset/shape index
+
+    The first process on a node decodes and writes the arena, DDP ranks on the same node and DataLoader workers attach
+    zero-copy. Arena pages are shared file pages, so Python refcounts never copy them and RAM use stays 1x.
+    """
+    dir = Path('/dev/shm') if os.path.isdir('/dev/shm') else Path(tempfile.gettempdir())  # tmpfs on Linux
+
+    def __init__(self, key):
+        self.file = self.dir / f'yolov5-{key}.bin'
+        self.index_file = self.dir / f'yolov5-{key}.npy'  # (n, 6) offset, h, w, c, h0, w0, written last
+        self.tmp = None  # file object while writing
+        self.index, self.buf = [], None
+
+    def exists(self):
+        return self.index_file.exists()
+
+    def add(self, im, hw0):
+        # Append an image to the arena, in dataset index order
+        if self.tmp is None:
+            self.tmp = open(self.file.with_suffix(f'.{os.getpid()}.tmp'), 'wb')
+            atexit.register(self.unlink)  # the writer frees the arena on exit, attached processes keep their mapping
+        im = im if im.ndim == 3 else im[..., None]
+        self.index.append((self.tmp.tell(), *im.shape, *hw0))
+        self.tmp.write(np.ascontiguousarray(im).data)
+
+    def save(self):
+        # Publish the arena, the index is renamed last so readers never see a partial arena
+        self.tmp.close()
+        index = self.file.with_suffix(f'.{os.getpid()}.npy')
+        np.save(index, np.array(self.index, dtype=np.int64))
+        os.replace(self.tmp.name, self.file)
+        os.replace(index, self.index_file)
+        self.attach()
+
+    def attach(self):
+        self.index = np.load(self.index_file)
+        self.buf = np.memmap(self.file, dtype=np.uint8, mode='r')  # read-only, shared by every process mapping it
+        return self
+
+    def unlink(self):
+        for f in self.file, self.index_file, Path(self.tmp.name):
+            f.unlink(missing_ok=True)
+
+    def nbytes(self):
+        return self.buf.nbytes
+
+    def __getitem__(self, i):
+        # Returns (im, hw_original, hw_resized) with im a read-only view into the arena
+        o, h, w, c, h0, w0 = self.index[i]
+        im = np.ndarray((h, w, c), dtype=np.uint8, buffer=self.buf, offset=o)
+        return (im if c > 1 else im[..., 0]), (h0, w0), (h, w)
+
+    def __getstate__(self):
+        # Spawned DataLoader workers re-map the arena instead of pickling its contents
+        return {**self.__dict__, 'tmp': None, 'buf': None}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.exists():
+            self.buf = np.memmap(self.file, dtype=np.uint8, mode='r')
+
+
+class PackedShards:
+    """ Packed dataset written by pack_dataset(), shard-*.bin files of encoded images plus a pack.npz index
+
+    The index holds the (shard, offset, size) record of every image, its shape, labels and segments as flat arrays that
+    load without pickle. Records read in file order are served from large read-ahead chunks, so walking a shard costs
+    one read per chunk instead of an open() and read() per image. Other records are read on their own, exactly.
+
+    Shards are split into windows of 'window' consecutive records. Under PackedShardSampler (windowed=True) a read
+    loads the record's whole window at once and the last two windows are kept. The sampler shuffles within windows
+    and LoadImagesAndLabels draws mosaic and mixup partners from the same window, so a shuffled epoch reads every
+    window once per process.
+    """
+    index = 'pack.npz'
+    version = 1
+
+    def __init__(self, path, chunk=8 << 20, window=256):
+        self.path = Path(path)
+        with np.load(self.path / self.index) as x:
+            self.x = dict(x)  # shapes, labels and segments
+        v = int(self.x['version'])
+        assert v == self.version, f'{self.path / self.index} version {v} != {self.version}'
+        self.files = [str(self.path / f) for f in self.x['files']]  # virtual image paths, stems are the original ones
+        self.shards = [self.path / f for f in self.x['shards']]
+        self.records = self.x['records']  # (n, 3) shard, offset, size
+        self.chunk = chunk  # bytes per read-ahead
+        self.pid, self.fh, self.buf = None, {}, (-1, 0, b'')  # per-process file handles and current chunk
+        self.end = (-1, 0)  # shard and end offset of the last record read, the next record in file order starts there
+        self.windowed = False  # read whole windows, set by PackedShardSampler
+        self.cache, self.last = {}, -1  # {window: bytes} and the window read last
+
+        # Windows of 'window' consecutive records within each shard
+        r = self.records
+        order = np.lexsort((r[:, 1], r[:, 0]))  # file order
+        first = np.ones(len(r), bool)
+        first[1:] = np.diff(r[order, 0]) != 0  # first record of each shard
+        k = np.arange(len(r)) - np.maximum.accumulate(np.where(first, np.arange(len(r)), 0))  # position within shard
+        self.windows = np.empty(len(r), dtype=int)
+        self.windows[order] = np.cumsum(first | (k % window == 0)) - 1  # window of each record
+        start = np.flatnonzero(first | (k % window == 0))
+        end = np.append(start[1:], len(r)) - 1
+        self.spans = np.stack((r[order[start], 0], r[order[start], 1], r[order[end], 1] + r[order[end], 2]), 1)
+
+    @classmethod
+    def is_packed(cls, path):
+        return isinstance(path, (str, Path)) and (Path(path) / cls.index).is_file()
+
+    def labels_cache(self):
+        # Return the index in the LoadImagesAndLabels.cache_labels() layout
+        labels, segments = unflatten_labels(self.x)
+        counts = np.zeros((len(self.files), 4), np.int64)  # missing, found, empty, corrupt
+        counts[:, 1], counts[:, 2] = 1, self.x['nl'] == 0
+        return dict(files=self.files, labels=labels, shapes=self.x['shapes'], segments=segments, counts=counts,
+                    msgs=[''] * len(self.files))
+
+    def read(self, j):
+        # Return the encoded bytes of record j, from the current chunk when possible. A record that follows the previous
+        # one in its shard starts a read-ahead chunk, any other is read alone so random access reads no extra bytes
+        if self.pid != os.getpid():  # forked processes share file offsets, reopen
+            self.pid, self.fh, self.buf, self.end, self.cache = os.getpid(), {}, (-1, 0, b''), (-1, 0), {}
+        s, o, n = self.records[j].tolist()
+        if self.windowed:
+            return self.read_window(self.windows[j])[o - self.spans[self.windows[j], 1]:][:n]
+        bs, bo, b = self.buf
+        sequential = (s, o) == self.end
+        self.end = s, o + n
+        if s != bs or o < bo or o + n > bo + len(b):
+            if s not in self.fh:
+                self.fh[s] = open(self.shards[s], 'rb', buffering=0)
+            self.fh[s].seek(o)
+            b = self.fh[s].read(max(n, self.chunk) if sequential else n)
+            if not sequential:
+                return memoryview(b)  # keep the current chunk for the walk it belongs to
+            bo, self.buf = o, (s, o, b)
+        return memoryview(b)[o - bo:o - bo + n]
+
+    def read_window(self, w):
+        # Return the bytes of window w, read in one go and kept with the previously read window
+        if w not in self.cache:
+            s, start, end = self.spans[w].tolist()
+            if s not in self.fh:
+                self.fh[s] = open(self.shards[s], 'rb', buffering=0)
+            self.fh[s].seek(start)
+            self.cache = {k: v for k, v in self.cache.items() if k == self.last}  # drop all but the last window
+            self.cache[w] = memoryview(self.fh[s].read(end - start))
+        self.last = w
+        return self.cache[w]
+
+    def imread(self, j, size=None):
+        # Decode record j to a BGR image like cv2.imread(), see imdecode() for 'size'
+        return imdecode(self.read(j), size)
+
+    def __getstate__(self):
+        return {**self.__dict__, 'pid': None, 'fh': {}, 'buf': (-1, 0, b''), 'end': (-1, 0), 'cache': {}}
+
+
 class LoadImagesAndLabels(Dataset):
     # YOLOv5 train_loader/val_loader, loads images and labels for training and validation
-    cache_version = 0.6  # dataset labels *.cache version
+    cache_version = 0.7  # dataset labels *.cache version
     rand_interp_methods = [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_LANCZOS4]
 
     def __init__(self,
@@ -446,67 +998,75 @@ class LoadImagesAndLabels(Dataset):
                  stride=32,
                  pad=0.0,
                  min_items=0,
-                 prefix=''):
+                 prefix='',
+                 batch_augment=False):
         self.img_size = img_size
         self.augment = augment
+        self.batch_augment = augment and batch_augment  # leave warps, mixup, HSV and flips to BatchAugment
         self.hyp = hyp
         self.image_weights = image_weights
         self.rect = False if image_weights else rect
         self.mosaic = self.augment and not self.rect  # load 4 images at a time into a mosaic (only during training)
         self.mosaic_border = [-img_size // 2, -img_size // 2]
+        self.mosaic_buffers = []  # reused load_mosaic() outputs
         self.stride = stride
         self.path = path
         self.albumentations = Albumentations(size=img_size) if augment else None
+        check_imread_backend()
 
-        try:
-            f = []  # image files
-            for p in path if isinstance(path, list) else [path]:
-                p = Path(p)  # os-agnostic
-                if p.is_dir():  # dir
-                    f += glob.glob(str(p / '**' / '*.*'), recursive=True)
-                    # f = list(p.rglob('*.*'))  # pathlib
-                elif p.is_file():  # file
-                    with open(p) as t:
-                        t = t.read().strip().splitlines()
-                        parent = str(p.parent) + os.sep
-                        f += [x.replace('./', parent, 1) if x.startswith('./') else x for x in t]  # to global path
-                        # f += [p.parent / x.lstrip(os.sep) for x in t]  # to global path (pathlib)
-                else:
-                    raise FileNotFoundError(f'{prefix}{p} does not exist')
-            self.im_files = sorted(x.replace('/', os.sep) for x in f if x.split('.')[-1].lower() in IMG_FORMATS)
-            # self.img_files = sorted([x for x in f if x.suffix[1:].lower() in IMG_FORMATS])  # pathlib
-            assert self.im_files, f'{prefix}No images found'
-        except Exception as e:
-            raise Exception(f'{prefix}Error loading data from {path}: {e}\n{HELP_URL}') from e
-
-        # Check cache
-        self.label_files = img2label_paths(self.im_files)  # labels
-        cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')
-        try:
-            cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
-            assert cache['version'] == self.cache_version  # matches current version
-            assert cache['hash'] == get_hash(self.label_files + self.im_files)  # identical hash
-        except Exception:
-            cache, exists = self.cache_labels(cache_path, prefix), False  # run cache ops
+        self.packed = PackedShards(path) if PackedShards.is_packed(path) else None
+        if self.packed:  # packed shards, labels come from the pack index
+            cache, exists, cache_path = self.packed.labels_cache(), True, self.packed.path / PackedShards.index
+        else:
+            try:
+                f = []  # image files
+                for p in path if isinstance(path, list) else [path]:
+                    p = Path(p)  # os-agnostic
+                    if p.is_dir():  # dir
+                        f += glob.glob(str(p / '**' / '*.*'), recursive=True)
+                        # f = list(p.rglob('*.*'))  # pathlib
+                    elif p.is_file():  # file
+                        with open(p) as t:
+                            t = t.read().strip().splitlines()
+                            parent = str(p.parent) + os.sep
+                            f += [x.replace('./', parent, 1) if x.startswith('./') else x for x in t]  # to global path
+                            # f += [p.parent / x.lstrip(os.sep) for x in t]  # to global path (pathlib)
+                    else:
+                        raise FileNotFoundError(f'{prefix}{p} does not exist')
+                self.im_files = sorted(x.replace('/', os.sep) for x in f if x.split('.')[-1].lower() in IMG_FORMATS)
+                # self.img_files = sorted([x for x in f if x.suffix[1:].lower() in IMG_FORMATS])  # pathlib
+                assert self.im_files, f'{prefix}No images found'
+            except Exception as e:
+                raise Exception(f'{prefix}Error loading data from {path}: {e}\n{HELP_URL}') from e
+
+            # Check cache, only new or changed images and labels are verified
+            self.label_files = img2label_paths(self.im_files)  # labels
+            cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix('.cache')
+            cache, exists = self.cache_labels(cache_path, prefix)
+
+        self.cache_path = cache_path  # utils/audit.py saves dataset statistics next to it
+        self.stats = None  # utils/audit.py dataset_stats()
 
         # Display cache
-        nf, nm, ne, nc, n = cache.pop('results')  # found, missing, empty, corrupt, total
+        nm, nf, ne, nc = cache['counts'].sum(0).tolist()  # missing, found, empty, corrupt
+        n = len(cache['files'])  # total
         if exists and LOCAL_RANK in {-1, 0}:
             d = f"Scanning {cache_path}... {nf} images, {nm + ne} backgrounds, {nc} corrupt"
             tqdm(None, desc=prefix + d, total=n, initial=n, bar_format=TQDM_BAR_FORMAT)  # display cache results
-            if cache['msgs']:
-                LOGGER.info('\n'.join(cache['msgs']))  # display warnings
+            msgs = [x for x in cache['msgs'] if x]
+            if msgs:
+                LOGGER.info('\n'.join(msgs))  # display warnings
         assert nf > 0 or not augment, f'{prefix}No labels found in {cache_path}, can not start training. {HELP_URL}'
 
         # Read cache
-        [cache.pop(k) for k in ('hash', 'version', 'msgs')]  # remove items
-        labels, shapes, self.segments = zip(*cache.values())
-        nl = len(np.concatenate(labels, 0))  # number of labels
+        ok = np.flatnonzero(cache['counts'][:, 3] == 0)  # drop corrupt images
+        self.labels = [cache['labels'][i] for i in ok]
+        self.segments = [cache['segments'][i] for i in ok]
+        nl = sum(len(x) for x in self.labels)  # number of labels
         assert nl > 0 or not augment, f'{prefix}All labels empty in {cache_path}, can not start training. {HELP_URL}'
-        self.labels = list(labels)
-        self.shapes = np.array(shapes)
-        self.im_files = list(cache.keys())  # update
-        self.label_files = img2label_paths(cache.keys())  # update
+        self.shapes = np.asarray(cache['shapes'])[ok]
+        self.im_files = [str(cache['files'][i]) for i in ok]  # update
+        self.label_files = img2label_paths(self.im_files)  # update
 
         # Filter images
         if min_items:
@@ -565,37 +1125,70 @@ class LoadImagesAndLabels(Dataset):
 
             self.batch_shapes = np.ceil(np.array(shapes) * img_size / stride + pad).astype(int) * stride
 
-        # Cache images into RAM/disk for faster training
-        if cache_images == 'ram' and not self.check_cache_ram(prefix=prefix):
-            cache_images = False
+        # Packed records of the filtered and sorted images
+        if self.packed:
+            j = {f: i for i, f in enumerate(self.packed.files)}
+            self.pack_index = np.array([j[f] for f in self.im_files], dtype=int)
+            self.pack_window = self.packed.windows[self.pack_index]  # read window of each image
+            order = np.argsort(self.pack_window, kind='stable')
+            w = np.searchsorted(self.pack_window[order], range(1, len(self.packed.spans)))
+            self.pack_windows = np.split(order, w)  # images of each read window
+            if cache_images in ('disk', 'disk-resized'):
+                LOGGER.info(f'{prefix}--cache {cache_images} is not supported for packed datasets, not caching images')
+                cache_images = False
+
+        # Cache images into RAM/shared memory/disk for faster training
+        self.shm = None
+        if cache_images == 'shm':  # keyed by images and resize settings, so DDP ranks on a node share one arena
+            self.shm = SharedImageCache(get_hash(self.im_files + [str(self.img_size), str(self.augment)]))
+            if self.shm.exists():  # written by another rank or run on this node
+                self.shm.attach()
+                LOGGER.info(f'{prefix}Attached to shared image cache {self.shm.file} ({self.shm.nbytes() / 1E9:.1f}GB)')
+                cache_images = False
+        if cache_images in ('ram', 'shm') and not self.check_cache_ram(prefix=prefix, shm=cache_images == 'shm'):
+            cache_images, self.shm = False, None
         self.ims = [None] * n
         self.npy_files = [Path(f).with_suffix('.npy') for f in self.im_files]
+        self.rsz_files = None  # *.r640.cache training JPEGs, *.r640.npy validation arrays, both resized to img_size
+        if cache_images == 'disk-resized':  # not image suffixes, so dataset globs never pick these up
+            r = f'.r{self.img_size}.{"cache" if self.augment else "npy"}'
+            self.rsz_files = [Path(f).with_suffix(r) for f in self.im_files]
         if cache_images:
             b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
             self.im_hw0, self.im_hw = [None] * n, [None] * n
-            fcn = self.cache_images_to_disk if cache_images == 'disk' else self.load_image
+            fcn = {
+                'disk': self.cache_images_to_disk,
+                'disk-resized': self.cache_resized_to_disk}.get(cache_images, self.load_image)
             results = ThreadPool(NUM_THREADS).imap(fcn, range(n))
             pbar = tqdm(enumerate(results), total=n, bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
             for i, x in pbar:
                 if cache_images == 'disk':
                     b += self.npy_files[i].stat().st_size
+                elif cache_images == 'disk-resized':
+                    b += self.rsz_files[i].stat().st_size
+                elif cache_images == 'shm':
+                    self.shm.add(x[0], x[1])  # in index order, imap preserves it
+                    b += x[0].nbytes
                 else:  # 'ram'
                     self.ims[i], self.im_hw0[i], self.im_hw[i] = x  # im, hw_orig, hw_resized = load_image(self, i)
                     b += self.ims[i].nbytes
                 pbar.desc = f'{prefix}Caching images ({b / gb:.1f}GB {cache_images})'
             pbar.close()
-
-    def check_cache_ram(self, safety_margin=0.1, prefix=''):
-        # Check image caching requirements vs available memory
-        b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
-        n = min(self.n, 30)  # extrapolate from 30 random images
-        for _ in range(n):
-            im = cv2.imread(random.choice(self.im_files))  # sample image
-            ratio = self.img_size / max(im.shape[0], im.shape[1])  # max(h, w)  # ratio
-            b += im.nbytes * ratio ** 2
-        mem_required = b * self.n / n  # GB required to cache dataset into RAM
+            if cache_images == 'shm':
+                self.shm.save()
+
+    def check_cache_ram(self, safety_margin=0.1, prefix='', shm=False):
+        # Check image caching requirements vs available memory, and vs free shared memory if shm
+        gb = 1 << 30  # bytes per gigabytes
+        ratio = self.img_size / self.shapes.max(1)  # resize ratios from the scanned shapes, no images are decoded
+        mem_required = (self.shapes.prod(1) * 3 * ratio ** 2).sum()  # GB required to cache dataset into RAM, BGR
         mem = psutil.virtual_memory()
         cache = mem_required * (1 + safety_margin) < mem.available  # to cache or not to cache, that is the question
+        if shm:  # /dev/shm is often much smaller than RAM in containers, i.e. docker run --shm-size
+            free = shutil.disk_usage(SharedImageCache.dir).free
+            cache = cache and mem_required * (1 + safety_margin) < free
+            if not cache:
+                LOGGER.info(f'{prefix}{free / gb:.1f}GB shared memory free, increase it with docker --shm-size')
         if not cache:
             LOGGER.info(f"{prefix}{mem_required / gb:.1f}GB RAM required, "
                         f"{mem.available / gb:.1f}/{mem.total / gb:.1f}GB available, "
@@ -603,42 +1196,73 @@ class LoadImagesAndLabels(Dataset):
         return cache
 
     def cache_labels(self, path=Path('./labels.cache'), prefix=''):
-        # Cache dataset labels, check images and read shapes
-        x = {}  # dict
-        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
-        desc = f"{prefix}Scanning {path.parent / path.stem}..."
-        with Pool(NUM_THREADS) as pool:
-            pbar = tqdm(pool.imap(verify_image_label, zip(self.im_files, self.label_files, repeat(prefix))),
-                        desc=desc,
-                        total=len(self.im_files),
-                        bar_format=TQDM_BAR_FORMAT)
-            for im_file, lb, shape, segments, nm_f, nf_f, ne_f, nc_f, msg in pbar:
+        # Cache dataset labels, check images and read shapes, returns (cache, True if the cache was up to date)
+        # Entries whose image and label sizes and mtimes are unchanged are reused, only new or changed ones are verified
+        # and deleted ones are dropped. The cache is an npz of flat arrays that loads without pickle.
+        n = len(self.im_files)
+        stat = np.concatenate((file_stats(self.im_files), file_stats(self.label_files)), 1)  # sizes and mtimes
+        x = dict(files=self.im_files,
+                 labels=[np.zeros((0, 5), np.float32)] * n,
+                 shapes=np.zeros((n, 2), np.int64),
+                 segments=[[]] * n,
+                 counts=np.zeros((n, 4), np.int64),  # missing, found, empty, corrupt
+                 msgs=[''] * n)
+        todo, changed = np.arange(n), True
+        with contextlib.suppress(Exception):  # missing, unreadable or older cache
+            with np.load(path) as c:
+                c = dict(c)
+            assert c['version'] == self.cache_version  # matches current version
+            j = {f: i for i, f in enumerate(c['files'].tolist())}
+            k = np.array([j.get(f, -1) for f in self.im_files], dtype=np.int64)  # cache index of each image
+            reuse = (k >= 0) & (c['stat'][k] == stat).all(1)
+            labels, segments = unflatten_labels(c)
+            for i in np.flatnonzero(reuse):
+                x['labels'][i], x['segments'][i], x['msgs'][i] = labels[k[i]], segments[k[i]], str(c['msgs'][k[i]])
+            x['shapes'][reuse], x['counts'][reuse] = c['shapes'][k[reuse]], c['counts'][k[reuse]]
+            todo = np.flatnonzero(~reuse)
+            changed = len(todo) > 0 or len(c['files']) != n  # new, changed or deleted files
+
+        if len(todo):
+            msgs = []
+            nm, nf, ne, nc = x['counts'].sum(0).tolist()  # number missing, found, empty, corrupt
+            desc = f"{prefix}Scanning {path.parent / path.stem}..."
+            scan = verify_image_labels([self.im_files[i] for i in todo], [self.label_files[i] for i in todo], prefix)
+            pbar = tqdm(scan, desc=desc, total=len(todo), bar_format=TQDM_BAR_FORMAT)
+            for j, (im_file, lb, shape, segments, nm_f, nf_f, ne_f, nc_f, msg) in pbar:
+                i = todo[j]
                 nm += nm_f
                 nf += nf_f
                 ne += ne_f
                 nc += nc_f
                 if im_file:
-                    x[im_file] = [lb, shape, segments]
+                    x['labels'][i], x['shapes'][i], x['segments'][i] = lb, shape, segments
+                x['counts'][i], x['msgs'][i] = (nm_f, nf_f, ne_f, nc_f), msg
                 if msg:
                     msgs.append(msg)
                 pbar.desc = f"{desc} {nf} images, {nm + ne} backgrounds, {nc} corrupt"
 
-        pbar.close()
-        if msgs:
-            LOGGER.info('\n'.join(msgs))
-        if nf == 0:
-            LOGGER.warning(f'{prefix}WARNING ⚠️ No labels found in {path}. {HELP_URL}')
-        x['hash'] = get_hash(self.label_files + self.im_files)
-        x['results'] = nf, nm, ne, nc, len(self.im_files)
-        x['msgs'] = msgs  # warnings
-        x['version'] = self.cache_version  # cache version
-        try:
-            np.save(path, x)  # save cache for next time
-            path.with_suffix('.cache.npy').rename(path)  # remove .npy suffix
-            LOGGER.info(f'{prefix}New cache created: {path}')
-        except Exception as e:
-            LOGGER.warning(f'{prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable: {e}')  # not writeable
-        return x
+            pbar.close()
+            if msgs:
+                LOGGER.info('\n'.join(msgs))
+            if nf == 0:
+                LOGGER.warning(f'{prefix}WARNING ⚠️ No labels found in {path}. {HELP_URL}')
+        if changed:
+            try:
+                tmp = path.with_suffix('.cache.tmp')
+                with open(tmp, 'wb') as f:  # file object, np.savez() would append .npz to a path
+                    np.savez(f,
+                             version=self.cache_version,
+                             files=np.array(self.im_files),
+                             stat=stat,
+                             shapes=x['shapes'],
+                             counts=x['counts'],
+                             msgs=np.array(x['msgs']),
+                             **flatten_labels(x['labels'], x['segments']))
+                os.replace(tmp, path)  # readers never see a partial cache
+                LOGGER.info(f'{prefix}{"New cache created" if len(todo) == n else "Cache updated"}: {path}')
+            except Exception as e:
+                LOGGER.warning(f'{prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable: {e}')
+        return x, not len(todo)
 
     def __len__(self):
         return len(self.im_files)
@@ -660,8 +1284,8 @@ class LoadImagesAndLabels(Dataset):
             shapes = None
 
             # MixUp augmentation
-            if random.random() < hyp['mixup']:
-                img, labels = mixup(img, labels, *self.load_mosaic(random.randint(0, self.n - 1)))
+            if not self.batch_augment and random.random() < hyp['mixup']:
+                img, labels = mixup(img, labels, *self.load_mosaic(random.choice(self.partners(index))))
 
         else:
             # Load image
@@ -676,7 +1300,12 @@ class LoadImagesAndLabels(Dataset):
             if labels.size:  # normalized xywh to pixel xyxy format
                 labels[:, 1:] = xywhn2xyxy(labels[:, 1:], ratio[0] * w, ratio[1] * h, padw=pad[0], padh=pad[1])
 
-            if self.augment:
+            if self.batch_augment and self.mosaic and hyp['mosaic'] > 0:  # center on a mosaic canvas
+                s = self.img_size
+                img4 = np.full((s * 2, s * 2, img.shape[2]), 114, dtype=np.uint8)
+                img4[s // 2:s // 2 + img.shape[0], s // 2:s // 2 + img.shape[1]] = img
+                img, labels[:, 1:] = img4, labels[:, 1:] + s // 2  # centered like a letterbox warp
+            elif self.augment and not self.batch_augment:
                 img, labels = random_perspective(img,
                                                  labels,
                                                  degrees=hyp['degrees'],
@@ -694,6 +1323,7 @@ class LoadImagesAndLabels(Dataset):
             img, labels = self.albumentations(img, labels)
             nl = len(labels)  # update after albumentations
 
+        if self.augment and not self.batch_augment:
             # HSV color-space
             augment_hsv(img, hgain=hyp['hsv_h'], sgain=hyp['hsv_s'], vgain=hyp['hsv_v'])
 
@@ -725,18 +1355,26 @@ class LoadImagesAndLabels(Dataset):
 
     def load_image(self, i):
         # Loads 1 image from dataset index 'i', returns (im, original hw, resized hw)
+        if self.shm is not None and self.shm.buf is not None:  # shared memory arena
+            return self.shm[i]
         im, f, fn = self.ims[i], self.im_files[i], self.npy_files[i],
         if im is None:  # not cached in RAM
-            if fn.exists():  # load npy
+            if self.rsz_files is not None and self.rsz_files[i].exists():  # resized disk cache
+                r = self.rsz_files[i]
+                im = np.load(r) if r.suffix == '.npy' else imread(r)  # BGR, already at img_size
+                return im, tuple(int(x) for x in self.shapes[i][::-1]), im.shape[:2]  # im, hw_original, hw_resized
+            if self.packed is None and fn.exists():  # load npy
                 im = np.load(fn)
+                h0, w0 = im.shape[:2]  # orig hw
             else:  # read image
-                im = cv2.imread(f)  # BGR
-                assert im is not None, f'Image Not Found {f}'
-            h0, w0 = im.shape[:2]  # orig hw
-            r = self.img_size / max(h0, w0)  # ratio
+                im = self.imread(i)  # BGR
+                assert im is not None, f'Image Not Found {f}, check images with python utils/audit.py --decode'
+                h0, w0 = (int(x) for x in self.shapes[i][::-1])  # orig hw, from the header scan
+            h, w = im.shape[:2]  # decoded hw
+            r = self.img_size / max(h, w)  # ratio
             if r != 1:  # if sizes are not equal
                 interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
-                im = cv2.resize(im, (int(w0 * r), int(h0 * r)), interpolation=interp)
+                im = cv2.resize(im, (int(w * r), int(h * r)), interpolation=interp)
             return im, (h0, w0), im.shape[:2]  # im, hw_original, hw_resized
         return self.ims[i], self.im_hw0[i], self.im_hw[i]  # im, hw_original, hw_resized
 
@@ -744,14 +1382,39 @@ class LoadImagesAndLabels(Dataset):
         # Saves an image as an *.npy file for faster loading
         f = self.npy_files[i]
         if not f.exists():
-            np.save(f.as_posix(), cv2.imread(self.im_files[i]))
+            np.save(f.as_posix(), imread(self.im_files[i]))  # full size, load_image() resizes *.npy files
+
+    def cache_resized_to_disk(self, i):
+        # Saves an image resized to img_size, as quality 95 JPEG for training where augmentation dominates the loss and
+        # as an uncompressed *.npy for validation so mAP is unchanged, PNG decodes several times slower than either
+        f = self.rsz_files[i]
+        if not f.exists():
+            im, t = self.load_image(i)[0], f.with_suffix('.tmp')
+            with open(t, 'wb') as x:
+                if self.augment:
+                    x.write(cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes())
+                else:
+                    np.save(x, im)
+            os.replace(t, f)  # never leave a truncated file behind
+
+    def imread(self, i):
+        # Reads image 'i' as BGR from its file or from the packed shards. Training JPEGs are decoded at a DCT scale that
+        # keeps their long side >= img_size, validation ones at full size so mAP is unchanged
+        size = self.img_size if self.augment else None
+        return imread(self.im_files[i], size) if self.packed is None else self.packed.imread(self.pack_index[i], size)
+
+    def partners(self, index):
+        # Images to draw mosaic and mixup partners of image 'index' from, its own read window for windowed packed shards
+        if self.packed is not None and self.packed.windowed:
+            return self.pack_windows[self.pack_window[index]]
+        return self.indices
 
     def load_mosaic(self, index):
         # YOLOv5 4-mosaic loader. Loads 1 image + 3 random images into a 4-image mosaic
-        labels4, segments4 = [], []
+        tiles, pads = [], []
         s = self.img_size
         yc, xc = (int(random.uniform(-x, 2 * s + x)) for x in self.mosaic_border)  # mosaic center x, y
-        indices = [index] + random.choices(self.indices, k=3)  # 3 additional image indices
+        indices = [index] + random.choices(self.partners(index), k=3)  # 3 additional image indices
         random.shuffle(indices)
         for i, index in enumerate(indices):
             # Load image
@@ -759,7 +1422,6 @@ class LoadImagesAndLabels(Dataset):
 
             # place img in img4
             if i == 0:  # top left
-                img4 = np.full((s * 2, s * 2, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
                 x1a, y1a, x2a, y2a = max(xc - w, 0), max(yc - h, 0), xc, yc  # xmin, ymin, xmax, ymax (large image)
                 x1b, y1b, x2b, y2b = w - (x2a - x1a), h - (y2a - y1a), w, h  # xmin, ymin, xmax, ymax (small image)
             elif i == 1:  # top right
@@ -772,43 +1434,16 @@ class LoadImagesAndLabels(Dataset):
                 x1a, y1a, x2a, y2a = xc, yc, min(xc + w, s * 2), min(s * 2, yc + h)
                 x1b, y1b, x2b, y2b = 0, 0, min(w, x2a - x1a), min(y2a - y1a, h)
 
-            img4[y1a:y2a, x1a:x2a] = img[y1b:y2b, x1b:x2b]  # img4[ymin:ymax, xmin:xmax]
-            padw = x1a - x1b
-            padh = y1a - y1b
-
-            # Labels
-            labels, segments = self.labels[index].copy(), self.segments[index].copy()
-            if labels.size:
-                labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padw, padh)  # normalized xywh to pixel xyxy format
-                segments = [xyn2xy(x, w, h, padw, padh) for x in segments]
-            labels4.append(labels)
-            segments4.extend(segments)
-
-        # Concat/clip labels
-        labels4 = np.concatenate(labels4, 0)
-        for x in (labels4[:, 1:], *segments4):
-            np.clip(x, 0, 2 * s, out=x)  # clip when using random_perspective()
-        # img4, labels4 = replicate(img4, labels4)  # replicate
-
-        # Augment
-        img4, labels4, segments4 = copy_paste(img4, labels4, segments4, p=self.hyp['copy_paste'])
-        img4, labels4 = random_perspective(img4,
-                                           labels4,
-                                           segments4,
-                                           degrees=self.hyp['degrees'],
-                                           translate=self.hyp['translate'],
-                                           scale=self.hyp['scale'],
-                                           shear=self.hyp['shear'],
-                                           perspective=self.hyp['perspective'],
-                                           border=self.mosaic_border)  # border to remove
-
-        return img4, labels4
+            tiles.append((img[y1b:y2b, x1b:x2b], x1a, y1a))  # img4[ymin:ymax, xmin:xmax]
+            pads.append((w, h, x1a - x1b, y1a - y1b))
+
+        return self.mosaic_warp(indices, tiles, pads, s * 2)
 
     def load_mosaic9(self, index):
         # YOLOv5 9-mosaic loader. Loads 1 image + 8 random images into a 9-image mosaic
-        labels9, segments9 = [], []
+        tiles, pads = [], []
         s = self.img_size
-        indices = [index] + random.choices(self.indices, k=8)  # 8 additional image indices
+        indices = [index] + random.choices(self.partners(index), k=8)  # 8 additional image indices
         random.shuffle(indices)
         hp, wp = -1, -1  # height, width previous
         for i, index in enumerate(indices):
@@ -817,7 +1452,6 @@ class LoadImagesAndLabels(Dataset):
 
             # place img in img9
             if i == 0:  # center
-                img9 = np.full((s * 3, s * 3, img.shape[2]), 114, dtype=np.uint8)  # base image with 4 tiles
                 h0, w0 = h, w
                 c = s, s, s + w, s + h  # xmin, ymin, xmax, ymax (base) coordinates
             elif i == 1:  # top
@@ -837,56 +1471,74 @@ class LoadImagesAndLabels(Dataset):
             elif i == 8:  # top left
                 c = s - w, s + h0 - hp - h, s, s + h0 - hp
 
-            padx, pady = c[:2]
-            x1, y1, x2, y2 = (max(x, 0) for x in c)  # allocate coords
-
-            # Labels
-            labels, segments = self.labels[index].copy(), self.segments[index].copy()
-            if labels.size:
-                labels[:, 1:] = xywhn2xyxy(labels[:, 1:], w, h, padx, pady)  # normalized xywh to pixel xyxy format
-                segments = [xyn2xy(x, w, h, padx, pady) for x in segments]
-            labels9.append(labels)
-            segments9.extend(segments)
-
-            # Image
-            img9[y1:y2, x1:x2] = img[y1 - pady:, x1 - padx:]  # img9[ymin:ymax, xmin:xmax]
+            tiles.append((img, c))
             hp, wp = h, w  # height, width previous
 
-        # Offset
+        # Offset, crop tiles to the 2 * s window at xc, yc of the 3 * s canvas
         yc, xc = (int(random.uniform(0, s)) for _ in self.mosaic_border)  # mosaic center x, y
-        img9 = img9[yc:yc + 2 * s, xc:xc + 2 * s]
-
-        # Concat/clip labels
-        labels9 = np.concatenate(labels9, 0)
-        labels9[:, [1, 3]] -= xc
-        labels9[:, [2, 4]] -= yc
-        c = np.array([xc, yc])  # centers
-        segments9 = [x - c for x in segments9]
-
-        for x in (labels9[:, 1:], *segments9):
-            np.clip(x, 0, 2 * s, out=x)  # clip when using random_perspective()
-        # img9, labels9 = replicate(img9, labels9)  # replicate
-
-        # Augment
-        img9, labels9, segments9 = copy_paste(img9, labels9, segments9, p=self.hyp['copy_paste'])
-        img9, labels9 = random_perspective(img9,
-                                           labels9,
-                                           segments9,
-                                           degrees=self.hyp['degrees'],
-                                           translate=self.hyp['translate'],
-                                           scale=self.hyp['scale'],
-                                           shear=self.hyp['shear'],
-                                           perspective=self.hyp['perspective'],
-                                           border=self.mosaic_border)  # border to remove
-
-        return img9, labels9
+        for i, (img, (padx, pady, x2, y2)) in enumerate(tiles):
+            x1, y1 = max(padx, xc), max(pady, yc)  # allocate coords
+            x2, y2 = max(min(x2, xc + 2 * s), x1), max(min(y2, yc + 2 * s), y1)
+            tiles[i] = img[y1 - pady:y2 - pady, x1 - padx:x2 - padx], x1 - xc, y1 - yc
+            pads.append((img.shape[1], img.shape[0], padx - xc, pady - yc))
+        return self.mosaic_warp(indices, tiles, pads, s * 2)
+
+    def mosaic_warp(self, indices, tiles, pads, size):
+        # Warp mosaic tiles (im, x, y) of a size x size canvas to img_size with random_perspective(), pads are the
+        # (w, h, padw, padh) label transforms of each tile. Tiles are warped straight into a per-worker buffer that is
+        # reused by the next-but-one call, unless copy_paste() or BatchAugment need the canvas
+        hyp = self.hyp
+        pads = np.array(pads, dtype=np.float32)
+        labels = np.concatenate([self.labels[i] for i in indices], 0)
+        p = np.repeat(pads, [len(self.labels[i]) for i in indices], 0).T
+        labels[:, 1:] = xywhn2xyxy(labels[:, 1:], *p)  # normalized xywh to pixel xyxy format
+        segments = [x for i in indices for x in self.segments[i]]
+        if segments:
+            p = np.repeat(pads, [len(self.segments[i]) for i in indices], 0)
+            k = [len(x) for x in segments]  # points per segment
+            segments = np.split(xyn2xy(np.concatenate(segments, 0), *np.repeat(p, k, 0).T), np.cumsum(k)[:-1])
+
+        # Clip labels
+        for x in (labels[:, 1:], *segments):
+            np.clip(x, 0, size, out=x)  # clip when using random_perspective()
+
+        if self.batch_augment or (hyp['copy_paste'] and segments):  # assemble the canvas
+            img = np.full((size, size, 3), 114, dtype=np.uint8)
+            for x, x1, y1 in tiles:
+                img[y1:y1 + x.shape[0], x1:x1 + x.shape[1]] = x
+            img, labels, segments = copy_paste(img, labels, segments, p=hyp['copy_paste'])
+            if self.batch_augment:
+                return img, labels  # size x size canvas, warped to img_size by BatchAugment
+            return random_perspective(img,
+                                      labels,
+                                      segments,
+                                      degrees=hyp['degrees'],
+                                      translate=hyp['translate'],
+                                      scale=hyp['scale'],
+                                      shear=hyp['shear'],
+                                      perspective=hyp['perspective'],
+                                      border=self.mosaic_border)  # border to remove
+
+        M, s, (h, w) = random_perspective_matrix((size, size),
+                                                 degrees=hyp['degrees'],
+                                                 translate=hyp['translate'],
+                                                 scale=hyp['scale'],
+                                                 shear=hyp['shear'],
+                                                 perspective=hyp['perspective'],
+                                                 border=self.mosaic_border)  # border to remove
+        b = self.mosaic_buffers  # last two outputs, mixup holds the previous one
+        img = b[0] if len(b) == 2 and b[0].shape == (h, w, 3) else np.empty((h, w, 3), dtype=np.uint8)
+        self.mosaic_buffers = [*b[-1:], img]
+        img[:] = 114
+        warp_tiles(img, tiles, M, hyp['perspective'])
+        return img, warp_targets(labels, segments, M, s, w, h)
 
     @staticmethod
     def collate_fn(batch):
         im, label, path, shapes = zip(*batch)  # transposed
         for i, lb in enumerate(label):
             lb[:, 0] = i  # add target image index for build_targets()
-        return torch.stack(im, 0), torch.cat(label, 0), path, shapes
+        return torch.stack(im, 0, out=shared_batch(im)), torch.cat(label, 0), path, shapes
 
     @staticmethod
     def collate_fn4(batch):
@@ -915,7 +1567,36 @@ class LoadImagesAndLabels(Dataset):
         return torch.stack(im4, 0), torch.cat(label4, 0), path4, shapes4
 
 
+class LoadCalibration:
+    # YOLOv5 INT8 calibration batches, i.e. LoadCalibration(check_dataset(data)['val'], shape=(1, 3, 640, 640))
+    def __init__(self, path, shape=(1, 3, 640, 640), n=300, prefix=''):
+        self.batch_size, _, *self.hw = shape  # static export input shape BCHW
+        self.dataset = LoadImagesAndLabels(path, img_size=max(self.hw), batch_size=self.batch_size, prefix=prefix)
+        self.n = max(min(n, len(self.dataset)) // self.batch_size, 1)  # number of batches
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        # Return batch i as a float32 BCHW RGB 0-1 array letterboxed to the export input shape
+        if i >= self.n:
+            raise IndexError(i)
+        j = range(i * self.batch_size, (i + 1) * self.batch_size)
+        im = np.stack([letterbox(self.dataset.load_image(k % len(self.dataset))[0], self.hw, auto=False)[0] for k in j])
+        im = np.ascontiguousarray(im.transpose((0, 3, 1, 2))[:, ::-1])  # BHWC to BCHW, BGR to RGB
+        return im.astype(np.float32) / 255  # uint8 to fp32, 0 - 255 to 0.0 - 1.0
+
+
 # Ancillary functions --------------------------------------------------------------------------------------------------
+def shared_batch(ims):
+    # Uninitialized batch for torch.stack(ims, out=...), in shared memory in DataLoader workers so it reaches the main
+    # process without another copy, None in the main process
+    if torch.utils.data.get_worker_info() is None:
+        return None
+    x = ims[0]
+    return x.new(x.untyped_storage()._new_shared(x.nbytes * len(ims))).view(len(ims), *x.shape)
+
+
 def flatten_recursive(path=DATASETS_DIR / 'coco128'):
     # Flatten a recursive directory by bringing all files to top level
     new_path = Path(f'{str(path)}_flat')
@@ -986,23 +1667,58 @@ def autosplit(path=DATASETS_DIR / 'coco128/images', weights=(0.9, 0.1, 0.0), ann
                 f.write(f'./{img.relative_to(path.parent).as_posix()}' + '\n')  # add image to txt file
 
 
+def pack_dataset(path=DATASETS_DIR / 'coco128/images/train2017', out=None, shard_size=1 << 30):
+    """ Pack a YOLO-format dataset into shard files of encoded images plus one index of records, labels and segments
+    Usage: from utils.dataloaders import *; pack_dataset('../datasets/coco/train2017.txt', '../datasets/coco/packed'),
+    then point train: or val: in the dataset yaml at the output directory
+    Arguments
+        path:        Images directory or *.txt image list, as in a dataset yaml
+        out:         Output directory, defaults to path + '_packed'
+        shard_size:  Bytes per shard file
+    """
+    dataset = LoadImagesAndLabels(path, prefix=colorstr('pack: '))  # verified labels and shapes from the *.cache
+    path = Path(path)
+    out = Path(out) if out else path.with_name(f'{path.stem}_packed')
+    out.mkdir(parents=True, exist_ok=True)
+    root = os.path.commonpath([os.path.dirname(f) for f in dataset.im_files])
+
+    shards, records, f = [], [], None
+    for im_file in tqdm(dataset.im_files, desc=f'Packing {path} to {out}', bar_format=TQDM_BAR_FORMAT):
+        if f is None or f.tell() >= shard_size:
+            if f:
+                f.close()
+            shards.append(f'shard-{len(shards):05d}.bin')
+            f = open(out / shards[-1], 'wb')
+        with open(im_file, 'rb') as x:
+            b = x.read()
+        records.append((len(shards) - 1, f.tell(), len(b)))
+        f.write(b)
+    f.close()
+
+    np.savez(out / PackedShards.index,
+             version=PackedShards.version,
+             files=np.array([os.path.relpath(x, root) for x in dataset.im_files]),
+             shards=np.array(shards),
+             records=np.array(records, dtype=np.int64),
+             shapes=dataset.shapes,
+             **flatten_labels(dataset.labels, dataset.segments))
+    LOGGER.info(f'Packed {len(records)} images into {len(shards)} shards in {out}')
+    return out
+
+
 def verify_image_label(args):
-    # Verify one image-label pair
+    # Verify one image-label pair, images are checked from their headers only and never modified (see utils/audit.py)
     im_file, lb_file, prefix = args
     nm, nf, ne, nc, msg, segments = 0, 0, 0, 0, '', []  # number (missing, found, empty, corrupt), message, segments
     try:
         # verify images
-        im = Image.open(im_file)
-        im.verify()  # PIL verify
-        shape = exif_size(im)  # image size
+        with Image.open(im_file) as im:  # lazy, reads the header
+            shape = exif_size(im)  # image size
+            fmt = im.format.lower()
         assert (shape[0] > 9) & (shape[1] > 9), f'image size {shape} <10 pixels'
-        assert im.format.lower() in IMG_FORMATS, f'invalid image format {im.format}'
-        if im.format.lower() in ('jpg', 'jpeg'):
-            with open(im_file, 'rb') as f:
-                f.seek(-2, 2)
-                if f.read() != b'\xff\xd9':  # corrupt JPEG
-                    ImageOps.exif_transpose(Image.open(im_file)).save(im_file, 'JPEG', subsampling=0, quality=100)
-                    msg = f'{prefix}WARNING ⚠️ {im_file}: corrupt JPEG restored and saved'
+        assert fmt in IMG_FORMATS, f'invalid image format {fmt}'
+        if fmt in ('jpg', 'jpeg') and not jpeg_complete(im_file):
+            msg = f'{prefix}WARNING ⚠️ {im_file}: truncated JPEG read as is, fix with python utils/audit.py --repair'
 
         # verify labels
         if os.path.isfile(lb_file):
@@ -1038,6 +1754,25 @@ def verify_image_label(args):
         return [None, None, None, None, nm, nf, ne, nc, msg]
 
 
+def verify_image_labels(im_files, label_files, prefix='', chunksize=SCAN_CHUNKSIZE, workers=NUM_THREADS):
+    # Verify image-label pairs in parallel processes, yields (index, verify_image_label() result) in completion order
+    with Pool(workers) as pool:
+        yield from pool.imap_unordered(verify_indexed, zip(range(len(im_files)), im_files, label_files, repeat(prefix)),
+                                       chunksize=max(1, min(chunksize, len(im_files) // workers)))
+
+
+def verify_indexed(args):
+    # verify_image_label() for imap_unordered(), returns (index, result)
+    return args[0], verify_image_label(args[1:])
+
+
+def jpeg_complete(file):
+    # Returns True if a JPEG file ends with the end-of-image marker
+    with open(file, 'rb') as f:
+        f.seek(-2, 2)
+        return f.read() == b'\xff\xd9'
+
+
 class HUBDatasetStats():
     """ Class for generating HUB dataset JSON and `-hub` dataset directory
 
@@ -1166,32 +1901,89 @@ class ClassificationDataset(torchvision.datasets.ImageFolder):
         root:  Dataset path
         transform:  torchvision transforms, used by default
         album_transform: Albumentations transforms, used if installed
+        cache:  'ram' to decode once into a SharedImageCache attached by all workers, 'disk' for full size *.npy files
     """
+    size_margin = 1.25  # decoded and cached short side / imgsz, resolution headroom for RandomResizedCrop zooms
 
     def __init__(self, root, augment, imgsz, cache=False):
         super().__init__(root=root)
         self.torch_transforms = classify_transforms(imgsz)
         self.album_transforms = classify_albumentations(augment, imgsz) if augment else None
-        self.cache_ram = cache is True or cache == 'ram'
         self.cache_disk = cache == 'disk'
-        self.samples = [list(x) + [Path(x[0]).with_suffix('.npy'), None] for x in self.samples]  # file, index, npy, im
+        check_imread_backend()
+        self.samples = [list(x) + [Path(x[0]).with_suffix('.npy')] for x in self.samples]  # file, index, npy
+        self.size = round(imgsz * self.size_margin)  # cached short side
+        self.decode_size = self.size if augment else None  # min short side of training JPEG decodes, val full size
+        self.shm = None
+        if cache is True or cache in ('ram', 'shm'):
+            self.cache_images(self.size, prefix=colorstr(f'{Path(root).name}: '))
 
     def __getitem__(self, i):
-        f, j, fn, im = self.samples[i]  # filename, index, filename.with_suffix('.npy'), image
-        if self.cache_ram and im is None:
-            im = self.samples[i][3] = cv2.imread(f)
+        f, j, fn = self.samples[i]  # filename, index, filename.with_suffix('.npy')
+        if self.shm is not None:  # read-only view into the shared arena, already resized
+            im = self.shm[i][0]
         elif self.cache_disk:
             if not fn.exists():  # load npy
-                np.save(fn.as_posix(), cv2.imread(f))
+                np.save(fn.as_posix(), imread(f))  # full size
             im = np.load(fn)
         else:  # read image
-            im = cv2.imread(f)  # BGR
+            im = imread(f, self.decode_size, short=True)  # BGR
         if self.album_transforms:
             sample = self.album_transforms(image=cv2.cvtColor(im, cv2.COLOR_BGR2RGB))["image"]
         else:
             sample = self.torch_transforms(im)
         return sample, j
 
+    def cache_images(self, size, prefix=''):
+        # Decode every image once, resized to a 'size' short side, into a shared-memory arena that DataLoader workers
+        # and DDP ranks on this node attach to instead of each caching its own full resolution copies
+        files = [x[0] for x in self.samples]
+        self.shm = SharedImageCache(get_hash(files + [str(size), str(self.decode_size)]))
+        if self.shm.exists():  # written by another rank or run on this node
+            self.shm.attach()
+            LOGGER.info(f'{prefix}Attached to shared image cache {self.shm.file} ({self.shm.nbytes() / 1E9:.1f}GB)')
+            return
+        if not self.check_cache_ram(size, prefix=prefix):
+            self.shm = None
+            return
+        b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
+        results = ThreadPool(NUM_THREADS).imap(lambda f: self.load_resized(f, size), files)
+        pbar = tqdm(results, total=len(files), bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
+        for im, hw0 in pbar:
+            self.shm.add(im, hw0)  # in index order, imap preserves it
+            b += im.nbytes
+            pbar.desc = f'{prefix}Caching images ({b / gb:.1f}GB shm)'
+        pbar.close()
+        self.shm.save()
+
+    def load_resized(self, f, size):
+        # Read image 'f' as BGR and downsize it to a 'size' short side, returns (im, decoded hw)
+        im = imread(f, self.decode_size, short=True)
+        assert im is not None, f'Image Not Found {f}'
+        h0, w0 = im.shape[:2]
+        r = size / min(h0, w0)
+        if r < 1:  # never upsample, the transforms resize to imgsz anyway
+            im = cv2.resize(im, (round(w0 * r), round(h0 * r)), interpolation=cv2.INTER_AREA)
+        return im, (h0, w0)
+
+    def check_cache_ram(self, size, safety_margin=0.1, prefix=''):
+        # Check image caching requirements vs available RAM and shared memory, estimated from 30 image headers
+        gb = 1 << 30  # bytes per gigabytes
+        n = min(len(self.samples), 30)  # extrapolate from 30 random images
+        b = 0
+        for f, *_ in random.sample(self.samples, n):
+            with Image.open(f) as im:  # header only
+                w, h = im.size
+            b += w * h * 3 * min(1, size / min(w, h)) ** 2
+        mem_required = b * len(self.samples) / n  # bytes required to cache dataset, BGR
+        mem, free = psutil.virtual_memory(), shutil.disk_usage(SharedImageCache.dir).free
+        cache = mem_required * (1 + safety_margin) < min(mem.available, free)
+        if not cache:
+            LOGGER.info(f"{prefix}{mem_required / gb:.1f}GB RAM required, "
+                        f"{mem.available / gb:.1f}GB available, {free / gb:.1f}GB shared memory free, "
+                        f"not caching images ⚠️")
+        return cache
+
 
 def create_classification_dataloader(path,
                                      imgsz=224,
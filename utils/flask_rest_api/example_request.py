@@ -1,19 +1,63 @@
 # YOLOv5 🚀 by Ultralytics, GPL-3.0 license
 """
 Perform test request
+
+Usage - single request:
+    $ python example_request.py
+
+Usage - load test with concurrent clients:
+    $ python example_request.py --requests 500 --concurrency 16
 """
 
+import argparse
 import pprint
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import local
 
 import requests
 
 DETECTION_URL = "http://localhost:5000/v1/object-detection/yolov5s"
 IMAGE = "zidane.jpg"
 
-# Read image
-with open(IMAGE, "rb") as f:
-    image_data = f.read()
 
-response = requests.post(DETECTION_URL, files={"image": image_data}).json()
+def load_test(url, image_data, n=100, concurrency=8):
+    # Send n requests from concurrency threads, report throughput and latency percentiles
+    sessions = local()  # one keep-alive session per thread
+
+    def post(_):
+        if not hasattr(sessions, 's'):
+            sessions.s = requests.Session()
+        t = time.perf_counter()
+        r = sessions.s.post(url, files={"image": image_data})
+        return time.perf_counter() - t, r.ok
+
+    t = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(post, range(n)))
+    dt = time.perf_counter() - t
+
+    lat = sorted(x[0] * 1E3 for x in results)
+    pct = lambda p: lat[min(int(p / 100 * len(lat)), len(lat) - 1)]  # noqa: E731
+    errors = sum(not x[1] for x in results)
+    print(f'{n} requests, {concurrency} concurrent, {errors} errors in {dt:.2f}s: {n / dt:.1f} req/s, '
+          f'latency p50 {pct(50):.1f}ms, p90 {pct(90):.1f}ms, p99 {pct(99):.1f}ms, max {lat[-1]:.1f}ms')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default=DETECTION_URL, help='detection endpoint')
+    parser.add_argument('--image', default=IMAGE, help='image file to post')
+    parser.add_argument('--requests', default=1, type=int, help='number of requests, >1 runs a load test')
+    parser.add_argument('--concurrency', default=8, type=int, help='concurrent clients for load test')
+    opt = parser.parse_args()
+
+    # Read image
+    with open(opt.image, "rb") as f:
+        image_data = f.read()
 
-pprint.pprint(response)
+    if opt.requests > 1:
+        load_test(opt.url, image_data, opt.requests, opt.concurrency)
+    else:
+        response = requests.post(opt.url, files={"image": image_data}).json()
+        pprint.pprint(response)
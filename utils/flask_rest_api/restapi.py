@@ -5,11 +5,19 @@ Run a Flask REST API exposing one or more YOLOv5s models
 
 import argparse
 import io
+import sys
+from pathlib import Path
 
-import torch
 from flask import Flask, request
 from PIL import Image
 
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[2]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from utils.registry import load_model  # noqa: E402
+
 app = Flask(__name__)
 models = {}
 
@@ -43,6 +51,6 @@ if __name__ == "__main__":
     opt = parser.parse_args()
 
     for m in opt.model:
-        models[m] = torch.hub.load("ultralytics/yolov5", m, force_reload=True, skip_validation=True)
+        models[Path(m).stem] = load_model(m)  # local weights and fused model cache, no torch.hub download
 
     app.run(host="0.0.0.0", port=opt.port)  # debug=True causes Restarting with stat
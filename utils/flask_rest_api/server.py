@@ -0,0 +1,199 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Run an asyncio REST API serving one or more YOLOv5 models with dynamic micro-batching
+
+Concurrent requests to the same model are grouped into a single AutoShape forward pass of up to --max-batch images,
+waiting at most --max-wait milliseconds for a batch to fill. Each model runs in its own inference thread so the event
+loop keeps accepting requests while a batch is in flight. With --workers N each model is served by N CPU replicas in
+separate processes pinned to core subsets (utils/workers.py), and up to N batches per model are in flight at once.
+
+Usage:
+    $ python server.py --model yolov5n yolov5s --max-batch 8 --max-wait 5
+    $ python server.py --model yolov5s --workers 4  # multi-process CPU inference
+    $ curl -X POST -F image=@zidane.jpg 'http://localhost:5000/v1/object-detection/yolov5s'
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+
+try:
+    import orjson  # fast JSON serializer
+
+    dumps = orjson.dumps
+except ImportError:
+    dumps = lambda x: json.dumps(x).encode()  # noqa: E731
+
+from aiohttp import web
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[2]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from utils.augmentations import letterbox  # noqa: E402
+from utils.dataloaders import imdecode  # noqa: E402
+from utils.general import scale_boxes  # noqa: E402
+from utils.registry import load_model, resolve  # noqa: E402
+from utils.workers import InferencePool  # noqa: E402
+
+DETECTION_URL = "/v1/object-detection/{model}"
+
+
+def to_records(det, names):
+    # Serialize an (n,6) xyxy detections tensor to the records layout of results.pandas().xyxy[i].to_json()
+    return [{
+        'xmin': x1,
+        'ymin': y1,
+        'xmax': x2,
+        'ymax': y2,
+        'confidence': conf,
+        'class': int(c),
+        'name': names[int(c)]} for x1, y1, x2, y2, conf, c in det.tolist()]
+
+
+class Batcher:
+    # Dynamic micro-batcher, groups concurrent requests into one AutoShape or InferencePool forward pass
+    def __init__(self, model, max_batch=8, max_wait=5.0, size=640, pool=None):
+        self.model = model
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait / 1E3  # ms to s
+        self.size = size
+        self.queue = asyncio.Queue()
+        n = pool.workers if pool else 1  # batches in flight
+        self.executor = ThreadPoolExecutor(n)
+        self.slots = asyncio.Semaphore(n)
+        self.task = None
+
+    async def __call__(self, im):
+        # Enqueue an RGB image and wait for its serialized detections
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((im, future))
+        return await future
+
+    def infer(self, ims):
+        # Batched inference in an executor thread, returns one JSON payload per image
+        if self.pool:
+            return self.infer_pool(ims)
+        with torch.inference_mode():
+            results = self.model(list(ims), size=self.size)
+        return [dumps(to_records(x, results.names)) for x in results.xyxy]
+
+    def infer_pool(self, ims):
+        # Letterbox to a fixed square shape for the shared-memory buffers, replicas run inference and NMS
+        ims = [np.asarray(im) for im in ims]
+        x = np.stack([letterbox(im, self.size, auto=False)[0] for im in ims]).transpose(0, 3, 1, 2)  # BHWC to BCHW
+        pred = self.pool(x)
+        for det, im in zip(pred, ims):
+            scale_boxes(x.shape[2:], det[:, :4], im.shape)
+        return [dumps(to_records(det, self.model.names)) for det in pred]
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()  # requests keep queueing while every slot is busy, so batches fill up
+            batch = [await self.queue.get()]  # block until the first request arrives
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            loop.create_task(self.dispatch(batch))
+
+    async def dispatch(self, batch):
+        # Run one batch in the executor and resolve its request futures
+        ims, futures = zip(*batch)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.infer, ims)
+        except Exception as e:
+            results = [e] * len(futures)
+        finally:
+            self.slots.release()
+        for future, r in zip(futures, results):
+            if future.done():  # client disconnected
+                continue
+            if isinstance(r, Exception):
+                future.set_exception(r)
+            else:
+                future.set_result(r)
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        self.executor.shutdown(wait=False)
+        if self.pool:
+            self.pool.close()
+
+
+def decode(b):
+    # Decode image bytes to an RGB array through the IMREAD_BACKEND decoder, EXIF orientation applied
+    im = imdecode(b)
+    if im is None:
+        raise web.HTTPBadRequest(body=dumps({'error': 'image does not decode'}), content_type='application/json')
+    return im[..., ::-1]  # BGR to RGB
+
+
+async def predict(request):
+    batcher = request.app['batchers'].get(request.match_info['model'])
+    if batcher is None:
+        return web.Response(status=404, body=dumps({'error': f"model '{request.match_info['model']}' not found"}),
+                            content_type='application/json')
+
+    post = await request.post()
+    image = post.get('image')
+    if image is None or not hasattr(image, 'file'):
+        return web.Response(status=400, body=dumps({'error': "missing 'image' file"}), content_type='application/json')
+
+    im = await asyncio.get_running_loop().run_in_executor(None, decode, image.file.read())  # decode off the loop
+    return web.Response(body=await batcher(im), content_type='application/json')
+
+
+def create_app(models, max_batch=8, max_wait=5.0, size=640, pools=None):
+    # Build the aiohttp application, models is a dict of {name: AutoShape model}, pools of {name: InferencePool}
+    app = web.Application(client_max_size=32 * 1024 ** 2)
+    app.router.add_post(DETECTION_URL, predict)
+    pools = pools or {}
+
+    async def startup(app):
+        app['batchers'] = {k: Batcher(m, max_batch, max_wait, size, pools.get(k)) for k, m in models.items()}
+        for b in app['batchers'].values():
+            b.start()
+
+    async def cleanup(app):
+        for b in app['batchers'].values():
+            await b.stop()
+
+    app.on_startup.append(startup)
+    app.on_cleanup.append(cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="asyncio REST API exposing YOLOv5 models with dynamic batching")
+    parser.add_argument("--port", default=5000, type=int, help="port number")
+    parser.add_argument('--model', nargs='+', default=['yolov5s'], help='model(s) to run, i.e. --model yolov5n yolov5s')
+    parser.add_argument('--max-batch', default=8, type=int, help='maximum images per forward pass')
+    parser.add_argument('--max-wait', default=5.0, type=float, help='maximum milliseconds to wait for a batch to fill')
+    parser.add_argument('--size', default=640, type=int, help='inference size (pixels)')
+    parser.add_argument('--workers', default=0, type=int, help='CPU inference processes per model, 0 for in-process')
+    parser.add_argument('--threads', default=0, type=int, help='intra-op threads per worker, 0 for its share of cores')
+    opt = parser.parse_args()
+
+    models = {Path(m).stem: load_model(m) for m in opt.model}  # local weights and fused model cache
+    pools = {
+        Path(m).stem: InferencePool(resolve(m), opt.workers, opt.threads, (opt.size, opt.size), opt.max_batch)
+        for m in opt.model} if opt.workers else None
+    web.run_app(create_app(models, opt.max_batch, opt.max_wait, opt.size, pools), port=opt.port)
@@ -28,9 +28,7 @@ from typing import Optional
 from zipfile import ZipFile, is_zipfile
 
 import cv2
-import IPython
 import numpy as np
-import pandas as pd
 import pkg_resources as pkg
 import torch
 import torchvision
@@ -54,7 +52,6 @@ FONT = 'Arial.ttf'  # https://ultralytics.com/assets/Arial.ttf
 
 torch.set_printoptions(linewidth=320, precision=5, profile='long')
 np.set_printoptions(linewidth=320, formatter={'float_kind': '{:11.5g}'.format})  # format short g, %precision=5
-pd.options.display.max_columns = 10
 cv2.setNumThreads(0)  # prevent OpenCV from multithreading (incompatible with PyTorch DataLoader)
 os.environ['NUMEXPR_MAX_THREADS'] = str(NUM_THREADS)  # NumExpr max threads
 os.environ['OMP_NUM_THREADS'] = '1' if platform.system() == 'darwin' else str(NUM_THREADS)  # OpenMP (PyTorch and SciPy)
@@ -78,6 +75,9 @@ def is_colab():
 
 def is_notebook():
     # Is environment a Jupyter notebook? Verified on Colab, Jupyterlab, Kaggle, Paperspace
+    if 'IPython' not in sys.modules:  # notebook kernels always import IPython, avoid importing it here
+        return False
+    import IPython
     ipython_type = str(type(IPython.get_ipython()))
     return 'colab' in ipython_type or 'zmqshell' in ipython_type
 
@@ -891,6 +891,8 @@ def non_max_suppression(
         labels=(),
         max_det=300,
         nm=0,  # number of masks
+        batched=False,  # single NMS call over the whole batch, no time limit
+        topk=0,  # keep only the topk highest objectness candidates per image before NMS, 0 to disable
 ):
     """Non-Maximum Suppression (NMS) on inference results to reject overlapping detections
 
@@ -907,6 +909,9 @@ def non_max_suppression(
         prediction = prediction.cpu()
     bs = prediction.shape[0]  # batch size
     nc = prediction.shape[2] - nm - 5  # number of classes
+    if topk and topk < prediction.shape[1]:  # top-k objectness pre-filter
+        k = prediction[..., 4].topk(topk, dim=1)[1]  # (bs, topk) indices
+        prediction = prediction.gather(1, k[..., None].expand(-1, -1, prediction.shape[2]))
     xc = prediction[..., 4] > conf_thres  # candidates
 
     # Checks
@@ -918,6 +923,10 @@ def non_max_suppression(
     max_wh = 7680  # (pixels) maximum box width and height
     max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
     time_limit = 0.5 + 0.05 * bs  # seconds to quit after
+    if batched:
+        output = _batched_nms(prediction, xc, conf_thres, iou_thres, classes, agnostic, multi_label and nc > 1, labels,
+                              max_det, nc, max_nms, max_wh)
+        return [x.to(device) for x in output] if mps else output
     redundant = True  # require redundant detections
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
     merge = False  # use merge-NMS
@@ -999,6 +1008,76 @@ def non_max_suppression(
     return output
 
 
+def _batched_nms(prediction, xc, conf_thres, iou_thres, classes, agnostic, multi_label, labels, max_det, nc, max_nms,
+                 max_wh):
+    # Vectorized non_max_suppression() for the whole batch: one filter, one NMS pass and one split into images
+    bs, mi = prediction.shape[0], 5 + nc  # batch size, mask start index
+    b, a = xc.nonzero(as_tuple=True)  # image index, anchor index of candidates
+    x = prediction[b, a]
+
+    # Cat apriori labels if autolabelling
+    if labels and any(len(lb) for lb in labels):
+        v = torch.zeros((sum(len(lb) for lb in labels), prediction.shape[2]), device=x.device)
+        lb = torch.cat([lb for lb in labels if len(lb)], 0)
+        v[:, :4] = lb[:, 1:5]  # box
+        v[:, 4] = 1.0  # conf
+        v[range(len(lb)), lb[:, 0].long() + 5] = 1.0  # cls
+        x = torch.cat((x, v), 0)
+        bl = torch.cat([torch.full((len(lb),), i, dtype=b.dtype, device=b.device) for i, lb in enumerate(labels)])
+        b = torch.cat((b, bl), 0)  # label image indices
+
+    # Compute conf
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+
+    # Box/Mask
+    box = xywh2xyxy(x[:, :4])  # center_x, center_y, width, height) to (x1, y1, x2, y2)
+    mask = x[:, mi:]  # zero columns if no masks
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = (x[:, 5:mi] > conf_thres).nonzero(as_tuple=False).T
+        x, b = torch.cat((box[i], x[i, 5 + j, None], j[:, None].float(), mask[i]), 1), b[i]
+    else:  # best class only
+        conf, j = x[:, 5:mi].max(1, keepdim=True)
+        k = conf.view(-1) > conf_thres
+        x, b = torch.cat((box, conf, j.float(), mask), 1)[k], b[k]
+
+    # Filter by class
+    if classes is not None:
+        k = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        x, b = x[k], b[k]
+
+    # Sort by image then confidence, keep at most max_nms boxes per image
+    x, b = _rank_by_image(x, b, bs, max_nms)
+    if not x.shape[0]:  # no boxes
+        return list(x.split([0] * bs))
+
+    # Batched NMS
+    c, scores = x[:, 5:6] * (0 if agnostic else max_wh), x[:, 4]  # classes, scores
+    if x.device.type == 'cpu':  # CPU NMS is quadratic in box count, run it on each image slice
+        boxes = x[:, :4] + c  # boxes (offset by class)
+        end = torch.bincount(b, minlength=bs).cumsum(0).tolist()
+        i = torch.cat([torchvision.ops.nms(boxes[s:e], scores[s:e], iou_thres) + s for s, e in zip([0] + end, end)])
+    else:  # one NMS call, class offsets along x and image offsets along y keep every (image, class) group apart
+        o = b[:, None].float() * max_wh  # images
+        boxes = x[:, :4] + torch.cat((c, o, c, o), 1)  # boxes (offset by class and image)
+        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
+
+    # Split into images, keep at most max_det per image
+    x, b = _rank_by_image(x[i], b[i], bs, max_det)
+    return list(x.split(torch.bincount(b, minlength=bs).tolist()))
+
+
+def _rank_by_image(x, b, bs, n):
+    # Sort detections x (with image indices b) by image then descending confidence, keep the first n per image
+    i = (b.double() * 2 - x[:, 4].double()).argsort()  # conf in [0, 1], image index dominates
+    x, b = x[i], b[i]
+    counts = torch.bincount(b, minlength=bs)
+    rank = torch.arange(len(b), device=b.device) - (counts.cumsum(0) - counts)[b]  # position within image
+    k = rank < n
+    return x[k], b[k]
+
+
 def strip_optimizer(f='best.pt', s=''):  # from utils.general import *; strip_optimizer()
     # Strip optimizer from 'f' to finalize training, optionally save as 's'
     x = torch.load(f, map_location=torch.device('cpu'))
@@ -1036,6 +1115,7 @@ def print_mutation(keys, results, hyp, save_dir, bucket, prefix=colorstr('evolve
 
     # Save yaml
     with open(evolve_yaml, 'w') as f:
+        import pandas as pd  # scoped, pandas is slow to import
         data = pd.read_csv(evolve_csv)
         data = data.rename(columns=lambda x: x.strip())  # strip keys
         i = np.argmax(fitness(data.values[:, :4]))  #
@@ -0,0 +1,74 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Import-time benchmark based on `python -X importtime`, guards against slow or unwanted imports creeping back in
+
+Usage:
+    $ python utils/importtime.py                                  # detect, val, export, models.common
+    $ python utils/importtime.py --modules detect --top 20        # 20 slowest imports below detect
+    $ python utils/importtime.py --max-time 4.0                   # exit 1 if any module takes longer than 4s
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+
+MODULES = 'detect', 'val', 'export', 'models.common'  # entrypoints to benchmark
+FORBIDDEN = ('pandas', 'seaborn', 'requests', 'IPython', 'tensorboard', 'wandb', 'clearml', 'comet_ml', 'onnxruntime',
+             'openvino', 'tensorrt', 'tensorflow', 'paddle', 'tritonclient')  # must only load when selected
+
+
+def importtime(module, python=sys.executable):
+    # Import module in a fresh interpreter, return {name: cumulative seconds} parsed from -X importtime
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, (str(ROOT), os.getenv('PYTHONPATH'))))}
+    r = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'],
+                       cwd=ROOT,
+                       env=env,
+                       capture_output=True,
+                       text=True)
+    if r.returncode:
+        raise RuntimeError(f'import {module} failed:\n{r.stderr[-2000:]}')
+    times = {}
+    for line in r.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \|\s+(\S+)', line)
+        if m:
+            times[m[2]] = int(m[1]) / 1E6  # us to s
+    return times
+
+
+def run(modules=MODULES, forbidden=FORBIDDEN, top=10, max_time=0.0, runs=3):
+    failures = []
+    for module in modules:
+        t = min((importtime(module) for _ in range(runs)), key=lambda x: x[module])  # best of n, warm disk cache
+        loaded = sorted({k.split('.')[0] for k in t} & set(forbidden))
+        print(f'\n{module}: {t[module]:.3f}s, {len(t)} modules')
+        for k, v in sorted(t.items(), key=lambda x: -x[1])[1:top + 1]:
+            print(f'{v:10.3f}s  {k}')
+        if loaded:
+            failures.append(f'{module} imports {", ".join(loaded)}')
+        if max_time and t[module] > max_time:
+            failures.append(f'{module} import time {t[module]:.3f}s > {max_time}s')
+
+    for f in failures:
+        print(f'FAIL: {f}')
+    return not failures
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', nargs='+', default=MODULES, help='modules to import')
+    parser.add_argument('--forbidden', nargs='*', default=FORBIDDEN, help='packages that must not be imported')
+    parser.add_argument('--top', type=int, default=10, help='show the N slowest imports per module')
+    parser.add_argument('--max-time', type=float, default=0.0, help='fail above this import time (s), 0 to disable')
+    parser.add_argument('--runs', type=int, default=3, help='report the best of N runs')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    opt = parse_opt()
+    sys.exit(0 if run(**vars(opt)) else 1)
@@ -9,49 +9,57 @@ from pathlib import Path
 
 import pkg_resources as pkg
 import torch
-from torch.utils.tensorboard import SummaryWriter
 
 from utils.general import LOGGER, colorstr, cv2
-from utils.loggers.clearml.clearml_utils import ClearmlLogger
-from utils.loggers.wandb.wandb_utils import WandbLogger
 from utils.plots import plot_images, plot_labels, plot_results
 from utils.torch_utils import de_parallel
 
 LOGGERS = ('csv', 'tb', 'wandb', 'clearml', 'comet')  # *.csv, TensorBoard, Weights & Biases, ClearML
 RANK = int(os.getenv('RANK', -1))
 
-try:
-    import wandb
+wandb = clearml = comet_ml = None  # third-party loggers, imported by import_loggers() only when selected
 
-    assert hasattr(wandb, '__version__')  # verify package import not local dir
-    if pkg.parse_version(wandb.__version__) >= pkg.parse_version('0.12.2') and RANK in {0, -1}:
+
+def import_loggers(include=LOGGERS):
+    # Import the selected third-party loggers on first use, missing packages stay None
+    global wandb, clearml, comet_ml, WandbLogger, ClearmlLogger, CometLogger
+    if 'wandb' in include and wandb is None:
         try:
-            wandb_login_success = wandb.login(timeout=30)
-        except wandb.errors.UsageError:  # known non-TTY terminal issue
-            wandb_login_success = False
-        if not wandb_login_success:
+            from utils.loggers.wandb.wandb_utils import WandbLogger  # first, the subpackage shadows 'wandb'
+            import wandb
+
+            assert hasattr(wandb, '__version__')  # verify package import not local dir
+            if pkg.parse_version(wandb.__version__) >= pkg.parse_version('0.12.2') and RANK in {0, -1}:
+                try:
+                    wandb_login_success = wandb.login(timeout=30)
+                except wandb.errors.UsageError:  # known non-TTY terminal issue
+                    wandb_login_success = False
+                if not wandb_login_success:
+                    wandb = None
+        except (ImportError, AssertionError):
             wandb = None
-except (ImportError, AssertionError):
-    wandb = None
 
-try:
-    import clearml
+    if 'clearml' in include and clearml is None:
+        try:
+            from utils.loggers.clearml.clearml_utils import ClearmlLogger  # first, the subpackage shadows 'clearml'
+            import clearml
 
-    assert hasattr(clearml, '__version__')  # verify package import not local dir
-except (ImportError, AssertionError):
-    clearml = None
+            assert hasattr(clearml, '__version__')  # verify package import not local dir
+        except (ImportError, AssertionError):
+            clearml = None
 
-try:
-    if RANK not in [0, -1]:
-        comet_ml = None
-    else:
-        import comet_ml
+    if 'comet' in include and comet_ml is None:
+        try:
+            if RANK not in [0, -1]:
+                comet_ml = None
+            else:
+                import comet_ml
 
-        assert hasattr(comet_ml, '__version__')  # verify package import not local dir
-        from utils.loggers.comet import CometLogger
+                assert hasattr(comet_ml, '__version__')  # verify package import not local dir
+                from utils.loggers.comet import CometLogger
 
-except (ModuleNotFoundError, ImportError, AssertionError):
-    comet_ml = None
+        except (ModuleNotFoundError, ImportError, AssertionError):
+            comet_ml = None
 
 
 class Loggers():
@@ -82,17 +90,18 @@ class Loggers():
         for k in LOGGERS:
             setattr(self, k, None)  # init empty logger dictionary
         self.csv = True  # always log to csv
+        import_loggers(self.include)
 
         # Messages
         # if not wandb:
         #     prefix = colorstr('Weights & Biases: ')
         #     s = f"{prefix}run 'pip install wandb' to automatically track and visualize YOLOv5 🚀 runs in Weights & Biases"
         #     self.logger.info(s)
-        if not clearml:
+        if not clearml and 'clearml' in self.include:
             prefix = colorstr('ClearML: ')
             s = f"{prefix}run 'pip install clearml' to automatically track, visualize and remotely train YOLOv5 🚀 in ClearML"
             self.logger.info(s)
-        if not comet_ml:
+        if not comet_ml and 'comet' in self.include:
             prefix = colorstr('Comet: ')
             s = f"{prefix}run 'pip install comet_ml' to automatically track and visualize YOLOv5 🚀 runs in Comet"
             self.logger.info(s)
@@ -101,6 +110,7 @@ class Loggers():
         if 'tb' in self.include and not self.opt.evolve:
             prefix = colorstr('TensorBoard: ')
             self.logger.info(f"{prefix}Start with 'tensorboard --logdir {s.parent}', view at http://localhost:6006/")
+            from torch.utils.tensorboard import SummaryWriter  # scoped, tensorboard is slow to import
             self.tb = SummaryWriter(str(s))
 
         # W&B
@@ -155,10 +165,10 @@ class Loggers():
         if self.comet_logger:
             self.comet_logger.on_pretrain_routine_start()
 
-    def on_pretrain_routine_end(self, labels, names):
+    def on_pretrain_routine_end(self, labels, names, stats=None):
         # Callback runs on pre-train routine end
         if self.plots:
-            plot_labels(labels, names, self.save_dir)
+            plot_labels(labels, names, self.save_dir, stats)
             paths = self.save_dir.glob('*labels*.jpg')  # training labels
             if self.wandb:
                 self.wandb.log({"Labels": [wandb.Image(str(x), caption=x.name) for x in paths]})
@@ -324,10 +334,12 @@ class GenericLogger:
         self.include = include
         self.console_logger = console_logger
         self.csv = self.save_dir / 'results.csv'  # CSV logger
+        import_loggers(self.include)
         if 'tb' in self.include:
             prefix = colorstr('TensorBoard: ')
             self.console_logger.info(
                 f"{prefix}Start with 'tensorboard --logdir {self.save_dir.parent}', view at http://localhost:6006/")
+            from torch.utils.tensorboard import SummaryWriter  # scoped, tensorboard is slow to import
             self.tb = SummaryWriter(str(self.save_dir))
 
         if wandb and 'wandb' in self.include:
@@ -7,7 +7,6 @@ import math
 import warnings
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import numpy as np
 import torch
 
@@ -48,39 +47,52 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir='.', names
 
     # Find unique classes
     unique_classes, nt = np.unique(target_cls, return_counts=True)
-    nc = unique_classes.shape[0]  # number of classes, number of detections
+
+    # Accumulate FPs and TPs per class
+    curves = []
+    for c in unique_classes:
+        i = pred_cls == c
+        curves.append((conf[i], tp[i].cumsum(0), (1 - tp[i]).cumsum(0)))
+    return pr_metrics(curves, nt, unique_classes, tp.shape[1], plot, save_dir, names, eps, prefix)
+
+
+def pr_metrics(curves, nt, unique_classes, niou, plot=False, save_dir='.', names=(), eps=1e-16, prefix=""):
+    """ Compute AP, P, R and F1 from per-class cumulative TP/FP curves, shared by ap_per_class() and APAccumulator
+    # Arguments
+        curves:  Per-class tuples of (conf (n), tpc (n, niou), fpc (n, niou)), conf in decreasing order.
+        nt:  Number of labels per class (nparray).
+        unique_classes:  Classes with labels (nparray).
+    # Returns
+        tp, fp, p, r, f1, ap, classes as returned by ap_per_class().
+    """
 
     # Create Precision-Recall curve and compute AP for each class
+    nc = unique_classes.shape[0]  # number of classes
     px, py = np.linspace(0, 1, 1000), []  # for plotting
-    ap, p, r = np.zeros((nc, tp.shape[1])), np.zeros((nc, 1000)), np.zeros((nc, 1000))
-    for ci, c in enumerate(unique_classes):
-        i = pred_cls == c
+    ap, p, r = np.zeros((nc, niou)), np.zeros((nc, 1000)), np.zeros((nc, 1000))
+    for ci, (conf, tpc, fpc) in enumerate(curves):
         n_l = nt[ci]  # number of labels
-        n_p = i.sum()  # number of predictions
+        n_p = conf.shape[0]  # number of predictions
         if n_p == 0 or n_l == 0:
             continue
 
-        # Accumulate FPs and TPs
-        fpc = (1 - tp[i]).cumsum(0)
-        tpc = tp[i].cumsum(0)
-
         # Recall
         recall = tpc / (n_l + eps)  # recall curve
-        r[ci] = np.interp(-px, -conf[i], recall[:, 0], left=0)  # negative x, xp because xp decreases
+        r[ci] = np.interp(-px, -conf, recall[:, 0], left=0)  # negative x, xp because xp decreases
 
         # Precision
         precision = tpc / (tpc + fpc)  # precision curve
-        p[ci] = np.interp(-px, -conf[i], precision[:, 0], left=1)  # p at pr_score
+        p[ci] = np.interp(-px, -conf, precision[:, 0], left=1)  # p at pr_score
 
         # AP from recall-precision curve
-        for j in range(tp.shape[1]):
+        for j in range(niou):
             ap[ci, j], mpre, mrec = compute_ap(recall[:, j], precision[:, j])
             if plot and j == 0:
                 py.append(np.interp(px, mrec, mpre))  # precision at mAP@0.5
 
     # Compute F1 (harmonic mean of precision and recall)
     f1 = 2 * p * r / (p + r + eps)
-    names = [v for k, v in names.items() if k in unique_classes]  # list: only classes that have data
+    names = [v for k, v in dict(names).items() if k in unique_classes]  # list: only classes that have data
     names = dict(enumerate(names))  # to dict
     if plot:
         plot_pr_curve(px, py, ap, Path(save_dir) / f'{prefix}PR_curve.png', names)
@@ -95,6 +107,105 @@ def ap_per_class(tp, conf, pred_cls, target_cls, plot=False, save_dir='.', names
     return tp, fp, p, r, f1, ap, unique_classes.astype(int)
 
 
+class APStats:
+    # Exact AP, keeps every prediction's (correct, conf, class) and every label class for ap_per_class(). Same interface
+    # as APAccumulator, mergeable across processes by concatenating, i.e. stats.merge(other) or stats.all_reduce()
+    def __init__(self, nc, niou=10, device='cpu'):
+        self.nc, self.niou, self.device = nc, niou, device
+        self.stats = []  # (correct, conf, pred_cls, target_cls) per update
+
+    def update(self, correct, conf, pred_cls, target_cls):
+        # Add predictions correct (n, niou), conf (n), pred_cls (n) and labels target_cls (m) of one or more images
+        self.stats.append((correct, conf, pred_cls, target_cls))
+
+    def arrays(self):
+        # Concatenated (correct, conf, pred_cls, target_cls) numpy arrays
+        if not self.stats:
+            return np.zeros((0, self.niou), bool), np.zeros(0), np.zeros(0), np.zeros(0)
+        return [torch.cat(x, 0).cpu().numpy() for x in zip(*self.stats)]
+
+    @property
+    def nt(self):
+        # Labels per class
+        return torch.from_numpy(np.bincount(self.arrays()[3].astype(int), minlength=self.nc))
+
+    def merge(self, other):
+        # Add the predictions and labels of another APStats, i.e. from another validation shard
+        self.stats += [tuple(x.to(self.device) for x in y) for y in other.stats]
+        return self
+
+    def all_reduce(self):
+        # Gather predictions and labels from all DDP ranks, every rank ends up with all of them
+        import torch.distributed as dist
+        x = [None] * dist.get_world_size()
+        dist.all_gather_object(x, self.arrays())
+        self.stats = [tuple(torch.from_numpy(a) for a in y) for y in x]
+        return self
+
+    def any(self):
+        # True if there is at least one true positive
+        return bool(self.arrays()[0].any())
+
+    def compute(self, plot=False, save_dir='.', names=(), eps=1e-16, prefix=""):
+        # Return tp, fp, p, r, f1, ap, classes from ap_per_class()
+        return ap_per_class(*self.arrays(), plot=plot, save_dir=save_dir, names=names, eps=eps, prefix=prefix)
+
+
+class APAccumulator:
+    # Streaming AP, per-class TP/prediction histograms over confidence bins. Bounded memory, updated on-device per
+    # image and mergeable across processes, i.e. acc.merge(other) or acc.all_reduce() for DDP. AP is interpolated
+    # within bins so it approximates ap_per_class(), use APStats for exact results
+    def __init__(self, nc, niou=10, bins=1000, device='cpu'):
+        self.nc, self.bins = nc, bins
+        self.tp = torch.zeros(nc * bins, niou, dtype=torch.int64, device=device)  # TPs per (class, bin), IoU
+        self.n = torch.zeros(nc * bins, dtype=torch.int64, device=device)  # predictions per (class, bin)
+        self.nt = torch.zeros(nc, dtype=torch.int64, device=device)  # labels per class
+
+    def update(self, correct, conf, pred_cls, target_cls):
+        # Add predictions correct (n, niou), conf (n), pred_cls (n) and labels target_cls (m) of one or more images
+        i = pred_cls.long() * self.bins + (conf * self.bins).long().clamp(0, self.bins - 1)  # (class, bin) index
+        self.tp.index_add_(0, i, correct.long())
+        self.n.index_add_(0, i, torch.ones_like(i))
+        self.nt += torch.bincount(target_cls.long(), minlength=self.nc)
+
+    def merge(self, other):
+        # Add the state of another APAccumulator, i.e. from another validation shard
+        self.tp += other.tp.to(self.tp.device)
+        self.n += other.n.to(self.n.device)
+        self.nt += other.nt.to(self.nt.device)
+        return self
+
+    def all_reduce(self):
+        # Sum state across all DDP ranks
+        import torch.distributed as dist
+        for x in self.tp, self.n, self.nt:
+            dist.all_reduce(x)
+        return self
+
+    def any(self):
+        # True if there is at least one true positive
+        return bool(self.tp.any())
+
+    def compute(self, plot=False, save_dir='.', names=(), eps=1e-16, prefix=""):
+        # Return tp, fp, p, r, f1, ap, classes as ap_per_class(). TPs are assumed evenly spread within a bin, so each
+        # non-empty bin adds a PR point after its first prediction and one after its last
+        tp = self.tp.view(self.nc, self.bins, -1).flip(1).cpu().numpy()  # decreasing confidence
+        n = self.n.view(self.nc, self.bins).flip(1).cpu().numpy()
+        nt = self.nt.cpu().numpy()
+        unique_classes = np.nonzero(nt)[0]  # classes with labels
+        b = np.arange(self.bins)[::-1]
+        conf = np.stack(((b + 0.75) / self.bins, (b + 0.25) / self.bins), 1)  # (first, last) prediction of each bin
+        curves = []
+        for c in unique_classes:
+            k = n[c] > 0  # non-empty bins
+            tpb, nb = tp[c][k], n[c][k, None]
+            tpc, npc = tpb.cumsum(0), nb.cumsum(0)  # after the last prediction of each bin
+            tp0, np0 = tpc - tpb + tpb / nb, npc - nb + 1  # after the first prediction of each bin
+            tpc, npc = np.stack((tp0, tpc), 1).reshape(-1, tpb.shape[1]), np.stack((np0, npc), 1).reshape(-1, 1)
+            curves.append((conf[k].reshape(-1), tpc, npc - tpc))
+        return pr_metrics(curves, nt[unique_classes], unique_classes, tp.shape[2], plot, save_dir, names, eps, prefix)
+
+
 def compute_ap(recall, precision):
     """ Compute the average precision, given the recall and precision curves
     # Arguments
@@ -142,14 +253,13 @@ class ConfusionMatrix:
             None, updates confusion matrix accordingly
         """
         if detections is None:
-            gt_classes = labels.int()
-            for gc in gt_classes:
-                self.matrix[self.nc, gc] += 1  # background FN
+            gt_classes = labels.int().cpu().numpy()
+            np.add.at(self.matrix, (self.nc, gt_classes), 1)  # background FN
             return
 
         detections = detections[detections[:, 4] > self.conf]
-        gt_classes = labels[:, 0].int()
-        detection_classes = detections[:, 5].int()
+        gt_classes = labels[:, 0].int().cpu().numpy()
+        detection_classes = detections[:, 5].int().cpu().numpy()
         iou = box_iou(labels[:, 1:], detections[:, :4])
 
         x = torch.where(iou > self.iou_thres)
@@ -164,18 +274,16 @@ class ConfusionMatrix:
             matches = np.zeros((0, 3))
 
         n = matches.shape[0] > 0
-        m0, m1, _ = matches.transpose().astype(int)
-        for i, gc in enumerate(gt_classes):
-            j = m0 == i
-            if n and sum(j) == 1:
-                self.matrix[detection_classes[m1[j]], gc] += 1  # correct
-            else:
-                self.matrix[self.nc, gc] += 1  # true background
+        m0, m1, _ = matches.transpose().astype(int)  # matched label and detection indices, each unique
+        np.add.at(self.matrix, (detection_classes[m1], gt_classes[m0]), 1)  # correct
+        fn = np.ones(len(gt_classes), dtype=bool)
+        fn[m0] = False
+        np.add.at(self.matrix, (self.nc, gt_classes[fn]), 1)  # true background
 
         if n:
-            for i, dc in enumerate(detection_classes):
-                if not any(m1 == i):
-                    self.matrix[dc, self.nc] += 1  # predicted background
+            fp = np.ones(len(detection_classes), dtype=bool)
+            fp[m1] = False
+            np.add.at(self.matrix, (detection_classes[fp], self.nc), 1)  # predicted background
 
     def matrix(self):
         return self.matrix
@@ -188,6 +296,7 @@ class ConfusionMatrix:
 
     @TryExcept('WARNING ⚠️ ConfusionMatrix plot failure')
     def plot(self, normalize=True, save_dir='', names=()):
+        import matplotlib.pyplot as plt
         import seaborn as sn
 
         array = self.matrix / ((self.matrix.sum(0).reshape(1, -1) + 1E-9) if normalize else 1)  # normalize columns
@@ -320,6 +429,8 @@ def wh_iou(wh1, wh2, eps=1e-7):
 @threaded
 def plot_pr_curve(px, py, ap, save_dir=Path('pr_curve.png'), names=()):
     # Precision-recall curve
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1, 1, figsize=(9, 6), tight_layout=True)
     py = np.stack(py, axis=1)
 
@@ -343,6 +454,8 @@ def plot_pr_curve(px, py, ap, save_dir=Path('pr_curve.png'), names=()):
 @threaded
 def plot_mc_curve(px, py, save_dir=Path('mc_curve.png'), names=(), xlabel='Confidence', ylabel='Metric'):
     # Metric-confidence curve
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1, 1, figsize=(9, 6), tight_layout=True)
 
     if 0 < len(names) < 21:  # display per-class legend if < 21 classes
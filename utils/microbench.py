@@ -0,0 +1,244 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Micro-benchmarks for hot validation and data-loading paths, run on synthetic data so no dataset is needed
+
+Usage:
+    $ python utils/microbench.py confusion                                   # 80 classes, 200 labels/image
+    $ python utils/microbench.py confusion --labels 150 --dets 300 --nc 1    # SKU-110K-like dense single class
+    $ python utils/microbench.py augment --device 0                          # per-sample vs --device-augment
+    $ python utils/microbench.py dataloader --device 0 --workers 8           # train dataloader images/s
+    $ python utils/microbench.py decode --imgsz 640                         # 4K JPEG full vs DCT-scaled decodes
+"""
+
+import argparse
+import importlib.util
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+import yaml
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[1]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+if str(FILE.parent) in sys.path:
+    sys.path.remove(str(FILE.parent))  # utils/triton.py would shadow the triton package imported by torchvision
+
+from utils.augmentations import BatchAugment  # noqa: E402
+from utils.dataloaders import DevicePrefetcher, LoadImagesAndLabels, create_dataloader, imdecode  # noqa: E402
+from utils.metrics import ConfusionMatrix, box_iou  # noqa: E402
+from utils.torch_utils import select_device  # noqa: E402
+
+
+def synthetic_batch(n_labels=200, n_dets=300, nc=80, size=640, seed=0):
+    # Return (detections (N,6) x1y1x2y2-conf-cls, labels (M,5) cls-x1y1x2y2) where detections jitter the labels
+    g = torch.Generator().manual_seed(seed)
+    xy = torch.rand(n_labels, 2, generator=g) * size
+    wh = torch.rand(n_labels, 2, generator=g) * size / 10 + 4
+    labels = torch.cat((torch.randint(nc, (n_labels, 1), generator=g).float(), xy, xy + wh), 1)
+    i = torch.randint(n_labels, (n_dets,), generator=g)
+    boxes = labels[i, 1:] + torch.randn(n_dets, 4, generator=g) * wh[i].repeat(1, 2) * 0.1  # jittered labels
+    cls = torch.where(torch.rand(n_dets, generator=g) < 0.8, labels[i, 0], torch.randint(nc, (n_dets,), generator=g))
+    detections = torch.cat((boxes, torch.rand(n_dets, 1, generator=g), cls[:, None]), 1)
+    return detections, labels
+
+
+def process_batch_loop(cm, detections, labels):
+    # Reference per-label/per-detection loop implementation of ConfusionMatrix.process_batch(), for comparison
+    if detections is None:
+        for gc in labels.int():
+            cm.matrix[cm.nc, gc] += 1  # background FN
+        return
+
+    detections = detections[detections[:, 4] > cm.conf]
+    gt_classes = labels[:, 0].int()
+    detection_classes = detections[:, 5].int()
+    iou = box_iou(labels[:, 1:], detections[:, :4])
+
+    x = torch.where(iou > cm.iou_thres)
+    if x[0].shape[0]:
+        matches = torch.cat((torch.stack(x, 1), iou[x[0], x[1]][:, None]), 1).cpu().numpy()
+        if x[0].shape[0] > 1:
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[matches[:, 2].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+    else:
+        matches = np.zeros((0, 3))
+
+    n = matches.shape[0] > 0
+    m0, m1, _ = matches.transpose().astype(int)
+    for i, gc in enumerate(gt_classes):
+        j = m0 == i
+        if n and sum(j) == 1:
+            cm.matrix[detection_classes[m1[j]], gc] += 1  # correct
+        else:
+            cm.matrix[cm.nc, gc] += 1  # true background
+
+    if n:
+        for i, dc in enumerate(detection_classes):
+            if not any(m1 == i):
+                cm.matrix[dc, cm.nc] += 1  # predicted background
+
+
+def confusion(images=100, labels=200, dets=300, nc=80):
+    # Time ConfusionMatrix.process_batch() against the loop reference on synthetic images and check identical results
+    batches = [synthetic_batch(labels, dets, nc, seed=i) for i in range(images)]
+    batches += [(None, lb[:, 0]) for _, lb in batches[:images // 10]]  # images without detections
+    results = {}
+    for name, f in ('loop', process_batch_loop), ('vectorized', lambda cm, d, lb: cm.process_batch(d, lb)):
+        cm = ConfusionMatrix(nc=nc)
+        t = time.perf_counter()
+        for d, lb in batches:
+            f(cm, d, lb)
+        results[name] = time.perf_counter() - t, cm.matrix
+    (t0, m0), (t1, m1) = results.values()
+    assert np.array_equal(m0, m1), 'vectorized confusion matrix differs from the loop reference'
+    print(f'ConfusionMatrix.process_batch() {len(batches)} images, {labels} labels, {dets} detections, {nc} classes\n'
+          f'loop:       {t0 / len(batches) * 1E3:8.3f} ms/image\n'
+          f'vectorized: {t1 / len(batches) * 1E3:8.3f} ms/image ({t0 / t1:.1f}x faster), identical results ✅')
+    return t0, t1
+
+
+def synthetic_dataset(path, n=64, shape=(480, 640), labels=8, seed=0):
+    # Write n random JPEG images with YOLO labels to path/images and path/labels, returns the images directory
+    rng = np.random.default_rng(seed)
+    (path / 'images').mkdir(parents=True)
+    (path / 'labels').mkdir()
+    for i in range(n):
+        im = cv2.GaussianBlur(rng.integers(0, 256, (*shape, 3), dtype=np.uint8), (9, 9), 0)  # compressible noise
+        cv2.imwrite(str(path / 'images' / f'{i}.jpg'), im)
+        xy, wh = rng.uniform(0.2, 0.8, (labels, 2)), rng.uniform(0.05, 0.3, (labels, 2))
+        x = np.concatenate((rng.integers(0, 80, (labels, 1)), xy, wh), 1)
+        np.savetxt(path / 'labels' / f'{i}.txt', x, fmt='%g')
+    return path / 'images'
+
+
+def augment(images=64, batch=16, imgsz=640, device=''):
+    # Time per-sample CPU augmentation against --device-augment (dataloader mosaic + BatchAugment) for data/hyps/*.yaml
+    device = select_device(device, batch_size=batch)
+    with tempfile.TemporaryDirectory() as d:
+        path = synthetic_dataset(Path(d), images)
+        rows = []
+        for f in sorted((ROOT / 'data' / 'hyps').glob('hyp.*.yaml')):
+            hyp, t = yaml.safe_load(f.read_text()), []
+            for batch_augment in False, True:
+                dataset = LoadImagesAndLabels(path, imgsz, batch, augment=True, hyp=hyp, cache_images='ram',
+                                              batch_augment=batch_augment)  # RAM cache to exclude decoding
+                aug = BatchAugment(hyp, imgsz) if batch_augment else None
+                random.seed(0)
+                torch.manual_seed(0)
+                t0 = time.perf_counter()
+                for i in range(0, images, batch):
+                    ims, targets, *_ = dataset.collate_fn([dataset[j] for j in range(i, min(i + batch, images))])
+                    ims = ims.to(device, non_blocking=True).float() / 255
+                    if aug:
+                        ims, targets = aug(ims, targets.to(device, non_blocking=True))
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                t.append((time.perf_counter() - t0) / images)
+            rows.append((f.name, *t))
+    print(f'\nAugmented training batches, {images} images, batch {batch}, --imgsz {imgsz}, device {device}\n'
+          f'{"hyp":>24}{"per-sample ms/im":>18}{"batch ms/im":>14}{"speedup":>9}')
+    for name, t0, t1 in rows:
+        print(f'{name:>24}{t0 * 1E3:18.2f}{t1 * 1E3:14.2f}{t0 / t1:8.2f}x')
+    return rows
+
+
+def dataloader(images=256, batch=16, imgsz=640, workers=8, device='', epochs=2):
+    # Train dataloader throughput with models and losses excluded, pinned DataLoader with a blocking transfer and float
+    # conversion per batch, as in train.py before, against DevicePrefetcher
+    device = select_device(device, batch_size=batch)
+    hyp = yaml.safe_load((ROOT / 'data' / 'hyps' / 'hyp.scratch-low.yaml').read_text())
+    with tempfile.TemporaryDirectory() as d:
+        path, rows = synthetic_dataset(Path(d), images), []
+        for name, prefetch in ('DataLoader', False), ('DevicePrefetcher', True):
+            loader = create_dataloader(path, imgsz, batch, 32, hyp=hyp, augment=True, workers=workers, shuffle=True,
+                                       pin_memory=not prefetch)[0]
+            for epoch in range(epochs + 1):  # first epoch warms up workers and caches
+                t0 = time.perf_counter()
+                if prefetch:
+                    for ims, targets, *_ in DevicePrefetcher(loader, device):
+                        ims.sum()  # consume on the default stream
+                else:
+                    for ims, targets, *_ in loader:
+                        ims = ims.to(device, non_blocking=True).float() / 255
+                        targets = targets.to(device)
+                        ims.sum()
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                t = time.perf_counter() - t0
+            rows.append((name, images / t))
+    print(f'\nTrain dataloader, {images} images, batch {batch}, --imgsz {imgsz}, {workers} workers, device {device}')
+    for name, n in rows:
+        print(f'{name:>18}{n:10.1f} images/s')
+    return rows
+
+
+def decode(images=16, imgsz=640, shape=(2160, 3840)):
+    # Full resolution JPEG decodes against imdecode() at a DCT scale for --imgsz, for each available IMREAD_BACKEND on
+    # synthetic 4K JPEGs, both followed by the INTER_AREA resize to --imgsz that dataset loaders apply
+    rng = np.random.default_rng(0)
+    ims = [
+        cv2.imencode('.jpg', cv2.GaussianBlur(rng.integers(0, 256, (*shape, 3), dtype=np.uint8), (9, 9), 0))[1]
+        for _ in range(images)]
+    rows = []
+    for backend in ['cv2', 'pil'] + (['turbojpeg'] if importlib.util.find_spec('turbojpeg') else []):
+        t = []
+        for size in None, imgsz:
+            td = tr = 0
+            for b in ims:
+                t0 = time.perf_counter()
+                im = imdecode(b, size, backend=backend)
+                t1 = time.perf_counter()
+                r = imgsz / max(im.shape[:2])
+                cv2.resize(im, (round(im.shape[1] * r), round(im.shape[0] * r)), interpolation=cv2.INTER_AREA)
+                td, tr = td + t1 - t0, tr + time.perf_counter() - t1
+            t += [td / images, tr / images]
+        rows.append((backend, *t))
+    print(f'\nJPEG decode, {images} images {shape[1]}x{shape[0]}, --imgsz {imgsz}, ms/image\n'
+          f'{"backend":>10}{"full decode":>13}{"resize":>8}{"scaled decode":>15}{"resize":>8}{"speedup":>9}')
+    for name, d0, r0, d1, r1 in rows:
+        print(f'{name:>10}{d0 * 1E3:13.2f}{r0 * 1E3:8.2f}{d1 * 1E3:15.2f}{r1 * 1E3:8.2f}{(d0 + r0) / (d1 + r1):8.2f}x')
+    return rows
+
+
+def parse_opt():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='bench', required=True)
+    p = sub.add_parser('confusion', help='ConfusionMatrix.process_batch()')
+    p.add_argument('--images', type=int, default=100, help='number of synthetic images')
+    p.add_argument('--labels', type=int, default=200, help='labels per image')
+    p.add_argument('--dets', type=int, default=300, help='detections per image')
+    p.add_argument('--nc', type=int, default=80, help='number of classes')
+    p = sub.add_parser('augment', help='per-sample vs batched training augmentation')
+    p.add_argument('--images', type=int, default=64, help='number of synthetic images')
+    p.add_argument('--batch', type=int, default=16, help='batch size')
+    p.add_argument('--imgsz', type=int, default=640, help='train image size (pixels)')
+    p.add_argument('--device', default='', help='cuda device, i.e. 0 or cpu')
+    p = sub.add_parser('dataloader', help='train dataloader throughput with DevicePrefetcher')
+    p.add_argument('--images', type=int, default=256, help='number of synthetic images')
+    p.add_argument('--batch', type=int, default=16, help='batch size')
+    p.add_argument('--imgsz', type=int, default=640, help='train image size (pixels)')
+    p.add_argument('--workers', type=int, default=8, help='max dataloader workers')
+    p.add_argument('--device', default='', help='cuda device, i.e. 0 or cpu')
+    p.add_argument('--epochs', type=int, default=2, help='timed epochs after one warmup epoch')
+    p = sub.add_parser('decode', help='4K JPEG full resolution vs DCT-scaled decodes per IMREAD_BACKEND')
+    p.add_argument('--images', type=int, default=16, help='number of synthetic 4K images')
+    p.add_argument('--imgsz', type=int, default=640, help='target image size (pixels)')
+    return parser.parse_args()
+
+
+def main(opt):
+    bench = vars(opt).pop('bench')
+    {'confusion': confusion, 'augment': augment, 'dataloader': dataloader, 'decode': decode}[bench](**vars(opt))
+
+
+if __name__ == '__main__':
+    main(parse_opt())
@@ -12,10 +12,7 @@ from urllib.error import URLError
 
 import cv2
 import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-import seaborn as sn
 import torch
 from PIL import Image, ImageDraw, ImageFont
 
@@ -189,6 +186,8 @@ def feature_visualization(x, module_type, stage, n=32, save_dir=Path('runs/detec
     n:              Maximum number of feature maps to plot
     save_dir:       Directory to save results
     """
+    import matplotlib.pyplot as plt
+
     if 'Detect' not in module_type:
         batch, channels, height, width = x.shape  # batch, channels, height, width
         if height > 1 and width > 1:
@@ -308,6 +307,8 @@ def plot_images(images, targets, paths=None, fname='images.jpg', names=None):
 
 def plot_lr_scheduler(optimizer, scheduler, epochs=300, save_dir=''):
     # Plot LR simulating training for full epochs
+    import matplotlib.pyplot as plt
+
     optimizer, scheduler = copy(optimizer), copy(scheduler)  # do not modify originals
     y = []
     for _ in range(epochs):
@@ -325,6 +326,8 @@ def plot_lr_scheduler(optimizer, scheduler, epochs=300, save_dir=''):
 
 def plot_val_txt():  # from utils.plots import *; plot_val()
     # Plot val.txt histograms
+    import matplotlib.pyplot as plt
+
     x = np.loadtxt('val.txt', dtype=np.float32)
     box = xyxy2xywh(x[:, :4])
     cx, cy = box[:, 0], box[:, 1]
@@ -342,6 +345,8 @@ def plot_val_txt():  # from utils.plots import *; plot_val()
 
 def plot_targets_txt():  # from utils.plots import *; plot_targets_txt()
     # Plot targets.txt histograms
+    import matplotlib.pyplot as plt
+
     x = np.loadtxt('targets.txt', dtype=np.float32).T
     s = ['x targets', 'y targets', 'width targets', 'height targets']
     fig, ax = plt.subplots(2, 2, figsize=(8, 8), tight_layout=True)
@@ -355,6 +360,8 @@ def plot_targets_txt():  # from utils.plots import *; plot_targets_txt()
 
 def plot_val_study(file='', dir='', x=None):  # from utils.plots import *; plot_val_study()
     # Plot file=study.txt generated by val.py (or plot all study*.txt in dir)
+    import matplotlib.pyplot as plt
+
     save_dir = Path(file).parent if file else Path(dir)
     plot2 = False  # plot additional results
     if plot2:
@@ -399,32 +406,58 @@ def plot_val_study(file='', dir='', x=None):  # from utils.plots import *; plot_
 
 
 @TryExcept()  # known issue https://github.com/ultralytics/yolov5/issues/5395
-def plot_labels(labels, names=(), save_dir=Path('')):
-    # plot dataset labels
-    LOGGER.info(f"Plotting labels to {save_dir / 'labels.jpg'}... ")
-    c, b = labels[:, 0], labels[:, 1:].transpose()  # classes, boxes
-    nc = int(c.max() + 1)  # number of classes
-    x = pd.DataFrame(b.transpose(), columns=['x', 'y', 'width', 'height'])
+def plot_labels(labels, names=(), save_dir=Path(''), stats=None):
+    # plot dataset labels, histograms from utils/audit.py dataset statistics if given
+    import matplotlib.pyplot as plt
+
+    from utils.audit import PAIRS, label_stats
 
-    # seaborn correlogram
-    sn.pairplot(x, corner=True, diag_kind='auto', kind='hist', diag_kws=dict(bins=50), plot_kws=dict(pmax=0.9))
+    LOGGER.info(f"Plotting labels to {save_dir / 'labels.jpg'}... ")
+    if stats is None:
+        stats = label_stats([labels], np.ones((1, 2)))
+    hist, hist2d = stats['hist'], stats['hist2d']
+    nc = len(stats['classes'])  # number of classes
+    edges = np.linspace(0, 1, hist.shape[1] + 1)
+    cols = ['x', 'y', 'width', 'height']
+
+    def heatmap(ax, h):
+        # 2D histogram saturating at its 0.9 quantile of non-empty bins, as seaborn pmax=0.9
+        vmax = np.quantile(h[h > 0], 0.9) if h.any() else 1
+        ax.pcolormesh(edges, edges, h.T, cmap='Blues', vmin=0, vmax=vmax)
+
+    # correlogram
+    ax = plt.subplots(4, 4, figsize=(10, 10), tight_layout=True)[1]
+    pair = {p: k for k, p in enumerate(PAIRS)}
+    for i in range(4):
+        for j in range(4):
+            a = ax[i, j]
+            if j > i:
+                a.axis('off')
+            elif i == j:
+                a.bar(edges[:-1], hist[i], width=edges[1] - edges[0], align='edge', color='#4c72b0')
+            else:
+                heatmap(a, hist2d[pair[j, i]])
+            a.set_xlabel(cols[j] if i == 3 else '')
+            a.set_ylabel(cols[i] if j == 0 and i else '')
     plt.savefig(save_dir / 'labels_correlogram.jpg', dpi=200)
     plt.close()
 
     # matplotlib labels
     matplotlib.use('svg')  # faster
     ax = plt.subplots(2, 2, figsize=(8, 8), tight_layout=True)[1].ravel()
-    y = ax[0].hist(c, bins=np.linspace(0, nc, nc + 1) - 0.5, rwidth=0.8)
+    y = ax[0].bar(range(nc), stats['classes'], width=0.8)
     with contextlib.suppress(Exception):  # color histogram bars by class
-        [y[2].patches[i].set_color([x / 255 for x in colors(i)]) for i in range(nc)]  # known issue #3195
+        [y.patches[i].set_color([x / 255 for x in colors(i)]) for i in range(nc)]  # known issue #3195
     ax[0].set_ylabel('instances')
     if 0 < len(names) < 30:
         ax[0].set_xticks(range(len(names)))
         ax[0].set_xticklabels(list(names.values()), rotation=90, fontsize=10)
     else:
         ax[0].set_xlabel('classes')
-    sn.histplot(x, x='x', y='y', ax=ax[2], bins=50, pmax=0.9)
-    sn.histplot(x, x='width', y='height', ax=ax[3], bins=50, pmax=0.9)
+    for a, (j, k) in zip(ax[2:], [(0, 1), (2, 3)]):
+        heatmap(a, hist2d[pair[j, k]])
+        a.set_xlabel(cols[j])
+        a.set_ylabel(cols[k])
 
     # rectangles
     labels[:, 1:3] = 0.5  # center
@@ -446,6 +479,8 @@ def plot_labels(labels, names=(), save_dir=Path('')):
 
 def imshow_cls(im, labels=None, pred=None, names=None, nmax=25, verbose=False, f=Path('images.jpg')):
     # Show classification image grid with labels (optional) and predictions (optional)
+    import matplotlib.pyplot as plt
+
     from utils.augmentations import denormalize
 
     names = names or [f'class{i}' for i in range(1000)]
@@ -475,6 +510,9 @@ def imshow_cls(im, labels=None, pred=None, names=None, nmax=25, verbose=False, f
 
 def plot_evolve(evolve_csv='path/to/evolve.csv'):  # from utils.plots import *; plot_evolve()
     # Plot evolve.csv hyp evolution results
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
     evolve_csv = Path(evolve_csv)
     data = pd.read_csv(evolve_csv)
     keys = [x.strip() for x in data.columns]
@@ -502,6 +540,9 @@ def plot_evolve(evolve_csv='path/to/evolve.csv'):  # from utils.plots import *;
 
 def plot_results(file='path/to/results.csv', dir=''):
     # Plot training results.csv. Usage: from utils.plots import *; plot_results('path/to/results.csv')
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
     save_dir = Path(file).parent if file else Path(dir)
     fig, ax = plt.subplots(2, 5, figsize=(12, 6), tight_layout=True)
     ax = ax.ravel()
@@ -528,6 +569,8 @@ def plot_results(file='path/to/results.csv', dir=''):
 
 def profile_idetection(start=0, stop=0, labels=(), save_dir=''):
     # Plot iDetection '*.txt' per-image logs. from utils.plots import *; profile_idetection()
+    import matplotlib.pyplot as plt
+
     ax = plt.subplots(2, 4, figsize=(12, 6), tight_layout=True)[1].ravel()
     s = ['Images', 'Free Storage (GB)', 'RAM Usage (GB)', 'Battery', 'dt_raw (ms)', 'dt_smooth (ms)', 'real-world FPS']
     files = list(Path(save_dir).glob('frames*.txt'))
@@ -0,0 +1,139 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+NumPy post-processing for non-PyTorch backends (ONNX Runtime, OpenCV DNN, OpenVINO, TensorFlow, TFLite, PaddlePaddle)
+
+This module only depends on NumPy so edge deployments can run NMS without importing torch.
+
+Usage:
+    from models.common import DetectMultiBackend
+    from utils.postprocess import non_max_suppression, scale_boxes
+
+    model = DetectMultiBackend('yolov5s.onnx', numpy=True)  # outputs stay np.ndarray
+    pred = non_max_suppression(model(im), conf_thres=0.25, iou_thres=0.45)
+    for det in pred:
+        det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
+"""
+
+import numpy as np
+
+
+def xywh2xyxy(x):
+    # Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right
+    y = np.copy(x)
+    y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
+    y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
+    y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
+    y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
+    return y
+
+
+def nms(boxes, scores, iou_thres=0.45, max_det=300):
+    # Greedy NMS on (n,4) xyxy boxes, returns at most max_det indices sorted by decreasing score (torchvision.ops.nms)
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    with np.errstate(divide='ignore', invalid='ignore'):  # zero-area boxes are never suppressed, as in torchvision
+        while order.size and len(keep) < max_det:
+            i, rest = order[0], order[1:]
+            keep.append(i)
+            w = (np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])).clip(0)
+            h = (np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])).clip(0)
+            inter = w * h
+            iou = inter / (areas[i] + areas[rest] - inter)
+            order = rest[~(iou > iou_thres)]
+    return np.array(keep, dtype=np.int64)
+
+
+def non_max_suppression(
+        prediction,
+        conf_thres=0.25,
+        iou_thres=0.45,
+        classes=None,
+        agnostic=False,
+        multi_label=False,
+        max_det=300,
+        nm=0,  # number of masks
+):
+    """NumPy Non-Maximum Suppression (NMS) on inference results, mirrors utils.general.non_max_suppression()
+
+    Returns:
+         list of detections, on (n,6) array per image [xyxy, conf, cls]
+    """
+
+    if isinstance(prediction, (list, tuple)):  # segmentation models output (pred, proto)
+        prediction = prediction[0]  # select only inference output
+
+    bs = prediction.shape[0]  # batch size
+    nc = prediction.shape[2] - nm - 5  # number of classes
+    xc = prediction[..., 4] > conf_thres  # candidates
+
+    # Checks
+    assert 0 <= conf_thres <= 1, f'Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0'
+    assert 0 <= iou_thres <= 1, f'Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0'
+
+    # Settings
+    max_wh = 7680  # (pixels) maximum box width and height
+    max_nms = 30000  # maximum number of boxes into nms()
+    multi_label &= nc > 1  # multiple labels per box
+
+    mi = 5 + nc  # mask start index
+    output = [np.zeros((0, 6 + nm), dtype=np.float32)] * bs
+    for xi, x in enumerate(prediction):  # image index, image inference
+        x = x[xc[xi]].astype(np.float32)  # confidence
+        if not x.shape[0]:
+            continue
+
+        # Compute conf
+        x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+
+        # Box/Mask
+        box = xywh2xyxy(x[:, :4])  # center_x, center_y, width, height) to (x1, y1, x2, y2)
+        mask = x[:, mi:]  # zero columns if no masks
+
+        # Detections matrix nx6 (xyxy, conf, cls)
+        if multi_label:
+            i, j = (x[:, 5:mi] > conf_thres).nonzero()
+            x = np.concatenate((box[i], x[i, 5 + j, None], j[:, None].astype(np.float32), mask[i]), 1)
+        else:  # best class only
+            j = x[:, 5:mi].argmax(1)
+            conf = x[np.arange(len(x)), 5 + j]
+            x = np.concatenate((box, conf[:, None], j[:, None].astype(np.float32), mask), 1)[conf > conf_thres]
+
+        # Filter by class
+        if classes is not None:
+            x = x[(x[:, 5:6] == np.array(classes)).any(1)]
+
+        # Check shape
+        if not x.shape[0]:  # no boxes
+            continue
+        x = x[x[:, 4].argsort()[::-1][:max_nms]]  # sort by confidence and remove excess boxes
+
+        # Batched NMS
+        c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
+        i = nms(x[:, :4] + c, x[:, 4], iou_thres, max_det)  # boxes (offset by class), scores
+        output[xi] = x[i]
+
+    return output
+
+
+def clip_boxes(boxes, shape):
+    # Clip boxes (xyxy) to image shape (height, width)
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])  # x1, x2
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])  # y1, y2
+
+
+def scale_boxes(img1_shape, boxes, img0_shape, ratio_pad=None):
+    # Rescale boxes (xyxy) from img1_shape to img0_shape
+    if ratio_pad is None:  # calculate from img0_shape
+        gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])  # gain  = old / new
+        pad = (img1_shape[1] - img0_shape[1] * gain) / 2, (img1_shape[0] - img0_shape[0] * gain) / 2  # wh padding
+    else:
+        gain = ratio_pad[0][0]
+        pad = ratio_pad[1]
+
+    boxes[:, [0, 2]] -= pad[0]  # x padding
+    boxes[:, [1, 3]] -= pad[1]  # y padding
+    boxes[:, :4] /= gain
+    clip_boxes(boxes, img0_shape)
+    return boxes
@@ -0,0 +1,80 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Offline model registry, loads YOLOv5 models from the local checkout without torch.hub or network access
+
+Built models are fused and serialized to a warm cache keyed by the weights file hash, so later starts unpickle the
+ready-to-run model instead of rebuilding it. Set YOLOv5_MODEL_CACHE to change the cache directory.
+
+Usage:
+    from utils.registry import load_model
+    model = load_model('weights/yolov5s.pt')  # AutoShape model
+    model = load_model('yolov5s')  # resolves yolov5s.pt in the repo root or weights/
+"""
+
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import torch
+
+from utils.general import CONFIG_DIR, LOGGER, ROOT
+from utils.torch_utils import select_device
+
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH for hubconf
+
+CACHE_DIR = Path(os.getenv('YOLOv5_MODEL_CACHE', CONFIG_DIR / 'models'))  # serialized model cache directory
+SOURCES = [ROOT / 'models' / f for f in ('common.py', 'experimental.py', 'yolo.py')]  # pickled models depend on these
+
+
+def resolve(name):
+    # Resolve a model name or path to a local weights file, never downloads
+    p = Path(name)
+    p = p.with_suffix('.pt') if p.suffix == '' and not p.is_dir() else p
+    for f in p, ROOT / p, ROOT / 'weights' / p.name:
+        if f.exists():
+            return f.resolve()
+    raise FileNotFoundError(f'{name} not found locally, copy it to {ROOT / "weights"} for offline loading')
+
+
+def file_hash(file, chunk=1 << 20):
+    # Return the SHA-256 hex digest of a file
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for b in iter(lambda: f.read(chunk), b''):
+            h.update(b)
+    return h.hexdigest()
+
+
+def cached(weights, build, tag='', cache_dir=CACHE_DIR):
+    # Return build(weights), served from a serialized cache keyed by weights hash, tag, sources and torch version
+    weights = Path(weights)
+    h = [file_hash(f) for f in (weights, *SOURCES) if f.is_file()]
+    key = hashlib.sha256(''.join((*h, tag, torch.__version__)).encode()).hexdigest()[:16]
+    f = Path(cache_dir) / f'{weights.stem}-{key}.pt'
+    if f.is_file():
+        try:
+            return torch.load(f)
+        except Exception as e:
+            LOGGER.warning(f'WARNING ⚠️ model cache {f} is unreadable, rebuilding: {e}')
+
+    model = build(weights)
+    try:
+        f.parent.mkdir(parents=True, exist_ok=True)
+        tmp = f.with_suffix(f'.{os.getpid()}.tmp')
+        torch.save(model, tmp)
+        os.replace(tmp, f)  # atomic, concurrent processes never read a partial file
+    except Exception as e:
+        LOGGER.warning(f'WARNING ⚠️ model cache {f} is not writeable: {e}')
+    return model
+
+
+def load_model(name='yolov5s.pt', device='', autoshape=True, cache=True):
+    # Load a local YOLOv5 model through hubconf._create(), warm-started from the fused model cache
+    from hubconf import _create  # scoped, hubconf lives in ROOT
+
+    w = resolve(name)
+    device = select_device(device)
+    build = lambda w: _create(str(w), autoshape=autoshape, verbose=False, device=device)  # noqa: E731
+    return cached(w, build, tag=f'{device}-{autoshape}') if cache else build(w)
@@ -3,9 +3,7 @@ import math
 from pathlib import Path
 
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import torch
 
 from .. import threaded
@@ -110,6 +108,9 @@ def plot_images_and_masks(images, targets, masks, paths=None, fname='images.jpg'
 
 def plot_results_with_masks(file="path/to/results.csv", dir="", best=True):
     # Plot training results.csv. Usage: from utils.plots import *; plot_results('path/to/results.csv')
+    import matplotlib.pyplot as plt
+    import pandas as pd
+
     save_dir = Path(file).parent if file else Path(dir)
     fig, ax = plt.subplots(2, 8, figsize=(18, 6), tight_layout=True)
     ax = ax.ravel()
@@ -88,11 +88,12 @@ def reshape_classifier_output(model, n=1000):
 @contextmanager
 def torch_distributed_zero_first(local_rank: int):
     # Decorator to make all processes in distributed training wait for each local_master to do something
+    nccl = local_rank != -1 and dist.get_backend() == 'nccl'  # device_ids is NCCL-only, gloo runs CPU validation shards
     if local_rank not in [-1, 0]:
-        dist.barrier(device_ids=[local_rank])
+        dist.barrier(device_ids=[local_rank] if nccl else None)
     yield
     if local_rank == 0:
-        dist.barrier(device_ids=[0])
+        dist.barrier(device_ids=[0] if nccl else None)
 
 
 def device_count():
@@ -0,0 +1,207 @@
+# YOLOv5 🚀 by Ultralytics, GPL-3.0 license
+"""
+Multi-process CPU inference, N DetectMultiBackend replicas each pinned to its own subset of cores
+
+One process with default intra-op threading scales poorly past ~8 cores. InferencePool splits the available cores into
+contiguous groups (neighbouring cores usually share a socket and cache), runs one model replica per group with matching
+intra-op threads, and hands uint8 BCHW batches to the replicas through per-worker shared-memory buffers. Each replica
+also runs NMS, so only the small detection arrays travel back over a queue.
+
+Usage:
+    from utils.workers import InferencePool
+
+    pool = InferencePool('yolov5s.pt', workers=4, imgsz=(640, 640), conf_thres=0.25)
+    pred = pool(im)  # im uint8 numpy (b,3,h,w) or (3,h,w), returns list of (n,6) tensors
+    for (path, im, im0s, vid_cap, s), pred in pool.imap(dataset):  # pipelined, in input order
+        ...
+    pool.close()
+"""
+
+import itertools
+import os
+import queue
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing import get_context, shared_memory
+from threading import Lock, Thread
+
+import numpy as np
+import torch
+
+from utils.general import LOGGER, non_max_suppression
+
+
+def cpu_groups(n):
+    # Split the CPUs this process may run on into n contiguous groups
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count() or 1))
+    return [x.tolist() for x in np.array_split(cores, min(n, len(cores)))]
+
+
+def _worker(rank, weights, cores, threads, shm_name, tasks, results, model_kwargs, nms_kwargs):
+    # Worker process, pins itself to cores and serves (job, shape) tasks from its shared-memory buffer
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    shm = shared_memory.SharedMemory(name=shm_name)  # the parent owns and unlinks it
+    try:
+        from models.common import DetectMultiBackend
+        model = DetectMultiBackend(weights, device=torch.device('cpu'), **model_kwargs)
+        buf = np.ndarray((shm.size,), dtype=np.uint8, buffer=shm.buf)
+        results.put((None, rank, None, None))  # ready
+    except Exception as e:
+        results.put((None, rank, None, repr(e)))
+        shm.close()
+        return
+
+    with torch.inference_mode():
+        for job, shape in iter(tasks.get, None):
+            try:
+                im = torch.from_numpy(buf[:np.prod(shape)].reshape(shape))
+                im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32, copies out of shared memory
+                im /= 255  # 0 - 255 to 0.0 - 1.0
+                pred = non_max_suppression(model(im), **nms_kwargs)
+                results.put((job, rank, [x.numpy() for x in pred], None))
+            except Exception as e:
+                results.put((job, rank, None, repr(e)))
+    del buf
+    shm.close()
+
+
+class InferencePool:
+    # Pool of pinned CPU model replicas fed through shared memory
+    def __init__(self,
+                 weights,
+                 workers=2,
+                 threads=0,
+                 imgsz=(640, 640),
+                 batch_size=1,
+                 conf_thres=0.25,
+                 iou_thres=0.45,
+                 classes=None,
+                 agnostic=False,
+                 max_det=1000,
+                 **model_kwargs):
+        groups = cpu_groups(workers)
+        self.workers = len(groups)
+        size = batch_size * 3 * imgsz[0] * imgsz[1]  # largest uint8 input batch
+        nms_kwargs = dict(conf_thres=conf_thres,
+                          iou_thres=iou_thres,
+                          classes=classes,
+                          agnostic=agnostic,
+                          max_det=max_det)
+        model_kwargs.setdefault('cache', True)  # replicas share the fused model cache
+
+        ctx = get_context('spawn')  # fresh interpreters, no forked torch thread pools
+        self.shms = [shared_memory.SharedMemory(create=True, size=size) for _ in groups]
+        self.bufs = [np.ndarray((size,), dtype=np.uint8, buffer=x.buf) for x in self.shms]
+        self.tasks = [ctx.Queue() for _ in groups]
+        self.results = ctx.Queue()
+        self.procs = [
+            ctx.Process(target=_worker,
+                        args=(i, weights, g, threads or len(g), shm.name, t, self.results, model_kwargs, nms_kwargs),
+                        daemon=True) for i, (g, shm, t) in enumerate(zip(groups, self.shms, self.tasks))]
+        for p in self.procs:
+            p.start()
+        ready, errors = set(), []
+        while len(ready) < self.workers and not errors:
+            try:
+                _, rank, _, e = self.results.get(timeout=1)
+            except queue.Empty:  # a replica killed while loading (OOM, segfault) never replies
+                errors = [f'worker {i} exited with code {p.exitcode}' for i, p in enumerate(self.procs) if p.exitcode]
+                continue
+            ready.add(rank)
+            if e:
+                errors.append(e)
+        if errors:
+            self.close()
+            raise RuntimeError(f'InferencePool worker failed to start: {errors[0]}')
+        LOGGER.info(f'InferencePool: {self.workers} workers on cores {groups}')
+
+        self.free = queue.Queue()  # idle worker ranks
+        for i in range(self.workers):
+            self.free.put(i)
+        self.jobs = {}  # job id: Future
+        self.running = [None] * self.workers  # job id per worker rank
+        self.count = itertools.count()
+        self.lock = Lock()
+        self.thread = Thread(target=self._collect, daemon=True)
+        self.thread.start()
+
+    def _collect(self):
+        # Resolve futures as workers finish, then mark the worker idle again
+        while True:
+            try:
+                x = self.results.get(timeout=1)
+            except queue.Empty:
+                self._reap()
+                continue
+            if x is None:  # close()
+                return
+            job, rank, pred, error = x
+            with self.lock:
+                future = self.jobs.pop(job, None)
+                self.running[rank] = None
+            if future is None:  # already failed by _reap()
+                continue
+            self.free.put(rank)
+            if error:
+                future.set_exception(RuntimeError(f'InferencePool worker {rank}: {error}'))
+            else:
+                future.set_result([torch.from_numpy(x) for x in pred])
+
+    def _reap(self):
+        # Fail the pending futures of workers that died without replying (OOM kill, segfault), they are not reused
+        with self.lock:
+            dead = [(i, self.jobs.pop(j)) for i, j in enumerate(self.running)
+                    if j is not None and self.procs[i].exitcode]
+            for i, _ in dead:
+                self.running[i] = None
+        for i, future in dead:
+            future.set_exception(RuntimeError(f'InferencePool worker {i} exited with code {self.procs[i].exitcode}'))
+
+    def submit(self, im):
+        # Copy a uint8 (b,3,h,w) or (3,h,w) batch to an idle worker, returns a Future of per-image detections
+        im = np.ascontiguousarray(im[None] if im.ndim == 3 else im)
+        n = self.bufs[0].size
+        assert im.size <= n, f'input {im.shape} exceeds InferencePool buffer of {n} bytes'
+        while True:  # blocks while all workers are busy
+            try:
+                rank = self.free.get(timeout=1)
+                break
+            except queue.Empty:
+                if not any(p.is_alive() for p in self.procs):
+                    raise RuntimeError('InferencePool: all workers exited')
+        self.bufs[rank][:im.size] = im.reshape(-1)
+        future, job = Future(), next(self.count)
+        with self.lock:
+            self.jobs[job] = future
+            self.running[rank] = job
+        self.tasks[rank].put((job, im.shape))
+        return future
+
+    def __call__(self, im):
+        return self.submit(im).result()
+
+    def imap(self, iterable, fn=lambda x: x[1]):
+        # Yield (item, pred) in input order, keeping every worker busy, fn(item) returns the uint8 input batch
+        pending = deque()
+        for x in iterable:
+            pending.append((x, self.submit(fn(x))))
+            while pending and (pending[0][1].done() or len(pending) > 2 * self.workers):
+                x, f = pending.popleft()
+                yield x, f.result()
+        for x, f in pending:
+            yield x, f.result()
+
+    def close(self):
+        for t in self.tasks:
+            t.put(None)
+        for p in self.procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self.results.put(None)  # stop collector
+        self.bufs = []  # release views before closing shared memory
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
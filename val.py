@@ -4,6 +4,8 @@ Validate a trained YOLOv5 detection model on a detection dataset
 
 Usage:
     $ python val.py --weights yolov5s.pt --data coco128.yaml --img 640
+    $ python val.py --weights yolov5s.pt --data coco128.yaml --img 640 --shards 4            # 4 CPU processes
+    $ python -m torch.distributed.run --nproc_per_node 2 val.py --weights yolov5s.pt --data coco128.yaml  # DDP
 
 Usage - formats:
     $ python val.py --weights yolov5s.pt                 # PyTorch
@@ -22,11 +24,14 @@ Usage - formats:
 import argparse
 import json
 import os
+import socket
 import sys
+from multiprocessing import get_context
 from pathlib import Path
 
 import numpy as np
 import torch
+import torch.distributed as dist
 from tqdm import tqdm
 
 FILE = Path(__file__).resolve()
@@ -37,13 +42,16 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
 from utils.callbacks import Callbacks
-from utils.dataloaders import create_dataloader
+from utils.dataloaders import DevicePrefetcher, create_dataloader
 from utils.general import (LOGGER, TQDM_BAR_FORMAT, Profile, check_dataset, check_img_size, check_requirements,
                            check_yaml, coco80_to_coco91_class, colorstr, increment_path, non_max_suppression,
                            print_args, scale_boxes, xywh2xyxy, xyxy2xywh)
-from utils.metrics import ConfusionMatrix, ap_per_class, box_iou
+from utils.metrics import APAccumulator, APStats, ConfusionMatrix, box_iou
 from utils.plots import output_to_target, plot_images, plot_val_study
 from utils.torch_utils import select_device, smart_inference_mode
+from utils.workers import cpu_groups
+
+LOCAL_RANK = int(os.getenv('LOCAL_RANK', -1))  # https://pytorch.org/docs/stable/elastic/run.html
 
 
 def save_one_txt(predn, save_conf, shape, file):
@@ -118,6 +126,8 @@ def run(
         exist_ok=False,  # existing project/name ok, do not increment
         half=True,  # use FP16 half-precision inference
         dnn=False,  # use OpenCV DNN for ONNX inference
+        interval=0,  # log partial mAP every interval batches, 0 to disable
+        binned_ap=False,  # bounded-memory AP over confidence bins, approximate
         model=None,
         dataloader=None,
         save_dir=Path(''),
@@ -125,17 +135,26 @@ def run(
         callbacks=Callbacks(),
         compute_loss=None,
 ):
-    # Initialize/load model and set device
+    # Initialize/load model and set device, with an initialized process group every rank validates its own shard
     training = model is not None
+    rank, world = (dist.get_rank(), dist.get_world_size()) if dist.is_available() and dist.is_initialized() else (-1, 1)
+    lead = rank in {-1, 0}  # prints, plots and saves
     if training:  # called by train.py
         device, pt, jit, engine = next(model.parameters()).device, True, False, False  # get model device, PyTorch model
         half &= device.type != 'cpu'  # half precision only supported on CUDA
         model.half() if half else model.float()
     else:  # called directly
-        device = select_device(device, batch_size=batch_size)
+        if LOCAL_RANK != -1 and device != 'cpu' and torch.cuda.is_available():  # torchrun DDP
+            device = torch.device('cuda', LOCAL_RANK)
+        else:
+            device = select_device(device, batch_size=batch_size)
 
         # Directories
         save_dir = increment_path(Path(project) / name, exist_ok=exist_ok)  # increment run
+        if world > 1:
+            x = [save_dir]
+            dist.broadcast_object_list(x, 0)  # same directory for all shards
+            save_dir = x[0]
         (save_dir / 'labels' if save_txt else save_dir).mkdir(parents=True, exist_ok=True)  # make dir
 
         # Load model
@@ -156,7 +175,6 @@ def run(
 
     # Configure
     model.eval()
-    cuda = device.type != 'cpu'
     is_coco = isinstance(data.get('val'), str) and data['val'].endswith(f'coco{os.sep}val2017.txt')  # COCO dataset
     nc = 1 if single_cls else int(data['nc'])  # number of classes
     iouv = torch.linspace(0.5, 0.95, 10, device=device)  # iou vector for mAP@0.5:0.95
@@ -178,8 +196,11 @@ def run(
                                        single_cls,
                                        pad=pad,
                                        rect=rect,
+                                       rank=rank,
                                        workers=workers,
-                                       prefix=colorstr(f'{task}: '))[0]
+                                       prefix=colorstr(f'{task}: '),
+                                       shard=world > 1,
+                                       pin_memory=False)[0]
 
     seen = 0
     confusion_matrix = ConfusionMatrix(nc=nc)
@@ -191,17 +212,15 @@ def run(
     tp, fp, p, r, f1, mp, mr, map50, ap50, map = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
     dt = Profile(), Profile(), Profile()  # profiling times
     loss = torch.zeros(3, device=device)
-    jdict, stats, ap, ap_class = [], [], [], []
+    jdict, ap, ap_class = [], [], []
+    stats = (APAccumulator if binned_ap else APStats)(nc, niou, device=device)  # binned histograms or exact arrays
     callbacks.run('on_val_start')
-    pbar = tqdm(dataloader, desc=s, bar_format=TQDM_BAR_FORMAT)  # progress bar
-    for batch_i, (im, targets, paths, shapes) in enumerate(pbar):
+    batches = iter(DevicePrefetcher(dataloader, device, half))  # images on device, fp16/32 0.0 - 1.0
+    pbar = tqdm(range(len(dataloader)), desc=s, bar_format=TQDM_BAR_FORMAT, disable=not lead)  # progress bar
+    for batch_i in pbar:
         callbacks.run('on_val_batch_start')
         with dt[0]:
-            if cuda:
-                im = im.to(device, non_blocking=True)
-                targets = targets.to(device)
-            im = im.half() if half else im.float()  # uint8 to fp16/32
-            im /= 255  # 0 - 255 to 0.0 - 1.0
+            im, targets, paths, shapes = next(batches)  # waits for the batch and its transfer
             nb, _, height, width = im.shape  # batch size, channels, height, width
 
         # Inference
@@ -222,7 +241,8 @@ def run(
                                         labels=lb,
                                         multi_label=True,
                                         agnostic=single_cls,
-                                        max_det=max_det)
+                                        max_det=max_det,
+                                        batched=True)
 
         # Metrics
         for si, pred in enumerate(preds):
@@ -234,7 +254,7 @@ def run(
 
             if npr == 0:
                 if nl:
-                    stats.append((correct, *torch.zeros((2, 0), device=device), labels[:, 0]))
+                    stats.update(correct, *torch.zeros((2, 0), device=device), labels[:, 0])
                     if plots:
                         confusion_matrix.process_batch(detections=None, labels=labels[:, 0])
                 continue
@@ -253,7 +273,7 @@ def run(
                 correct = process_batch(predn, labelsn, iouv)
                 if plots:
                     confusion_matrix.process_batch(predn, labelsn)
-            stats.append((correct, pred[:, 4], pred[:, 5], labels[:, 0]))  # (correct, conf, pcls, tcls)
+            stats.update(correct, pred[:, 4], pred[:, 5], labels[:, 0])  # (correct, conf, pcls, tcls)
 
             # Save/log
             if save_txt:
@@ -263,19 +283,40 @@ def run(
             callbacks.run('on_val_image_end', pred, predn, path, names, im[si])
 
         # Plot images
-        if plots and batch_i < 3:
+        if plots and lead and batch_i < 3:
             plot_images(im, targets, paths, save_dir / f'val_batch{batch_i}_labels.jpg', names)  # labels
             plot_images(im, output_to_target(preds), paths, save_dir / f'val_batch{batch_i}_pred.jpg', names)  # pred
 
         callbacks.run('on_val_batch_end', batch_i, im, targets, paths, shapes, preds)
 
+        # Partial results
+        if interval and world == 1 and (batch_i + 1) % interval == 0 and stats.any():
+            ap = stats.compute()[5]
+            LOGGER.info(f'\n{seen} images: mAP50 {ap[:, 0].mean():.3g}, mAP50-95 {ap.mean():.3g}')
+
+    # Merge shards
+    t = tuple(x.t / max(seen, 1) * 1E3 for x in dt)  # speeds per image
+    nb = len(dataloader)  # number of batches
+    if world > 1:  # sum metrics over all ranks, counts are exact so results match a single process
+        stats.all_reduce()
+        x = torch.tensor([seen, nb], device=device)
+        dist.all_reduce(x)
+        seen, nb = x.tolist()
+        dist.all_reduce(loss)
+        x = torch.from_numpy(confusion_matrix.matrix).to(device)
+        dist.all_reduce(x)
+        confusion_matrix.matrix = x.cpu().numpy()
+        if save_json:
+            x = [None] * world
+            dist.all_gather_object(x, jdict)
+            jdict = sum(x, [])
+
     # Compute metrics
-    stats = [torch.cat(x, 0).cpu().numpy() for x in zip(*stats)]  # to numpy
-    if len(stats) and stats[0].any():
-        tp, fp, p, r, f1, ap, ap_class = ap_per_class(*stats, plot=plots, save_dir=save_dir, names=names)
+    if stats.any():
+        tp, fp, p, r, f1, ap, ap_class = stats.compute(plot=plots and lead, save_dir=save_dir, names=names)
         ap50, ap = ap[:, 0], ap.mean(1)  # AP@0.5, AP@0.5:0.95
         mp, mr, map50, map = p.mean(), r.mean(), ap50.mean(), ap.mean()
-    nt = np.bincount(stats[3].astype(int), minlength=nc)  # number of targets per class
+    nt = stats.nt.cpu().numpy()  # number of targets per class
 
     # Print results
     pf = '%22s' + '%11i' * 2 + '%11.3g' * 4  # print format
@@ -284,23 +325,22 @@ def run(
         LOGGER.warning(f'WARNING ⚠️ no labels found in {task} set, can not compute metrics without labels')
 
     # Print results per class
-    if (verbose or (nc < 50 and not training)) and nc > 1 and len(stats):
+    if (verbose or (nc < 50 and not training)) and nc > 1 and len(ap_class):
         for i, c in enumerate(ap_class):
             LOGGER.info(pf % (names[c], seen, nt[c], p[i], r[i], ap50[i], ap[i]))
 
     # Print speeds
-    t = tuple(x.t / seen * 1E3 for x in dt)  # speeds per image
     if not training:
         shape = (batch_size, 3, imgsz, imgsz)
         LOGGER.info(f'Speed: %.1fms pre-process, %.1fms inference, %.1fms NMS per image at shape {shape}' % t)
 
     # Plots
-    if plots:
+    if plots and lead:
         confusion_matrix.plot(save_dir=save_dir, names=list(names.values()))
         callbacks.run('on_val_end', nt, tp, fp, p, r, f1, ap, ap50, ap_class, confusion_matrix)
 
     # Save JSON
-    if save_json and len(jdict):
+    if save_json and lead and len(jdict):
         w = Path(weights[0] if isinstance(weights, list) else weights).stem if weights is not None else ''  # weights
         anno_json = str(Path(data.get('path', '../coco')) / 'annotations/instances_val2017.json')  # annotations json
         pred_json = str(save_dir / f"{w}_predictions.json")  # predictions json
@@ -333,7 +373,42 @@ def run(
     maps = np.zeros(nc) + map
     for i, c in enumerate(ap_class):
         maps[c] = ap[i]
-    return (mp, mr, map50, map, *(loss.cpu() / len(dataloader)).tolist()), maps, t
+    return (mp, mr, map50, map, *(loss.cpu() / nb).tolist()), maps, t
+
+
+def run_shard(cores, kwargs):
+    # CPU validation shard process, pinned to cores, joins the gloo process group set up by run_sharded() via env://
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    dist.init_process_group('gloo')
+    try:
+        run(**kwargs)
+    finally:
+        dist.destroy_process_group()
+
+
+def run_sharded(shards=2, **kwargs):
+    # Validate on CPU in shards processes, each pinned to its own core group, metrics are summed with all_reduce
+    groups = cpu_groups(shards)
+    groups = [groups[i % len(groups)] for i in range(shards)]  # share cores if there are more shards than CPUs
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]  # free port
+    env = os.environ.copy()
+    os.environ.update(MASTER_ADDR='127.0.0.1', MASTER_PORT=str(port), WORLD_SIZE=str(len(groups)))
+    procs = []
+    try:
+        for i, g in enumerate(groups):
+            os.environ['RANK'] = os.environ['LOCAL_RANK'] = str(i)  # read by dist and logging in the spawned process
+            procs.append(get_context('spawn').Process(target=run_shard, args=(g, {**kwargs, 'device': 'cpu'})))
+            procs[-1].start()
+    finally:
+        os.environ.clear()
+        os.environ.update(env)
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs), f'validation shard failed, exit codes {[p.exitcode for p in procs]}'
 
 
 def parse_opt():
@@ -360,6 +435,9 @@ def parse_opt():
     parser.add_argument('--exist-ok', action='store_true', help='existing project/name ok, do not increment')
     parser.add_argument('--half', action='store_true', help='use FP16 half-precision inference')
     parser.add_argument('--dnn', action='store_true', help='use OpenCV DNN for ONNX inference')
+    parser.add_argument('--interval', type=int, default=0, help='log partial mAP every N batches, 0 to disable')
+    parser.add_argument('--shards', type=int, default=1, help='CPU validation processes, each on its own cores')
+    parser.add_argument('--binned-ap', action='store_true', help='bounded-memory approximate AP over 1000 conf bins')
     opt = parser.parse_args()
     opt.data = check_yaml(opt.data)  # check YAML
     opt.save_json |= opt.data.endswith('coco.yaml')
@@ -370,13 +448,19 @@ def parse_opt():
 
 def main(opt):
     check_requirements(exclude=('tensorboard', 'thop'))
+    shards = vars(opt).pop('shards')
+    if LOCAL_RANK != -1:  # torchrun DDP, i.e. python -m torch.distributed.run --nproc_per_node 2 val.py
+        cuda = torch.cuda.is_available() and opt.device != 'cpu'
+        if cuda:
+            torch.cuda.set_device(LOCAL_RANK)
+        dist.init_process_group(backend='nccl' if cuda and dist.is_nccl_available() else 'gloo')
 
     if opt.task in ('train', 'val', 'test'):  # run normally
         if opt.conf_thres > 0.001:  # https://github.com/ultralytics/yolov5/issues/1466
             LOGGER.info(f'WARNING ⚠️ confidence threshold {opt.conf_thres} > 0.001 produces invalid results')
         if opt.save_hybrid:
             LOGGER.info('WARNING ⚠️ --save-hybrid will return high mAP from hybrid labels, not from predictions alone')
-        run(**vars(opt))
+        run_sharded(shards, **vars(opt)) if shards > 1 and LOCAL_RANK == -1 else run(**vars(opt))
 
     else:
         weights = opt.weights if isinstance(opt.weights, list) else [opt.weights]